@@ -65,5 +65,8 @@ setup(
         'pytest11': [
             'pytest_ranking = pytest_ranking.plugin',
         ],
+        'console_scripts': [
+            'pytest-ranking = pytest_ranking.cli:main',
+        ],
     },
 )
@@ -0,0 +1,3 @@
+from .features import FeatureProvider
+
+__all__ = ["FeatureProvider"]
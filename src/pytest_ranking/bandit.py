@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Weight kept from previous observations at each update,
+# so that the posteriors follow shifting failure patterns.
+DECAY = 0.9
+
+
+class ThompsonSampler:
+    """Multi-armed bandit over tests via Thompson sampling.
+    Each test is an arm whose reward is revealing a failure,
+    with a Beta(alpha, beta) posterior of its failure probability.
+    """
+    def __init__(self, state: dict) -> None:
+        self.nodeids = list(state.get("nodeids", []))
+        self.index = {nodeid: i for i, nodeid in enumerate(self.nodeids)}
+        self.alpha = np.array(state.get("alpha", []), dtype=float)
+        self.beta = np.array(state.get("beta", []), dtype=float)
+        self.num_updates = state.get("num_updates", 0)
+
+    def to_dict(self) -> dict:
+        return {
+            "nodeids": self.nodeids,
+            "alpha": self.alpha.round(4).tolist(),
+            "beta": self.beta.round(4).tolist(),
+            "num_updates": self.num_updates,
+        }
+
+    def get_arms(self, nodeids: list[str]) -> np.ndarray:
+        """Get arm index per test, unseen tests are added with prior (1, 1).
+        """
+        new_nodeids = [
+            x for x in dict.fromkeys(nodeids) if x not in self.index
+        ]
+        if new_nodeids:
+            for nodeid in new_nodeids:
+                self.index[nodeid] = len(self.nodeids)
+                self.nodeids.append(nodeid)
+            prior = np.ones(len(new_nodeids))
+            self.alpha = np.concatenate([self.alpha, prior])
+            self.beta = np.concatenate([self.beta, prior])
+        return np.array([self.index[x] for x in nodeids], dtype=int)
+
+    def sample(self, nodeids: list[str], seed: int) -> np.ndarray:
+        """Sample failure probability per test.
+        Samples only depend on the seed, the test set and the posteriors,
+        so that all pytest-xdist workers get the same samples.
+        """
+        order = sorted(range(len(nodeids)), key=lambda i: nodeids[i])
+        arms = self.get_arms([nodeids[i] for i in order])
+        rng = np.random.default_rng([seed, self.num_updates])
+        samples = np.empty(len(nodeids))
+        samples[order] = rng.beta(self.alpha[arms], self.beta[arms])
+        return samples
+
+    def update(self, nodeids: list[str], failed: np.ndarray) -> None:
+        """Update posteriors with outcomes of tests in execution order.
+        A failure is a reward. A pass is a penalty, increased by the share
+        of failures it delayed, so that early failures are rewarded.
+        """
+        if len(nodeids) == 0:
+            return
+        arms = self.get_arms(nodeids)
+        failed = failed.astype(float)
+        num_fail = failed.sum()
+        # Number of failures executed after each test.
+        fails_after = num_fail - np.cumsum(failed)
+        delayed = fails_after / num_fail if num_fail else np.zeros(len(arms))
+        reward = failed
+        penalty = (1 - failed) * (1 + delayed)
+        # Decay towards the prior before adding new observations.
+        self.alpha[arms] = 1 + DECAY * (self.alpha[arms] - 1)
+        self.beta[arms] = 1 + DECAY * (self.beta[arms] - 1)
+        np.add.at(self.alpha, arms, reward)
+        np.add.at(self.beta, arms, penalty)
+        self.num_updates += 1
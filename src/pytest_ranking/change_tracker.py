@@ -4,37 +4,235 @@ import glob
 import hashlib
 import os
 import re
+import threading
 import time
+from typing import Iterable
 
-from _pytest.config import Config
 from _pytest.nodes import Item
 
-from .const import DATA_DIR
+from .const import RACY_INDEX_NS
+from .profiler import Profiler
+from .store import CacheStore
+
+# Weight kept by a pending changed file at each later run.
+PENDING_DECAY = 0.7
+
+# Changed files are pending for at most this many later runs.
+PENDING_RUNS = 5
+
+# Name of the stored list of modules of executed tests.
+TEST_MODULES = "test_modules"
 
 
 def tokenize(string: str) -> list[str]:
     return re.findall(r'[a-zA-Z0-9]+', string.lower())
 
 
+def get_common_tokens(nodeids: Iterable[str]) -> set[str]:
+    """Tokens shared by all given tests, e.g., `py` or `test`,
+    which relate a file to every test.
+    """
+    common = None
+    for nodeid in nodeids:
+        tokens = set(tokenize(nodeid))
+        common = tokens if common is None else common & tokens
+    return common or set()
+
+
+def get_change_tokens(paths: list[str], nodeids: list[str]) -> set[str]:
+    """Tokens of changed files (relative to the rootdir) that relate them
+    to some of the given tests, leaving out tokens shared by all tests.
+    """
+    tokens = set()
+    for path in paths:
+        tokens.update(tokenize(path))
+    return tokens - get_common_tokens(nodeids)
+
+
+def get_module(nodeid: str) -> str:
+    return nodeid.split("::", 1)[0]
+
+
+def record_test_modules(store: CacheStore, nodeids: list[str]) -> None:
+    """Add modules of executed tests to the known test modules, which
+    caches recorded without them get once from recorded durations.
+    """
+    modules = {get_module(x) for x in nodeids}
+    known = store.get(TEST_MODULES, None)
+    if known is not None and modules.issubset(known):
+        return
+
+    def update(known: list[str] | None) -> list[str]:
+        if known is None:
+            known = {get_module(x) for x in store.get_items("last_durations")}
+        return sorted(set(known) | modules)
+
+    store.update(TEST_MODULES, None, update)
+
+
+def get_known_modules(
+        store: CacheStore,
+        rootpath: str,
+        collected: list[str]) -> list[str]:
+    """Known test modules without collected tests that still exist.
+    Modules that no longer exist are removed.
+    """
+    collected = {get_module(x) for x in collected}
+    known = []
+    missing = set()
+    for module in store.get(TEST_MODULES, []):
+        if module in collected:
+            continue
+        if os.path.isfile(os.path.join(rootpath, module)):
+            known.append(module)
+        else:
+            missing.add(module)
+    if missing:
+        store.update(
+            TEST_MODULES, [], lambda x: [m for m in x if m not in missing])
+    return known
+
+
+class PendingChanges:
+    """Changed files whose related tests have not all run yet,
+    with the number of runs since the change, so that partial runs
+    (e.g., with `-k`), interrupted runs, and runs with collection errors
+    do not forget changes. A file pending for more runs has less weight.
+    """
+    def __init__(self, state: dict[str, int]) -> None:
+        self.runs = dict(state)
+
+    def to_dict(self) -> dict[str, int]:
+        return self.runs
+
+    def add_run(self, changed_files: list[str]) -> None:
+        """Age pending files by one run, and add the changed files."""
+        self.runs = {
+            path: runs + 1 for path, runs in self.runs.items()
+            if runs + 1 <= PENDING_RUNS
+        }
+        for path in changed_files:
+            self.runs[path] = 0
+
+    def get_token_weights(self) -> dict[str, float]:
+        """Weight of each token of pending files, the largest one
+        if a token is in several files.
+        """
+        weights = {}
+        for path, runs in self.runs.items():
+            for token in tokenize(path):
+                weight = PENDING_DECAY**runs
+                weights[token] = max(weights.get(token, 0), weight)
+        return weights
+
+    def resolve(
+            self,
+            collected: list[str],
+            executed: set[str],
+            known: Iterable[str] = ()) -> None:
+        """Remove pending files whose related tests have all been executed.
+        A test is related to a file if they share a token that is not
+        shared by all tests, e.g., `py` or `test`. Known tests or test
+        modules that were not collected, e.g., of other folders than
+        the given paths, are related tests that have not been executed.
+        """
+        if not collected:
+            return
+        tests = list(dict.fromkeys([*collected, *known]))
+        common = get_common_tokens(tests)
+        unexecuted = set()
+        for nodeid in tests:
+            if nodeid not in executed:
+                unexecuted.update(tokenize(nodeid))
+        self.runs = {
+            path: runs for path, runs in self.runs.items()
+            if unexecuted.intersection(set(tokenize(path)) - common)
+        }
+
+
 class changeTracker:
-    def __init__(self, pytest_config: Config) -> None:
-        self.pytest_config = pytest_config
+    def __init__(
+            self,
+            rootpath: str,
+            store: CacheStore,
+            profiler: Profiler,
+            track_pending: bool = True) -> None:
+        """
+            - track_pending: whether to add changed files to
+              the pending changes, False in pytest-xdist workers
+        """
+        self.rootpath = rootpath
+        self.store = store
+        self.profiler = profiler
+        self.track_pending = track_pending
         self.delta = set()
+        # Weight of tokens of changed and pending files.
+        self.token_weights = {}
         self.num_delta_files = 0
+        # Paths of changed files relative to the rootdir.
+        self.changed_files = []
         self.runtime = 0
-        # Get data of the changed file set.
-        self.get_delta()
+        # State of computing the delta in a background thread.
+        self.thread = None
+        self.error = None
+        self.cancelled = False
+        self.finished = False
+        self.lock = threading.Lock()
 
     def get_all_file_paths(self):
         """Get all file paths in the codebase."""
-        pattern = os.path.join(self.pytest_config.rootpath, "**/*.py")
+        pattern = os.path.join(self.rootpath, "**/*.py")
         file_paths = glob.glob(pattern, recursive=True)
         return file_paths
 
     def get_hash(self, file_path):
         """Compute hash for the file."""
         with open(file_path, "rb") as f:
-            return hashlib.sha1(f.read()).hexdigest()
+            content = f.read()
+        self.profiler.count("bytes_read", len(content))
+        return hashlib.sha1(content).hexdigest()
+
+    def compute_hashes(self) -> dict[str, str]:
+        """Compute hashes for all files.
+        Files whose modification time and size match the file index
+        reuse their indexed hash, other files are re-hashed.
+        Save the updated entries of the file index.
+        """
+        with self.profiler.phase("discovery"):
+            file_paths = self.get_all_file_paths()
+        self.profiler.count("files_scanned", len(file_paths))
+        index = self.store.get_items("file_index")
+        new_index = {}
+        hashes = {}
+        with self.profiler.phase("hashing"):
+            now = time.time_ns()
+            for path in file_paths:
+                stat = os.stat(path)
+                entry = index.get(path)
+                if (
+                    entry
+                    and entry[0] == stat.st_mtime_ns
+                    and entry[1] == stat.st_size
+                ):
+                    hashes[path] = entry[2]
+                else:
+                    hashes[path] = self.get_hash(path)
+                    self.profiler.count("files_hashed")
+                # Do not index files modified too recently, a later change
+                # within the timestamp granularity would go unnoticed.
+                if now - stat.st_mtime_ns > RACY_INDEX_NS:
+                    new_index[path] = [
+                        stat.st_mtime_ns, stat.st_size, hashes[path]
+                    ]
+        self.store.update_items(
+            "file_index",
+            {
+                path: entry for path, entry in new_index.items()
+                if index.get(path) != entry
+            },
+            removed=[path for path in index if path not in new_index],
+        )
+        return hashes
 
     def get_delta(self) -> None:
         """Compute hashes for all files,
@@ -43,36 +241,110 @@ class changeTracker:
         Save the newest hashes for all files.
         Update the number of files that were re-computed hashes.
         """
-        start_time = time.time()
-        file_paths = self.get_all_file_paths()
-        hashes = {path: self.get_hash(path) for path in file_paths}
-
-        key = os.path.join(DATA_DIR, "file_hashes")
-        # Load file hashes since last run.
-        old_hashes = self.pytest_config.cache.get(key, {})
-        # Save newest hashes anyway.
-        self.pytest_config.cache.set(key, hashes)
-
-        # If hashes are computed for the first time,
-        # No need to get delta.
-        if old_hashes == {}:
-            self.runtime += time.time() - start_time
-            return
+        start_time = time.perf_counter()
+        hashes = self.compute_hashes()
 
-        # Get files that have new hashes since last run.
-        for path, hash in hashes.items():
-            if path not in old_hashes or old_hashes[path] != hash:
-                self.delta = self.delta.union(tokenize(path))
-                self.num_delta_files += 1
-        self.runtime += time.time() - start_time
+        with self.lock:
+            # Keep hashes of the last run if the result is abandoned,
+            # so that the changes are detected again in the next run.
+            if self.cancelled:
+                return
+            self.finished = True
+            # Load file hashes since last run.
+            old_hashes = self.store.get_items("file_hashes")
+            # Save newest hashes anyway.
+            self.store.update_items(
+                "file_hashes",
+                {
+                    path: hash for path, hash in hashes.items()
+                    if old_hashes.get(path) != hash
+                },
+                removed=[path for path in old_hashes if path not in hashes],
+            )
 
-    def compute_test_suite_similarity(self, items: list[Item]) -> None:
-        """Compute and save similarity to changed files per test."""
-        start_time = time.time()
+            # If hashes are computed for the first time,
+            # No need to get delta.
+            if old_hashes:
+                # Get files that have new hashes since last run.
+                for path, hash in hashes.items():
+                    if path not in old_hashes or old_hashes[path] != hash:
+                        self.delta = self.delta.union(tokenize(path))
+                        self.num_delta_files += 1
+                        self.changed_files.append(
+                            os.path.relpath(path, self.rootpath))
+            self.update_pending()
+            self.runtime += time.perf_counter() - start_time
+
+    def update_pending(self) -> None:
+        """Add changed files to the pending changes,
+        and get weights of tokens of changed and pending files.
+        """
+        def add_run(state: dict) -> dict:
+            pending = PendingChanges(state)
+            pending.add_run(self.changed_files)
+            return pending.to_dict()
+
+        if self.track_pending:
+            state = self.store.update("pending_changes", {}, add_run)
+        else:
+            state = self.store.get("pending_changes", {})
+        pending = PendingChanges(state)
+        self.token_weights = pending.get_token_weights()
+        # Changed files have the full weight.
+        self.token_weights.update(dict.fromkeys(self.delta, 1.0))
+
+    def start(self) -> None:
+        """Compute the delta in a background thread, see `join`."""
+        def run():
+            try:
+                self.get_delta()
+            except BaseException as e:
+                self.error = e
+
+        self.thread = threading.Thread(
+            target=run, name="pytest-ranking-change-tracker", daemon=True)
+        self.thread.start()
+
+    def join(self, timeout: float | None) -> bool:
+        """Wait for the delta computed in the background thread.
+        Re-raise its error if it failed.
+        Return False if it does not finish within timeout (in seconds),
+        the delta is then abandoned and treated as no change.
+        """
+        if self.thread is None:
+            return not self.cancelled
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            with self.lock:
+                if not self.finished:
+                    self.cancelled = True
+                    self.delta = set()
+                    self.token_weights = {}
+                    self.num_delta_files = 0
+                    self.changed_files = []
+                    self.thread = None
+                    return False
+            # The delta has been saved, the thread is about to finish.
+            self.thread.join()
+        self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return True
+
+    def compute_test_suite_similarity(
+            self, items: list[Item]) -> dict[str, float]:
+        """Compute and save similarity to changed files per test,
+        the number of shared tokens, weighted for pending files.
+        """
+        start_time = time.perf_counter()
+        weights = self.token_weights
         ret = {}
-        for item in items:
-            test_tokens = set(tokenize(item.nodeid))
-            ret[item.nodeid] = len(self.delta.intersection(set(test_tokens)))
-        key = os.path.join(DATA_DIR, "change_similarity")
-        self.pytest_config.cache.set(key, ret)
-        self.runtime += time.time() - start_time
+        with self.profiler.phase("similarity"):
+            for item in items:
+                test_tokens = set(tokenize(item.nodeid))
+                ret[item.nodeid] = sum(
+                    weights[x] for x in test_tokens if x in weights)
+        self.store.set("change_similarity", ret)
+        self.runtime += time.perf_counter() - start_time
+        return ret
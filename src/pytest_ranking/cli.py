@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import textwrap
+import time
+
+from .change_tracker import changeTracker
+from .const import (DATA_DIR, DEFAULT_HIST_LEN, DEFAULT_NORMALIZATION,
+                    DEFAULT_SEED, DEFAULT_STORE, STORE)
+from .features import parse_normalizations
+from .history import HistoryLog
+from .merge import merge_stores
+from .profiler import Profiler
+from .store import PARTITION_DIR, SQLITE_FILE, CacheStore, DirCache, open_store
+from .tuning import DEFAULT_GRID, recommend, replay
+
+CLI_HELP = textwrap.dedent("""\
+Maintain pytest-ranking data outside of a pytest run.
+""")
+
+WARM_HELP = textwrap.dedent("""\
+Index hashes of all Python files under the root directory,
+so that the next `pytest --rank` run only re-hashes modified files.
+Change detection against the previous pytest run is not affected.
+""")
+
+TUNE_HELP = textwrap.dedent("""\
+Replay runs recorded via `pytest --rank-history` through all strategies
+and combinations of weights, and report their mean APFD, APFDc,
+and time to first failure (TTFF) over runs with failures.
+""")
+
+MERGE_HELP = textwrap.dedent("""\
+Merge ranking data of pytest caches, e.g., of sharded CI jobs,
+into one cache. For each test, a value changed from the base cache
+wins over an unchanged one. Among changed values, the fewest runs since
+the last failure wins, and the newest value of other data wins.
+""")
+
+
+def get_store(args: argparse.Namespace) -> tuple[str, CacheStore]:
+    """Get rootdir and ranking data store from command line arguments."""
+    rootdir = os.path.abspath(args.rootdir)
+    cache_dir = args.cache_dir or os.path.join(rootdir, ".pytest_cache")
+    store = open_store(
+        args.store, DirCache(cache_dir), Profiler(), rootdir=rootdir)
+    return rootdir, store
+
+
+def warm(args: argparse.Namespace) -> int:
+    """Pre-compute the file index used by change tracking."""
+    start_time = time.perf_counter()
+    rootdir, store = get_store(args)
+    chgtracker = changeTracker(rootdir, store, store.profiler)
+    hashes = chgtracker.compute_hashes()
+    num_hashed = store.profiler.counters.get("files_hashed", 0)
+    print(
+        f"Indexed {len(hashes)} Python files ({num_hashed} re-hashed)"
+        + f" in {time.perf_counter() - start_time:.3f}s"
+    )
+    return 0
+
+
+def tune(args: argparse.Namespace) -> int:
+    """Evaluate configurations on the recorded history."""
+    _, store = get_store(args)
+    grid = [float(x) for x in args.grid.split(",")]
+    runs = HistoryLog.from_store(store, 0).read()
+    try:
+        normalize = parse_normalizations(args.normalize)
+    except ValueError:
+        print(f"Invalid normalization: {args.normalize}")
+        return 1
+    results = replay(runs, grid, args.hist_len, args.seed, normalize)
+    if not results:
+        print("No recorded runs with failures, run pytest --rank-history.")
+        return 1
+    print(f"Evaluated on {results[0]['runs']} runs with failures.")
+    print(f"{'config':<24} {'APFD':>8} {'APFDc':>8} {'TTFF (s)':>10}")
+    for result in results[:args.top]:
+        print(
+            f"{result['config']:<24} {result['apfd']:>8.4f}"
+            + f" {result['apfdc']:>8.4f} {result['ttff']:>10.3f}"
+        )
+    print(f"Recommended: {recommend(results)}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+def open_input_store(cache_dir: str, kind: str) -> CacheStore:
+    """Open the store of a cache that is only read."""
+    # Do not create a database or partitions in an input cache
+    # without them.
+    sqlite_path = os.path.join(cache_dir, "v", DATA_DIR, SQLITE_FILE)
+    if kind == STORE.SQLITE and not os.path.exists(sqlite_path):
+        kind = STORE.JSON
+    partition_path = os.path.join(cache_dir, "v", DATA_DIR, PARTITION_DIR)
+    if kind == STORE.PARTITIONED and not os.path.isdir(partition_path):
+        kind = STORE.JSON
+    return open_store(kind, DirCache(cache_dir), Profiler())
+
+
+def merge(args: argparse.Namespace) -> int:
+    """Merge ranking data of input caches into the output cache."""
+    start_time = time.perf_counter()
+    stores = []
+    for cache_dir in args.caches + ([args.base] if args.base else []):
+        if not os.path.isdir(cache_dir):
+            print(f"Not a directory: {cache_dir}")
+            return 1
+    for cache_dir in args.caches:
+        stores.append(open_input_store(cache_dir, args.store))
+    base = open_input_store(args.base, args.store) if args.base else None
+    output = open_store(args.store, DirCache(args.output), Profiler())
+    summary = merge_stores(stores, output, base)
+    for store in stores + [base, output]:
+        if store is not None:
+            store.close()
+    for name, num_entries in summary.items():
+        print(f"{name}: {num_entries}")
+    print(
+        f"Merged {len(stores)} caches into {args.output}"
+        + f" in {time.perf_counter() - start_time:.3f}s"
+    )
+    return 0
+
+
+def add_store_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--rootdir",
+        default=".",
+        help="Root directory of the codebase, same as pytest rootdir.")
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="pytest cache directory, default is ROOTDIR/.pytest_cache.")
+    parser.add_argument(
+        "--store",
+        choices=[i.value for i in STORE],
+        default=DEFAULT_STORE.value,
+        help="Same as `--rank-store`.")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="pytest-ranking", description=CLI_HELP)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    warm_parser = subparsers.add_parser("warm", help=WARM_HELP)
+    add_store_arguments(warm_parser)
+    warm_parser.set_defaults(func=warm)
+
+    tune_parser = subparsers.add_parser("tune", help=TUNE_HELP)
+    add_store_arguments(tune_parser)
+    tune_parser.add_argument(
+        "--grid",
+        default=",".join(str(x) for x in DEFAULT_GRID),
+        help="Comma-separated weight values to combine per heuristic.")
+    tune_parser.add_argument(
+        "--hist-len",
+        type=int,
+        default=DEFAULT_HIST_LEN,
+        help="Same as `--rank-hist-len`.")
+    tune_parser.add_argument(
+        "--seed",
+        type=int,
+        default=DEFAULT_SEED,
+        help="Seed of random order and bandit strategy.")
+    tune_parser.add_argument(
+        "--normalize",
+        default=DEFAULT_NORMALIZATION,
+        help="Same as `--rank-normalize`.")
+    tune_parser.add_argument(
+        "--top",
+        type=int,
+        default=10,
+        help="Number of best configurations to print.")
+    tune_parser.add_argument(
+        "--json",
+        default=None,
+        help="Write results of all configurations to a JSON file.")
+    tune_parser.set_defaults(func=tune)
+
+    merge_parser = subparsers.add_parser("merge", help=MERGE_HELP)
+    merge_parser.add_argument(
+        "caches",
+        nargs="+",
+        help="pytest cache directories to merge.")
+    merge_parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="pytest cache directory to write merged data to.")
+    merge_parser.add_argument(
+        "--base",
+        default=None,
+        help="pytest cache directory that the input caches started from."
+        + " Entries changed from the base win over unchanged entries."
+        + " Default is the output cache.")
+    merge_parser.add_argument(
+        "--store",
+        choices=[i.value for i in STORE],
+        default=DEFAULT_STORE.value,
+        help="Same as `--rank-store`.")
+    merge_parser.set_defaults(func=merge)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import numpy as np
+from _pytest.nodes import Item
+
+from .change_tracker import tokenize
+from .store import CacheStore
+
+# Weight kept from previous co-failures at each run with failures.
+DECAY = 0.9
+
+# Co-failures with a smaller weight are dropped.
+MIN_WEIGHT = 0.05
+
+# Maximum number of co-failing tests kept per test, by weight.
+MAX_NEIGHBORS = 20
+
+# Runs with more failures, e.g., broken builds, do not add co-failures.
+MAX_FAILURES = 100
+
+
+class CoFailureGraph:
+    """Sparse symmetric matrix of how often tests failed in the same runs,
+    stored as CSR arrays: neighbors of the i-th test are
+    `indices[indptr[i]:indptr[i + 1]]` with co-failure `weights`.
+    Only tests with co-failures are stored.
+    """
+    def __init__(self, state: dict) -> None:
+        self.nodeids = list(state.get("nodeids", []))
+        self.index = {nodeid: i for i, nodeid in enumerate(self.nodeids)}
+        self.indptr = np.array(state.get("indptr", [0]), dtype=np.int64)
+        self.indices = np.array(state.get("indices", []), dtype=np.int64)
+        self.weights = np.array(state.get("weights", []), dtype=float)
+
+    def to_dict(self) -> dict:
+        return {
+            "nodeids": self.nodeids,
+            "indptr": self.indptr.tolist(),
+            "indices": self.indices.tolist(),
+            "weights": self.weights.round(4).tolist(),
+        }
+
+    def get_rows(self) -> np.ndarray:
+        """Row index of each stored co-failure."""
+        return np.repeat(np.arange(len(self.nodeids)), np.diff(self.indptr))
+
+    def get_neighbors(self, nodeid: str) -> list[str]:
+        """Co-failing tests of a test, by descending weight."""
+        i = self.index.get(nodeid)
+        if i is None:
+            return []
+        neighbors = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        return [self.nodeids[j] for j in neighbors]
+
+    def update(self, failed: list[str]) -> None:
+        """Decay co-failures and add co-failures of the failed tests
+        of a run, keeping the strongest neighbors per test.
+        """
+        failed = list(dict.fromkeys(failed))
+        rows = self.get_rows()
+        cols = self.indices
+        weights = self.weights * DECAY
+        if 2 <= len(failed) <= MAX_FAILURES:
+            for nodeid in failed:
+                if nodeid not in self.index:
+                    self.index[nodeid] = len(self.nodeids)
+                    self.nodeids.append(nodeid)
+            nodes = np.array([self.index[x] for x in failed], dtype=np.int64)
+            new_rows = np.repeat(nodes, len(nodes))
+            new_cols = np.tile(nodes, len(nodes))
+            pairs = new_rows != new_cols
+            rows = np.concatenate([rows, new_rows[pairs]])
+            cols = np.concatenate([cols, new_cols[pairs]])
+            weights = np.concatenate([weights, np.ones(pairs.sum())])
+
+        # Sum weights of the same pair.
+        num_nodes = len(self.nodeids)
+        keys, inverse = np.unique(rows * num_nodes + cols, return_inverse=True)
+        weights = np.bincount(inverse, weights, minlength=len(keys))
+        rows, cols = keys // num_nodes, keys % num_nodes
+        keep = weights >= MIN_WEIGHT
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+        # Keep the strongest neighbors per test.
+        order = np.lexsort((-weights, rows))
+        rows, cols, weights = rows[order], cols[order], weights[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        keep = rank < MAX_NEIGHBORS
+        rows, cols, weights = rows[keep], cols[keep], weights[keep]
+
+        # Drop tests without co-failures.
+        nodes = np.unique(np.concatenate([rows, cols]))
+        self.nodeids = [self.nodeids[i] for i in nodes]
+        self.index = {nodeid: i for i, nodeid in enumerate(self.nodeids)}
+        rows = np.searchsorted(nodes, rows)
+        self.indices = np.searchsorted(nodes, cols)
+        self.weights = weights
+        self.indptr = np.concatenate(
+            [[0], np.cumsum(np.bincount(rows, minlength=len(nodes)))]
+        ).astype(np.int64)
+
+    def propagate(self, signal: np.ndarray) -> np.ndarray:
+        """Sum of signals of the neighbors of each test, by weight."""
+        if len(self.weights) == 0:
+            return np.zeros(len(self.nodeids))
+        return np.bincount(
+            self.get_rows(),
+            self.weights * signal[self.indices],
+            minlength=len(self.nodeids),
+        )
+
+
+def record_cofailures(store: CacheStore, failed: list[str]) -> None:
+    """Update the co-failure graph with failed tests of a run."""
+    if not failed:
+        return
+
+    def update(state: dict) -> dict:
+        graph = CoFailureGraph(state)
+        graph.update(failed)
+        return graph.to_dict()
+
+    store.update("cofailure_graph", {}, update)
+
+
+def cofailure_feature(
+        items: list[Item],
+        store: CacheStore,
+        change_tokens: set[str]) -> np.ndarray:
+    """Co-failure weight of each test to tests that are related to
+    the changed files, or that failed recently. Tests are related to
+    changed files by their tokens, see `get_change_tokens`.
+    """
+    graph = CoFailureGraph(store.get("cofailure_graph", {}))
+    if not graph.nodeids:
+        return np.zeros(len(items))
+    num_runs_since_fail = store.get_items(
+        "num_runs_since_fail", graph.nodeids)
+    recent_fail = np.array([
+        1 / (1 + num_runs_since_fail[x]) if x in num_runs_since_fail else 0
+        for x in graph.nodeids
+    ])
+    changed = np.array([
+        bool(change_tokens.intersection(tokenize(x))) for x in graph.nodeids
+    ])
+    scores = graph.propagate(np.maximum(recent_fail, changed))
+    return np.array([
+        scores[graph.index[item.nodeid]] if item.nodeid in graph.index else 0
+        for item in items
+    ])
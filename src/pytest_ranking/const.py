@@ -7,12 +7,41 @@ DATA_DIR = "pytest_ranking_data"
 # Default amount of historical test run results to store per test.
 DEFAULT_HIST_LEN = 50
 
+# Number of test runs to keep in the history log, 0 to disable it.
+DEFAULT_HISTORY = 0
+
 DEFAULT_WEIGHT = "1-0-0"
 
 DEFAULT_SEED = 0
 
 DEFAULT_REPLAY = None
 
+DEFAULT_PROFILE = None
+DEFAULT_SHARD = None
+DEFAULT_MAX_MEMORY = None
+
+DEFAULT_NOVELTY = 0.0
+
+DEFAULT_TIMEOUT = None
+
+DEFAULT_TIMEOUT_MIN = 60.0
+
+DEFAULT_REGRESSION = None
+
+DEFAULT_ENV = None
+
+DEFAULT_REGRESSION_REPORT = None
+
+DEFAULT_CHANGE_TIMEOUT = 300.0
+
+# Number of leading folders of a test or file by which the partitioned
+# store partitions data, 0 for its whole folder.
+DEFAULT_PARTITION_DEPTH = 0
+
+# Files modified within this many nanoseconds before indexing are re-hashed
+# in the next run, as their modification time may not reflect a new change.
+RACY_INDEX_NS = 2 * 10**9
+
 
 class LEVEL(str, Enum):
     """The test group level at which the test suites are reordered.
@@ -26,3 +55,35 @@ class LEVEL(str, Enum):
 
 
 DEFAULT_LEVEL = LEVEL.PUT
+
+
+class STRATEGY(str, Enum):
+    """The strategy that combines prioritization heuristics into a score."""
+    HYBRID = "hybrid"
+    LEARNED = "learned"
+    BANDIT = "bandit"
+    COST = "cost"
+
+
+DEFAULT_STRATEGY = STRATEGY.HYBRID
+
+
+class STORE(str, Enum):
+    """The storage backend of ranking data in the pytest cache."""
+    JSON = "json"
+    SQLITE = "sqlite"
+    PARTITIONED = "partitioned"
+
+
+DEFAULT_STORE = STORE.JSON
+
+
+class NORMALIZATION(str, Enum):
+    """The normalization of heuristic values to [0, 1] before weighting."""
+    MINMAX = "minmax"
+    RANK = "rank"
+    LOG = "log"
+    ROBUST = "robust"
+
+
+DEFAULT_NORMALIZATION = NORMALIZATION.MINMAX.value
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import numpy as np
+
+from .estimate import update_group_stats
+from .store import CacheStore
+
+# Probability that a test fails per token shared with the changed files.
+CHANGE_FAIL_PROB = 0.1
+
+# Predicted cost (s) of a test is at least this,
+# so that tests of about zero duration are not preferred regardless
+# of their failure probability.
+MIN_COST = 0.01
+
+
+def failure_probability(
+        num_runs_since_fail: np.ndarray,
+        similarity: np.ndarray) -> np.ndarray:
+    """Estimate failure probability of tests from the number of runs since
+    their last failure (rule of succession, counting the last failure),
+    and from the number of tokens shared with the changed files.
+    """
+    num_runs_since_fail = np.asarray(num_runs_since_fail, dtype=float)
+    similarity = np.asarray(similarity, dtype=float)
+    p_history = 1 / (num_runs_since_fail + 2)
+    p_change = 1 - (1 - CHANGE_FAIL_PROB) ** similarity
+    return 1 - (1 - p_history) * (1 - p_change)
+
+
+def cost_cognizant_priority(
+        probability: np.ndarray,
+        costs: np.ndarray) -> np.ndarray:
+    """Failure probability per predicted second of each test.
+    Running tests by descending priority maximizes the expected
+    failures found per second of run time (APFDc) for independent tests.
+    """
+    return probability / np.maximum(np.asarray(costs, dtype=float), MIN_COST)
+
+
+def record_costs(
+        store: CacheStore,
+        nodeids: list[str],
+        costs: np.ndarray) -> None:
+    """Save setup, call and teardown time of executed tests."""
+    last_costs = dict(zip(nodeids, costs.round(3).tolist()))
+    with store.file_lock:
+        previous = store.get_items("last_costs", nodeids)
+        store.update_items("last_costs", last_costs)
+        update_group_stats(store, "last_costs", last_costs, previous)
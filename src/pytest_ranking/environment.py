@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import os
+import platform
+import sys
+from typing import Iterable
+from urllib.parse import quote, unquote
+
+from .estimate import ESTIMATED, get_group_stats_name, update_group_stats
+from .store import CacheStore
+
+# Folder of ranking data recorded per environment.
+ENV_DIR = "env"
+
+# Mappings recorded per environment, with pooled values of all
+# environments as fallback for tests without data in an environment.
+ENV_MAPPINGS = (
+    "last_durations",
+    "num_runs_since_fail",
+    "last_costs",
+    "recent_durations",
+    "peak_rss",
+    "cpu_ratios",
+    "fixture_costs",
+)
+
+# Group stats recorded per environment, the pooled group stats are
+# used as a whole until the environment has its own.
+ENV_GROUP_STATS = tuple(get_group_stats_name(x) for x in ESTIMATED)
+
+
+def get_env_name(env: str, name: str) -> str:
+    """Name of data recorded in an environment."""
+    return os.path.join(ENV_DIR, quote(env, safe=""), name)
+
+
+def list_environments(store: CacheStore) -> set[str]:
+    """Environments with recorded data in a store."""
+    return {
+        unquote(name.split("/")[1])
+        for name in store.list_names(ENV_DIR) if name.count("/") >= 2
+    }
+
+
+def get_environment(spec: str) -> str | None:
+    """Get environment key from comma separated components:
+        - python: Python version, e.g., `py3.11`
+        - implementation: Python implementation, e.g., `cpython`
+        - platform: `sys.platform`, e.g., `linux`
+        - machine: machine type, e.g., `x86_64`
+        - tox: name of the running tox environment
+        - env:NAME: value of environment variable NAME
+        - any other value as is
+    Empty components are left out, None if all are empty.
+    """
+    parts = []
+    for component in spec.split(","):
+        component = component.strip()
+        if component == "python":
+            parts.append("py{}.{}".format(*sys.version_info[:2]))
+        elif component == "implementation":
+            parts.append(sys.implementation.name)
+        elif component == "platform":
+            parts.append(sys.platform)
+        elif component == "machine":
+            parts.append(platform.machine())
+        elif component == "tox":
+            parts.append(os.environ.get("TOX_ENV_NAME", ""))
+        elif component.startswith("env:"):
+            parts.append(os.environ.get(component[len("env:"):], ""))
+        else:
+            parts.append(component)
+    return "-".join(x for x in parts if x) or None
+
+
+class EnvironmentStore(CacheStore):
+    """Read and write durations and failures of tests per environment
+    in another store. Tests without data in the environment get their
+    pooled data, which is updated by runs in all environments.
+    """
+    def __init__(self, base: CacheStore, env: str) -> None:
+        super().__init__(base.cache, base.profiler)
+        self.base = base
+        self.env = env
+        # Same lock as the base store, which it writes to.
+        self.file_lock = base.file_lock
+
+    def get_env_name(self, name: str) -> str:
+        return get_env_name(self.env, name)
+
+    def get(self, name: str, default):
+        return self.base.get(name, default)
+
+    def set(self, name: str, value) -> None:
+        self.base.set(name, value)
+
+    def get_items(self, name: str, keys: Iterable[str] | None = None) -> dict:
+        if name in ENV_GROUP_STATS:
+            if self.get_mtime(name) is not None:
+                name = self.get_env_name(name)
+            return self.base.get_items(name, keys)
+        if name not in ENV_MAPPINGS:
+            return self.base.get_items(name, keys)
+        keys = list(keys) if keys is not None else None
+        values = self.base.get_items(self.get_env_name(name), keys)
+        if keys is None:
+            missing = None
+        else:
+            missing = [key for key in keys if key not in values]
+        if missing is None or missing:
+            pooled = self.base.get_items(name, missing)
+            values = {**pooled, **values}
+        return values
+
+    def update_items(
+            self,
+            name: str,
+            values: dict,
+            removed: Iterable[str] = ()) -> None:
+        if name in ENV_GROUP_STATS:
+            name = self.get_env_name(name)
+        if name not in ENV_MAPPINGS:
+            self.base.update_items(name, values, removed)
+            return
+        removed = list(removed)
+        self.base.update_items(self.get_env_name(name), values, removed)
+        # Pooled data and their group stats are also updated.
+        previous = self.base.get_items(name, values)
+        self.base.update_items(name, values, removed)
+        if name in ESTIMATED:
+            update_group_stats(self.base, name, values, previous)
+
+    def replace_items(self, name: str, values: dict) -> None:
+        if name in ENV_MAPPINGS or name in ENV_GROUP_STATS:
+            name = self.get_env_name(name)
+        self.base.replace_items(name, values)
+
+    def get_mtime(self, name: str) -> float | None:
+        if name in ENV_GROUP_STATS:
+            name = self.get_env_name(name)
+        return self.base.get_mtime(name)
+
+    def get_path(self, name: str) -> str:
+        return self.base.get_path(name)
+
+    def close(self) -> None:
+        self.base.close()
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import os
+from typing import Iterable
+
+from .rank import get_test_groups
+from .store import CacheStore
+
+# Folder of the stored [sum, count] of recorded values per test group,
+# one mapping per estimated data keyed by group. Group stats were stored
+# as a whole in a `group_stats` value before.
+GROUP_STATS = "groups"
+
+# Test data estimated for tests without recorded data.
+ESTIMATED = ("last_durations", "num_runs_since_fail", "last_costs")
+
+
+def get_group_stats_name(name: str) -> str:
+    """Name of the mapping of group stats of a mapping."""
+    return os.path.join(GROUP_STATS, name)
+
+
+def get_groups(nodeids: Iterable[str]) -> set[str]:
+    """Test groups of any of the given tests."""
+    return {group for x in nodeids for group in get_test_groups(x)}
+
+
+def compute_group_stats(values: dict[str, float]) -> dict[str, list]:
+    """Get [sum, count] of recorded values per test group."""
+    stats = {}
+    for nodeid, value in values.items():
+        for group in get_test_groups(nodeid):
+            total = stats.setdefault(group, [0.0, 0])
+            total[0] += value
+            total[1] += 1
+    return stats
+
+
+class GroupEstimator:
+    """Estimate a value of a test without recorded data by the mean of
+    the closest test group with recorded tests: other parametrizations
+    of the same function, then its class, module, and folders.
+    """
+    def __init__(self, stats: dict[str, list]) -> None:
+        self.stats = stats
+
+    @classmethod
+    def from_store(
+            cls,
+            store: CacheStore,
+            name: str,
+            nodeids: Iterable[str]) -> GroupEstimator:
+        """Load stats of the groups of the given tests only."""
+        return cls(store.get_items(
+            get_group_stats_name(name), get_groups(nodeids)))
+
+    def estimate(
+            self,
+            nodeid: str,
+            default: float | None = 0.0) -> float | None:
+        for group in get_test_groups(nodeid):
+            total, count = self.stats.get(group, (0.0, 0))
+            if count:
+                return total / count
+        return default
+
+    def update(self, values: dict[str, float], previous: dict) -> None:
+        """Update group stats with new values of tests,
+        given their previously recorded values.
+        """
+        for nodeid, value in values.items():
+            old = previous.get(nodeid)
+            for group in get_test_groups(nodeid):
+                total = self.stats.setdefault(group, [0.0, 0])
+                total[0] = round(total[0] + value - (old or 0), 3)
+                total[1] += old is None
+
+
+def update_group_stats(
+        store: CacheStore,
+        name: str,
+        values: dict[str, float],
+        previous: dict[str, float]) -> None:
+    """Update group stats of a mapping with new values of tests,
+    only writing the groups of the given tests. Stats of caches recorded
+    without them are computed once from all recorded values.
+    """
+    stats_name = get_group_stats_name(name)
+    with store.file_lock:
+        if store.get_mtime(stats_name) is None:
+            store.replace_items(
+                stats_name, compute_group_stats(store.get_items(name)))
+            return
+        estimator = GroupEstimator.from_store(store, name, values)
+        estimator.update(values, previous)
+        store.update_items(stats_name, estimator.stats)
@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import re
+from typing import Callable
+
+import numpy as np
+from _pytest.nodes import Item
+
+from .const import DEFAULT_NORMALIZATION, NORMALIZATION
+from .estimate import GroupEstimator
+from .store import CacheStore
+
+# Names of the built-in heuristics, in the order of `--rank-weight=a-b-c`.
+BUILTIN_FEATURES = ("time", "fail", "change")
+
+
+class FeatureProvider:
+    """A prioritization heuristic that gives a value per test.
+        - name: used to weight the heuristic, e.g., `--rank-weight=name:1`
+        - compute: function(items, store) returning an array of values
+          aligned with items, only called if the heuristic is weighted
+        - needs_history: True if compute reads data of previous runs
+          from the store, otherwise the store is passed as None
+        - reverse: True if originally smaller value means higher priority
+    """
+    def __init__(
+            self,
+            name: str,
+            compute: Callable[[list[Item], CacheStore | None], np.ndarray],
+            needs_history: bool = False,
+            reverse: bool = False) -> None:
+        self.name = name
+        self.compute = compute
+        self.needs_history = needs_history
+        self.reverse = reverse
+
+    def __repr__(self) -> str:
+        return f"FeatureProvider({self.name!r})"
+
+
+def cached_feature(key: str, estimate: bool = False) -> Callable:
+    """Get compute function that loads test-wise data by nodeid.
+    With estimate, tests without data get the mean of their closest
+    test group with data, see `GroupEstimator`.
+    """
+    def compute(items: list[Item], store: CacheStore) -> np.ndarray:
+        values = store.get_items(key, [item.nodeid for item in items])
+        if estimate:
+            estimator = GroupEstimator.from_store(
+                store,
+                key,
+                [x.nodeid for x in items if x.nodeid not in values])
+            for item in items:
+                if item.nodeid not in values:
+                    values[item.nodeid] = estimator.estimate(item.nodeid)
+        # 0 if not exist: prioritizes newly selected/created tests.
+        return np.array(
+            [values.get(item.nodeid, 0) for item in items], dtype=float)
+    return compute
+
+
+def parse_weights(string: str) -> dict[str, float]:
+    """Parse weights of heuristics, either by position of the built-in
+    heuristics, e.g., `1-0-0`, or by name, e.g., `time:1,fail:2,mycov:1`.
+    Raise ValueError if the format is invalid.
+    """
+    if ":" not in string:
+        weights = [float(w) for w in string.split("-")]
+        if len(weights) != len(BUILTIN_FEATURES):
+            raise ValueError(string)
+        return dict(zip(BUILTIN_FEATURES, weights))
+    weights = {}
+    for pair in string.split(","):
+        name, weight = pair.split(":")
+        name = name.strip()
+        if not re.fullmatch(r"[A-Za-z0-9_.]+", name) or name in weights:
+            raise ValueError(string)
+        weights[name] = float(weight)
+    return weights
+
+
+def parse_normalizations(string: str) -> tuple[str, dict[str, str]]:
+    """Parse normalization of heuristics into the one of all heuristics
+    and the ones by name, e.g., `log` or `rank,time:log` or `time:log`,
+    where unspecified heuristics use min-max normalization.
+    Raise ValueError if the format is invalid.
+    """
+    valid = [i.value for i in NORMALIZATION]
+    default = None
+    normalizations = {}
+    for part in string.split(","):
+        name, _, normalization = part.rpartition(":")
+        name, normalization = name.strip(), normalization.strip()
+        if normalization not in valid:
+            raise ValueError(string)
+        if not name:
+            if default is not None or ":" in part:
+                raise ValueError(string)
+            default = normalization
+        elif (
+            not re.fullmatch(r"[A-Za-z0-9_.]+", name)
+            or name in normalizations
+        ):
+            raise ValueError(string)
+        else:
+            normalizations[name] = normalization
+    return default or DEFAULT_NORMALIZATION, normalizations
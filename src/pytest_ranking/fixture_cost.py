@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import pytest
+from _pytest.nodes import Item
+
+# Node types of fixture scopes that can be torn down between tests,
+# from the outermost to the innermost scope.
+SCOPES = {
+    "package": pytest.Package,
+    "module": pytest.Module,
+    "class": pytest.Class,
+}
+
+
+def get_fixture_keys(item: Item) -> list[tuple[str, str]]:
+    """Get (scope node ID, fixture key) of package, module and class
+    scoped fixtures used by a test, same key as `get_fixture_key`.
+    """
+    keys = []
+    fixtureinfo = getattr(item, "_fixtureinfo", None)
+    if fixtureinfo is None:
+        return keys
+    for argname in item.fixturenames:
+        fixturedefs = fixtureinfo.name2fixturedefs.get(argname)
+        if not fixturedefs or fixturedefs[-1].scope not in SCOPES:
+            continue
+        node = item.getparent(SCOPES[fixturedefs[-1].scope])
+        if node is not None:
+            keys.append((node.nodeid, f"{node.nodeid}::{argname}"))
+    return keys
+
+
+def get_fixture_key(fixturedef, request) -> str | None:
+    """Get key of a fixture being set up,
+    None if it is not package, module or class scoped.
+    """
+    if fixturedef.scope not in SCOPES:
+        return None
+    return f"{request.node.nodeid}::{fixturedef.argname}"
+
+
+def get_scope_costs(
+        items: list[Item],
+        fixture_keys: list[list[tuple[str, str]]],
+        fixture_costs: dict[str, float]) -> tuple[list[list[str]], dict]:
+    """Get setup and teardown cost of fixtures per scope node,
+    and scope nodes with a cost of each test, from the outermost.
+        - fixture_keys: `get_fixture_keys` of each test
+    """
+    node_costs = {}
+    for keys in fixture_keys:
+        for node_id, key in keys:
+            if key in fixture_costs:
+                node_costs.setdefault(node_id, {})[key] = fixture_costs[key]
+    node_costs = {
+        node_id: sum(costs.values()) for node_id, costs in node_costs.items()
+    }
+    chains = []
+    for item in items:
+        chain = []
+        for node_type in SCOPES.values():
+            node = item.getparent(node_type)
+            if node is not None and node_costs.get(node.nodeid):
+                chain.append(node.nodeid)
+        chains.append(chain)
+    return chains, node_costs
+
+
+def estimate_overhead(
+        chains: list[list[str]],
+        node_costs: dict[str, float]) -> float:
+    """Estimate the extra fixture setup and teardown time of a test order,
+    compared to setting up fixtures of each scope node once.
+    pytest tears down fixtures of a scope node before a test
+    outside of the node, so that later tests of the node set them up again.
+    """
+    overhead = 0.0
+    seen = set()
+    previous = set()
+    for chain in chains:
+        for node_id in chain:
+            if node_id not in previous and node_id in seen:
+                overhead += node_costs[node_id]
+            seen.add(node_id)
+        previous = set(chain)
+    return overhead
+
+
+class PendingTests:
+    """Pending tests in priority order, per scope node and overall."""
+    def __init__(self, chains: list[list[str]]) -> None:
+        self.pending = [True] * len(chains)
+        self.tests = {None: list(range(len(chains)))}
+        for i, chain in enumerate(chains):
+            for node_id in chain:
+                self.tests.setdefault(node_id, []).append(i)
+        self.next = {node_id: 0 for node_id in self.tests}
+
+    def first(self, node_id: str | None = None) -> int | None:
+        """Get the pending test of the highest priority in a scope node."""
+        tests = self.tests[node_id]
+        i = self.next[node_id]
+        while i < len(tests) and not self.pending[tests[i]]:
+            i += 1
+        self.next[node_id] = i
+        return tests[i] if i < len(tests) else None
+
+
+def reduce_fixture_churn(
+        chains: list[list[str]],
+        node_costs: dict[str, float],
+        durations: list[float]) -> list[int]:
+    """Reorder tests given in priority order to reduce fixture churn.
+    Before running the next test by priority outside of the current scope
+    nodes whose fixtures would be set up again later, tests of those nodes
+    are run first for as long as the next test is delayed by less than
+    the setup and teardown time saved.
+    Return test indices in the new order.
+    """
+    pending = PendingTests(chains)
+    order = []
+    chain = []
+    waiting, delay = None, 0.0
+    for _ in range(len(chains)):
+        best = pending.first()
+        left = [
+            node_id for node_id in chain
+            if node_id not in chains[best]
+            and pending.first(node_id) is not None
+        ]
+        if left:
+            if waiting != best:
+                waiting, delay = best, 0.0
+            if delay < sum(node_costs[node_id] for node_id in left):
+                # Stay in the outermost scope node that would be left.
+                best = pending.first(left[0])
+                delay += durations[best]
+        pending.pending[best] = False
+        order.append(best)
+        chain = chains[best]
+    return order
@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Iterator
+
+import numpy as np
+
+from .store import CacheStore
+
+HISTORY_FILE = "history.jsonl"
+
+
+def make_record(
+        nodeids: list[str],
+        failed: np.ndarray,
+        durations: np.ndarray,
+        changed_files: list[str]) -> dict:
+    """Compact record of a test run: executed tests in execution order,
+    their outcomes and durations, and the files changed before the run.
+    """
+    return {
+        "time": round(time.time(), 3),
+        "nodeids": nodeids,
+        "failed": failed.astype(int).tolist(),
+        "durations": durations.round(3).tolist(),
+        "changed_files": sorted(changed_files),
+    }
+
+
+class HistoryLog:
+    """Append-only log of test runs as JSON lines.
+    The log is rotated into a second segment after `max_runs` runs,
+    so that between `max_runs` and twice of it runs are kept.
+    """
+    def __init__(self, path: str, max_runs: int) -> None:
+        self.path = path
+        self.old_path = path + ".1"
+        self.max_runs = max_runs
+
+    @classmethod
+    def from_store(cls, store: CacheStore, max_runs: int) -> HistoryLog:
+        return cls(store.get_path(HISTORY_FILE), max_runs)
+
+    def count_runs(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "rb") as f:
+            return sum(1 for _ in f)
+
+    def append(self, record: dict) -> None:
+        if self.count_runs() >= self.max_runs:
+            os.replace(self.path, self.old_path)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def read(self) -> Iterator[dict]:
+        """Stream recorded runs from the oldest to the newest."""
+        for path in (self.old_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    # Skip a partially written line of an interrupted run.
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pluggy
+from _pytest.config import Config
+
+if TYPE_CHECKING:
+    from .features import FeatureProvider
+
+hookspec = pluggy.HookspecMarker("pytest")
+
+
+@hookspec
+def pytest_ranking_features(config: Config) -> list[FeatureProvider]:
+    """Return prioritization heuristics to be weighted via `--rank-weight`.
+
+    Each heuristic is a `pytest_ranking.FeatureProvider` whose values
+    are normalized to [0, 1] before weighting,
+    the higher, the earlier the test will be run.
+    """
@@ -0,0 +1,133 @@
+from __future__ import annotations
+
+from .bandit import ThompsonSampler
+from .environment import (ENV_MAPPINGS, EnvironmentStore, get_env_name,
+                          list_environments)
+from .estimate import ESTIMATED, compute_group_stats, get_group_stats_name
+from .store import CacheStore
+
+# Mappings merged per entry, with the rule to resolve conflicts.
+NEWEST_WINS = "newest"
+FAILURE_WINS = "failure"
+MERGED_MAPPINGS = {
+    "last_durations": NEWEST_WINS,
+    "num_runs_since_fail": FAILURE_WINS,
+    "file_hashes": NEWEST_WINS,
+    "file_index": NEWEST_WINS,
+    "fixture_costs": NEWEST_WINS,
+    "peak_rss": NEWEST_WINS,
+    "cpu_ratios": NEWEST_WINS,
+    "last_costs": NEWEST_WINS,
+    "recent_durations": NEWEST_WINS,
+}
+
+# Data merged as a whole, the newest one wins.
+MERGED_VALUES = ("failure_model", "cofailure_graph")
+
+
+def by_mtime(stores: list[CacheStore], name: str) -> list[CacheStore]:
+    """Stores with the given data, from the oldest to the newest."""
+    mtimes = [(store.get_mtime(name), i) for i, store in enumerate(stores)]
+    mtimes = [(mtime, i) for mtime, i in mtimes if mtime is not None]
+    return [stores[i] for mtime, i in sorted(mtimes)]
+
+
+def merge_mapping(
+        stores: list[CacheStore],
+        name: str,
+        rule: str,
+        base: dict) -> dict:
+    """Merge a mapping entry by entry, loading one store at a time.
+    An entry a store changed from the base data wins over the same
+    entry left unchanged by other stores, e.g., by shards that did not
+    run the test.
+    """
+    changed = {}
+    for store in by_mtime(stores, name):
+        values = store.get_items(name)
+        for key, value in values.items():
+            if key in base and value == base[key]:
+                continue
+            if rule == FAILURE_WINS and key in changed:
+                # Fewest runs since the last failure wins.
+                changed[key] = min(value, changed[key])
+            else:
+                changed[key] = value
+        del values
+    return {**base, **changed}
+
+
+def merge_bandit(stores: list[CacheStore], base: dict) -> dict | None:
+    """Merge posteriors of the bandit strategy per test, the newest
+    posterior of each test that a store changed from the base wins.
+    """
+    merged = None
+    base_state = ThompsonSampler(base)
+    for store in by_mtime(stores, "bandit_state"):
+        state = ThompsonSampler(store.get("bandit_state", {}))
+        if merged is None:
+            merged = ThompsonSampler(base)
+        base_arms = base_state.get_arms(state.nodeids)
+        changed = (
+            (state.alpha != base_state.alpha[base_arms])
+            | (state.beta != base_state.beta[base_arms])
+        )
+        arms = merged.get_arms(
+            [x for x, c in zip(state.nodeids, changed) if c])
+        merged.alpha[arms] = state.alpha[changed]
+        merged.beta[arms] = state.beta[changed]
+        merged.num_updates = max(merged.num_updates, state.num_updates)
+    return merged.to_dict() if merged is not None else None
+
+
+def merge_stores(
+        stores: list[CacheStore],
+        output: CacheStore,
+        base: CacheStore | None = None) -> dict:
+    """Merge ranking data of stores into the output store, replacing
+    its data. Entries are merged against the data of the base store,
+    which stores started from, by default the data of the output store.
+    Return number of merged entries per data.
+    """
+    if base is None:
+        base = output
+    summary = {}
+    for name, rule in MERGED_MAPPINGS.items():
+        merged = merge_mapping(stores, name, rule, base.get_items(name))
+        if merged:
+            output.replace_items(name, merged)
+        summary[name] = len(merged)
+    # Group stats are recomputed from the merged data.
+    for name in ESTIMATED:
+        output.replace_items(
+            get_group_stats_name(name),
+            compute_group_stats(output.get_items(name)))
+    # Data recorded per environment are merged the same way.
+    environments = set()
+    for store in stores + [base]:
+        environments.update(list_environments(store))
+    for env in sorted(environments):
+        for name, rule in MERGED_MAPPINGS.items():
+            if name not in ENV_MAPPINGS:
+                continue
+            env_name = get_env_name(env, name)
+            merged = merge_mapping(
+                stores, env_name, rule, base.get_items(env_name))
+            if merged:
+                output.replace_items(env_name, merged)
+                summary[env_name] = len(merged)
+        env_store = EnvironmentStore(output, env)
+        for name in ESTIMATED:
+            env_store.replace_items(
+                get_group_stats_name(name),
+                compute_group_stats(env_store.get_items(name)))
+    for name in MERGED_VALUES:
+        newest = by_mtime(stores, name)
+        if newest:
+            output.set(name, newest[-1].get(name, None))
+            summary[name] = 1
+    bandit_state = merge_bandit(stores, base.get("bandit_state", {}))
+    if bandit_state is not None:
+        output.set("bandit_state", bandit_state)
+        summary["bandit_state"] = len(bandit_state["nodeids"])
+    return summary
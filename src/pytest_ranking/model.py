@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import numpy as np
+
+# Step size of each gradient descent update.
+LEARNING_RATE = 0.5
+
+# Number of gradient descent steps per test run.
+NUM_EPOCHS = 10
+
+# L2 regularization to keep weights small on few observations.
+L2_PENALTY = 1e-3
+
+
+def sigmoid(x: np.ndarray) -> np.ndarray:
+    return 1 / (1 + np.exp(-np.clip(x, -30, 30)))
+
+
+class FailurePredictor:
+    """Online logistic regression that predicts test failure
+    from the heuristic values of a test.
+    """
+    def __init__(
+            self,
+            features: list[str],
+            weights: list[float],
+            bias: float = 0.0) -> None:
+        self.features = list(features)
+        self.weights = np.array(weights, dtype=float)
+        self.bias = float(bias)
+        self.num_updates = 0
+
+    @classmethod
+    def from_dict(
+            cls,
+            data: dict,
+            features: list[str],
+            weights: list[float]) -> FailurePredictor:
+        """Load a stored model, start from given weights if there is
+        no stored model or its features differ.
+        """
+        if data.get("features") != list(features):
+            return cls(features, weights)
+        model = cls(features, data["weights"], data["bias"])
+        model.num_updates = data.get("num_updates", 0)
+        return model
+
+    def to_dict(self) -> dict:
+        return {
+            "features": self.features,
+            "weights": self.weights.round(6).tolist(),
+            "bias": round(self.bias, 6),
+            "num_updates": self.num_updates,
+        }
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        """Failure probability per row of the feature matrix."""
+        return sigmoid(features @ self.weights + self.bias)
+
+    def update(self, features: np.ndarray, failed: np.ndarray) -> None:
+        """Fit the model on the outcomes of one test run.
+        Failures are rare, so they are weighted to balance the classes.
+        """
+        if len(features) == 0:
+            return
+        failed = failed.astype(float)
+        num_fail = failed.sum()
+        num_pass = len(failed) - num_fail
+        sample_weight = np.ones(len(failed))
+        if num_fail and num_pass:
+            sample_weight[failed == 1] = num_pass / num_fail
+        sample_weight /= sample_weight.sum()
+        for _ in range(NUM_EPOCHS):
+            error = (self.predict(features) - failed) * sample_weight
+            grad_w = features.T @ error + L2_PENALTY * self.weights
+            grad_b = error.sum()
+            self.weights -= LEARNING_RATE * grad_w
+            self.bias -= LEARNING_RATE * grad_b
+        self.num_updates += 1
@@ -5,7 +5,9 @@ import os
 import random
 import textwrap
 import time
+import warnings
 from enum import Enum
+from typing import Callable
 
 import numpy as np
 import pytest
@@ -16,10 +18,39 @@ from _pytest.nodes import Item
 from _pytest.reports import TestReport
 from _pytest.terminal import TerminalReporter
 
-from .change_tracker import changeTracker
-from .const import (DATA_DIR, DEFAULT_HIST_LEN, DEFAULT_LEVEL, DEFAULT_REPLAY,
-                    DEFAULT_SEED, DEFAULT_WEIGHT, LEVEL)
-from .rank import get_ranking
+from .bandit import ThompsonSampler
+from .change_tracker import (PendingChanges, changeTracker, get_change_tokens,
+                             get_known_modules, record_test_modules)
+from .cofailure import CoFailureGraph, cofailure_feature, record_cofailures
+from .const import (DEFAULT_CHANGE_TIMEOUT, DEFAULT_ENV, DEFAULT_HIST_LEN,
+                    DEFAULT_HISTORY, DEFAULT_LEVEL, DEFAULT_MAX_MEMORY,
+                    DEFAULT_NORMALIZATION, DEFAULT_NOVELTY,
+                    DEFAULT_PARTITION_DEPTH, DEFAULT_PROFILE,
+                    DEFAULT_REGRESSION, DEFAULT_REGRESSION_REPORT,
+                    DEFAULT_REPLAY, DEFAULT_SEED, DEFAULT_SHARD, DEFAULT_STORE,
+                    DEFAULT_STRATEGY, DEFAULT_TIMEOUT, DEFAULT_TIMEOUT_MIN,
+                    DEFAULT_WEIGHT, LEVEL, STORE, STRATEGY)
+from .cost import cost_cognizant_priority, failure_probability, record_costs
+from .environment import EnvironmentStore, get_environment
+from .estimate import GroupEstimator, update_group_stats
+from .features import (BUILTIN_FEATURES, FeatureProvider, cached_feature,
+                       parse_normalizations, parse_weights)
+from .fixture_cost import (estimate_overhead, get_fixture_key,
+                           get_fixture_keys, get_scope_costs,
+                           reduce_fixture_churn)
+from .history import HistoryLog, make_record
+from .model import FailurePredictor
+from .profiler import Profiler
+from .rank import NORMALIZATIONS, assign_shards, get_ranking
+from .regression import (find_regressions, format_regression,
+                         write_regression_report)
+from .replay import load_replay, open_replay, replay_ranking
+from .resources import ResourceMeter, record_resources
+from .results import PHASES, ResultCheckpoint, TestResults
+from .scheduler import AdaptiveScheduler
+from .store import CacheStore, open_store
+from .timeout import (TimeLimit, predict_timeouts, record_recent_durations,
+                      timeout_supported)
 
 PLUGIN_HELP = textwrap.dedent("""\
 Run regression test prioritization for pytest test suite.
@@ -29,12 +60,24 @@ It re-orders execution of tests to expose test failure sooner.
 
 WEIGHT_HELP = textwrap.dedent("""\
 Set weights on different prioritization heuristics,
-separated by hyphens `-`.
+separated by hyphens `-` in the order of time, fail, change,
+or by name, e.g., `time:1,fail:2,cofail:1`.
 The sum of weights will be normalized to 1.
 Higher weight means that heuristic will be favored.
 Default value is 1-0-0.
 """)
 
+NORMALIZE_HELP = textwrap.dedent("""\
+Normalization of heuristic values to [0, 1] before weighting:
+minmax, rank (percentile rank), log (min-max of log-scaled values),
+or robust (median/IQR z-score clipped to 3 IQRs), either for all
+heuristics, e.g., `rank`, or by name, e.g., `time:log,fail:rank`,
+or both, e.g., `rank,time:log`.
+Rank, log and robust keep a few outliers, e.g., very slow tests,
+from compressing the values of all other tests.
+Default value is minmax.
+""")
+
 HIST_LEN_HELP = textwrap.dedent("""\
 The maximum number of previous test runs
 that can be recorded for a test since the test has failed.
@@ -55,11 +98,156 @@ Default value is PUT.
 """)
 
 REPLAY_HELP = textwrap.dedent("""
-Provide a text file where each line is a test ID.
-pytest-ranking will run tests with the order defined in the file.
+Provide a text file where each line is a test ID, or a test group:
+a test function without parameters, a class, a module or a folder.
+pytest-ranking will run tests with the order defined in the file,
+tests of a group in the order of the other options, and tests not
+listed afterwards in the order of the other options.
+The file may be gzip-compressed with a `.gz` suffix.
+Default value is None.
+""")
+
+STRATEGY_HELP = textwrap.dedent("""
+The strategy that combines the prioritization heuristics.
+`hybrid` sums the heuristics weighted by `--rank-weight`.
+`learned` ranks tests by their failure probability predicted by
+a model that is trained on the outcomes after each run,
+starting from `--rank-weight`.
+`bandit` ranks tests by Thompson sampling of their failure probability,
+rewarding tests that fail early, using the seed of `--rank-seed`.
+`cost` ranks tests by their failure probability, estimated from
+the runs since their last failure and their similarity to the changed
+files, per second of their recorded setup, call and teardown time.
+Default value is hybrid.
+""")
+
+HISTORY_HELP = textwrap.dedent("""
+Record a log of test runs (executed tests, outcomes, durations,
+and changed files), keeping at least this many most recent runs.
+Use `pytest-ranking tune` to evaluate weights on the recorded runs.
+Default value is 0 (no log).
+""")
+
+STORE_HELP = textwrap.dedent("""
+The storage backend of ranking data in the pytest cache.
+`json` stores each kind of data as one JSON file.
+`sqlite` stores data per test and per file in a SQLite database,
+so that runs of a few tests only read and write data of those tests.
+`partitioned` stores data per test and per file in one JSON file per
+folder, so that runs of the tests of a few folders only read
+and write data of those folders.
+Default value is json.
+""")
+
+PARTITION_DEPTH_HELP = textwrap.dedent("""
+Partition data of the `partitioned` store by the first N folders of
+tests and files instead of their whole folder, e.g., `1` for one
+partition per top-level folder. Stored partitions are repartitioned
+when the depth changes.
+Default value is 0 (folder of each test module or file).
+""")
+
+ENV_HELP = textwrap.dedent("""
+Record durations and failures of tests per environment, given as
+comma separated components of the environment key: `python` (version),
+`implementation`, `platform`, `machine`, `tox` (environment name),
+`env:NAME` (value of environment variable NAME), or any custom value,
+e.g., `--rank-env=python,platform,tox`.
+Tests without data in the environment use data pooled across all
+environments, which every run also updates.
+Default value is None (data of all environments are pooled).
+""")
+
+PROFILE_HELP = textwrap.dedent("""
+Provide a JSON file path to write the runtime of each plugin phase
+(discovery, hashing, cache load, similarity, scoring, grouping, sorting,
+persistence) in nanoseconds, together with overhead counters.
+Default value is None.
+""")
+
+PROFILE_PSTATS_HELP = textwrap.dedent("""
+Provide a file path to write cProfile statistics of the plugin phases,
+which can be loaded with the `pstats` module.
 Default value is None.
 """)
 
+CHANGE_TIMEOUT_HELP = textwrap.dedent("""
+Changed files are detected in the background during test collection.
+The maximum number of seconds to wait for it after collection,
+otherwise this run proceeds without change information.
+Default value is 300.
+""")
+
+SHARD_HELP = textwrap.dedent("""
+Only run the K-th of N disjoint shards of the tests, given as `K/N`,
+e.g., `--rank-shard=1/4`. Tests are assigned in ranked order to the shard
+with the least predicted runtime, by their last durations, so that shards
+take about the same time and each shard runs its likely failures first.
+Default value is None (run all tests).
+""")
+
+ADAPTIVE_HELP = textwrap.dedent("""
+Re-prioritize pending tests during the run: after a test fails,
+tests in the same test group (the same test function at PUT level),
+tests related to the same changed files, and tests that failed
+together with it in previous runs are run earlier.
+Not available with pytest-xdist.
+""")
+
+FIXTURE_AWARE_HELP = textwrap.dedent("""
+Reorder ranked tests to avoid setting up expensive package, module,
+and class scoped fixtures again, as far as the saved setup time
+is more than the delay of higher ranked tests.
+Setup and teardown time of fixtures is recorded in every run.
+""")
+
+TIMEOUT_HELP = textwrap.dedent("""
+Fail a test if its call takes longer than this factor times the
+95th percentile of its 10 most recent durations, e.g., `--rank-timeout=5`.
+Tests without recorded durations use the mean duration of their
+closest test group, no timeout if no test has a recorded duration.
+Only available on POSIX systems, where tests run in the main thread.
+Default value is None (no timeout).
+""")
+
+TIMEOUT_MIN_HELP = textwrap.dedent("""
+Minimum timeout in seconds of `--rank-timeout`.
+Default value is 60.0.
+""")
+
+REGRESSION_HELP = textwrap.dedent("""
+Report tests whose call duration exceeds the median of their 10 most
+recent durations by more than this many robust standard deviations
+(scaled median absolute deviation, at least 10% of the median),
+and by at least 0.1s, e.g., `--rank-regression=5`.
+Tests with less than 3 recent durations are not reported.
+Default value is None (no report).
+""")
+
+REGRESSION_REPORT_HELP = textwrap.dedent("""
+Write the tests reported by `--rank-regression` to this JSON file.
+Default value is None (terminal summary only).
+""")
+
+NOVELTY_HELP = textwrap.dedent("""
+Priority added to tests without recorded data, e.g., newly added tests.
+Heuristic values of these tests are estimated from recorded tests
+of their closest test group: other parametrizations of the same
+function, then its class, module and folders.
+The priority of other tests is between 0 and 1.
+Default value is 0.0 (no boost).
+""")
+
+MAX_MEMORY_HELP = textwrap.dedent("""
+Memory budget in MB of tests running at the same time under
+pytest-xdist (`--dist load`). Tests are held back while the recorded
+peak memory of tests sent to workers would exceed the budget,
+or while CPU-bound tests would exceed the number of CPUs,
+so that I/O-bound tests run in between.
+Peak memory and CPU time of tests are recorded in every run.
+Default value is None (no budget).
+""")
+
 
 def pytest_addoption(parser: Parser) -> None:
     group = parser.getgroup("rank", "pytest-ranking")
@@ -84,6 +272,22 @@ def pytest_addoption(parser: Parser) -> None:
         dest="rank_weight",
         help=WEIGHT_HELP)
 
+    group._addoption(
+        "--rank-normalize",
+        action="store",
+        type=normalize_type,
+        default=DEFAULT_NORMALIZATION,
+        dest="rank_normalize",
+        help=NORMALIZE_HELP)
+
+    group._addoption(
+        "--rank-strategy",
+        action="store",
+        type=strategy_type,
+        default=DEFAULT_STRATEGY,
+        dest="rank_strategy",
+        help=STRATEGY_HELP)
+
     group._addoption(
         "--rank-replay",
         action="store",
@@ -100,6 +304,14 @@ def pytest_addoption(parser: Parser) -> None:
         default=DEFAULT_HIST_LEN,
         help=HIST_LEN_HELP)
 
+    group._addoption(
+        "--rank-history",
+        action="store",
+        type=int,
+        dest="rank_history",
+        default=DEFAULT_HISTORY,
+        help=HISTORY_HELP)
+
     group._addoption(
         "--rank-seed",
         action="store",
@@ -108,11 +320,158 @@ def pytest_addoption(parser: Parser) -> None:
         default=DEFAULT_SEED,
         help=SEED_HELP)
 
+    group._addoption(
+        "--rank-store",
+        action="store",
+        type=store_type,
+        default=DEFAULT_STORE,
+        dest="rank_store",
+        help=STORE_HELP)
+
+    group._addoption(
+        "--rank-partition-depth",
+        action="store",
+        type=partition_depth_type,
+        default=DEFAULT_PARTITION_DEPTH,
+        dest="rank_partition_depth",
+        help=PARTITION_DEPTH_HELP)
+
+    group._addoption(
+        "--rank-env",
+        action="store",
+        type=str,
+        default=DEFAULT_ENV,
+        dest="rank_env",
+        help=ENV_HELP)
+
+    group._addoption(
+        "--rank-profile",
+        action="store",
+        default=DEFAULT_PROFILE,
+        dest="rank_profile",
+        help=PROFILE_HELP)
+
+    group._addoption(
+        "--rank-profile-pstats",
+        action="store",
+        default=DEFAULT_PROFILE,
+        dest="rank_profile_pstats",
+        help=PROFILE_PSTATS_HELP)
+
+    group._addoption(
+        "--rank-change-timeout",
+        action="store",
+        type=float,
+        default=DEFAULT_CHANGE_TIMEOUT,
+        dest="rank_change_timeout",
+        help=CHANGE_TIMEOUT_HELP)
+
+    group._addoption(
+        "--rank-shard",
+        action="store",
+        type=shard_type,
+        default=DEFAULT_SHARD,
+        dest="rank_shard",
+        help=SHARD_HELP)
+
+    group._addoption(
+        "--rank-adaptive",
+        action="store_true",
+        dest="rank_adaptive",
+        help=ADAPTIVE_HELP)
+
+    group._addoption(
+        "--rank-fixture-aware",
+        action="store_true",
+        dest="rank_fixture_aware",
+        help=FIXTURE_AWARE_HELP)
+
+    group._addoption(
+        "--rank-timeout",
+        action="store",
+        type=positive_float_type("--rank-timeout"),
+        default=DEFAULT_TIMEOUT,
+        dest="rank_timeout",
+        help=TIMEOUT_HELP)
+
+    group._addoption(
+        "--rank-timeout-min",
+        action="store",
+        type=non_negative_float_type("--rank-timeout-min"),
+        default=DEFAULT_TIMEOUT_MIN,
+        dest="rank_timeout_min",
+        help=TIMEOUT_MIN_HELP)
+
+    group._addoption(
+        "--rank-regression",
+        action="store",
+        type=positive_float_type("--rank-regression"),
+        default=DEFAULT_REGRESSION,
+        dest="rank_regression",
+        help=REGRESSION_HELP)
+
+    group._addoption(
+        "--rank-regression-report",
+        action="store",
+        type=str,
+        default=DEFAULT_REGRESSION_REPORT,
+        dest="rank_regression_report",
+        help=REGRESSION_REPORT_HELP)
+
+    group._addoption(
+        "--rank-novelty",
+        action="store",
+        type=novelty_type,
+        default=DEFAULT_NOVELTY,
+        dest="rank_novelty",
+        help=NOVELTY_HELP)
+
+    group._addoption(
+        "--rank-max-memory",
+        action="store",
+        type=float,
+        default=DEFAULT_MAX_MEMORY,
+        dest="rank_max_memory",
+        help=MAX_MEMORY_HELP)
+
     parser.addini("rank_weight", WEIGHT_HELP, default=DEFAULT_WEIGHT)
+    parser.addini(
+        "rank_normalize", NORMALIZE_HELP, default=DEFAULT_NORMALIZATION)
+    parser.addini("rank_strategy", STRATEGY_HELP, default=DEFAULT_STRATEGY)
     parser.addini("rank_replay", REPLAY_HELP, default=DEFAULT_REPLAY)
     parser.addini("rank_level", LEVEL_HELP, default=DEFAULT_LEVEL)
     parser.addini("rank_hist_len", HIST_LEN_HELP, default=DEFAULT_HIST_LEN)
+    parser.addini("rank_history", HISTORY_HELP, default=DEFAULT_HISTORY)
     parser.addini("rank_seed", SEED_HELP, default=DEFAULT_SEED)
+    parser.addini("rank_store", STORE_HELP, default=DEFAULT_STORE)
+    parser.addini(
+        "rank_partition_depth",
+        PARTITION_DEPTH_HELP,
+        default=DEFAULT_PARTITION_DEPTH)
+    parser.addini("rank_env", ENV_HELP, default=DEFAULT_ENV)
+    parser.addini("rank_profile", PROFILE_HELP, default=DEFAULT_PROFILE)
+    parser.addini(
+        "rank_profile_pstats", PROFILE_PSTATS_HELP, default=DEFAULT_PROFILE)
+    parser.addini(
+        "rank_change_timeout",
+        CHANGE_TIMEOUT_HELP,
+        default=DEFAULT_CHANGE_TIMEOUT)
+    parser.addini("rank_shard", SHARD_HELP, default=DEFAULT_SHARD)
+    parser.addini("rank_adaptive", ADAPTIVE_HELP, type="bool", default=False)
+    parser.addini(
+        "rank_max_memory", MAX_MEMORY_HELP, default=DEFAULT_MAX_MEMORY)
+    parser.addini("rank_novelty", NOVELTY_HELP, default=DEFAULT_NOVELTY)
+    parser.addini("rank_timeout", TIMEOUT_HELP, default=DEFAULT_TIMEOUT)
+    parser.addini(
+        "rank_timeout_min", TIMEOUT_MIN_HELP, default=DEFAULT_TIMEOUT_MIN)
+    parser.addini(
+        "rank_regression", REGRESSION_HELP, default=DEFAULT_REGRESSION)
+    parser.addini(
+        "rank_regression_report",
+        REGRESSION_REPORT_HELP,
+        default=DEFAULT_REGRESSION_REPORT)
+    parser.addini(
+        "rank_fixture_aware", FIXTURE_AWARE_HELP, type="bool", default=False)
 
 
 def weight_type(string: str) -> str:
@@ -120,14 +479,26 @@ def weight_type(string: str) -> str:
     if string == DEFAULT_WEIGHT:
         return string
     try:
-        weights = string.split("-")
-        assert len(weights) == 3
-        weights = [float(w) for w in weights]
+        parse_weights(string)
         return string
-    except (AssertionError, ValueError):
+    except ValueError:
         raise argparse.ArgumentTypeError(
             "Cannot parse input for `--rank-weight`."
-            + "Valid examples: 1-0-0, 0.4-0.2-0.2, and 2-7-1."
+            + "Valid examples: 1-0-0, 0.4-0.2-0.2, 2-7-1, and time:1,fail:2."
+        )
+
+
+def normalize_type(string: str) -> str:
+    """Check normalization format."""
+    if string == DEFAULT_NORMALIZATION:
+        return string
+    try:
+        parse_normalizations(string)
+        return string
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-normalize`."
+            + " Please run `pytest --help` for instruction."
         )
 
 
@@ -146,13 +517,57 @@ def level_type(string: str) -> str:
         )
 
 
+def strategy_type(string: str) -> str:
+    "Check strategy format."
+    if string == DEFAULT_STRATEGY:
+        return string
+    try:
+        valid_strategies = [i.value for i in STRATEGY]
+        assert string in valid_strategies
+        return string
+    except AssertionError:
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-strategy`."
+            + " Please run `pytest --help` for instruction."
+        )
+
+
+def store_type(string: str) -> str:
+    "Check store format."
+    if string == DEFAULT_STORE:
+        return string
+    try:
+        valid_stores = [i.value for i in STORE]
+        assert string in valid_stores
+        return string
+    except AssertionError:
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-store`."
+            + " Please run `pytest --help` for instruction."
+        )
+
+
+def partition_depth_type(string: str) -> int:
+    """Check partition depth format."""
+    try:
+        depth = int(string)
+        assert depth >= 0
+        return depth
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-partition-depth`."
+            + " Please run `pytest --help` for instruction."
+        )
+
+
 def replay_type(string: str) -> str:
     "Check replay file format."
     if string == DEFAULT_REPLAY:
         return string
     try:
-        with open(string) as f:
-            _ = f.readlines()
+        # Only check the first line, the file is streamed when replayed.
+        with open_replay(string) as f:
+            f.readline()
         return string
     except Exception:
         raise argparse.ArgumentTypeError(
@@ -161,40 +576,181 @@ def replay_type(string: str) -> str:
         )
 
 
-def min_max_normalization(x: list[float]) -> np.ndarray:
-    x = np.array(x)
-    x_range = (np.max(x) - np.min(x))
-    x = (x - np.min(x)) / x_range if x_range else np.zeros(len(x))
-    return x
+def positive_float_type(option: str) -> Callable[[str], float]:
+    """Get check of a positive float option."""
+    def check(string: str) -> float:
+        try:
+            value = float(string)
+            assert value > 0
+            return value
+        except (ValueError, AssertionError):
+            raise argparse.ArgumentTypeError(
+                f"Invalid input for `{option}`."
+                + " Please run `pytest --help` for instruction."
+            )
+    return check
+
+
+def non_negative_float_type(option: str) -> Callable[[str], float]:
+    """Get check of a non-negative float option."""
+    def check(string: str) -> float:
+        try:
+            value = float(string)
+            assert value >= 0
+            return value
+        except (ValueError, AssertionError):
+            raise argparse.ArgumentTypeError(
+                f"Invalid input for `{option}`."
+                + " Please run `pytest --help` for instruction."
+            )
+    return check
+
+
+def novelty_type(string: str) -> float:
+    """Check novelty boost format."""
+    try:
+        novelty = float(string)
+        assert novelty >= 0
+        return novelty
+    except (ValueError, AssertionError):
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-novelty`."
+            + " Please run `pytest --help` for instruction."
+        )
+
+
+def parse_shard(string: str) -> tuple[int, int]:
+    """Parse shard `K/N` into (K, N) with 1 <= K <= N."""
+    shard, num_shards = (int(x) for x in string.split("/"))
+    if not 1 <= shard <= num_shards:
+        raise ValueError(string)
+    return shard, num_shards
+
+
+def shard_type(string: str) -> str:
+    "Check shard format."
+    if string == DEFAULT_SHARD:
+        return string
+    try:
+        parse_shard(string)
+        return string
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "Invalid input for `--rank-shard`."
+            + " Please run `pytest --help` for instruction."
+        )
 
 
 class RTPRunner:
     """Plugin class."""
     def __init__(self, config: Config) -> None:
         self.config = config
-        self.test_reports = []
+        self.results = TestResults()
         self.log = {}
         self.weights = self.parse_rtp_weights()
+        self.normalize = self.parse_normalize()
         self.level = self.parse_rtp_level()
+        self.strategy = self.parse_strategy()
+        # Heuristic values of ranked tests, sent with their reports...
+        self.ranked_features = None
+        # ... to train the learned model on all executed tests.
+        self.executed_features = {}
         self.replay_file = self.parse_replay()
         self.hist_len = self.parse_hist_len()
+        self.history = self.parse_history()
         self.seed = self.parse_seed()
-        self.chgtracker = changeTracker(config)
+        self.shard = self.parse_rtp_shard()
+        self.adaptive = self.parse_adaptive()
+        self.scheduler = None
+        self.fixture_aware = self.parse_fixture_aware()
+        # Total setup and teardown time and number of setups per fixture.
+        self.fixture_costs = {}
+        self.teardown_start = {}
+        self.max_memory = self.parse_max_memory()
+        self.novelty = self.parse_novelty()
+        self.timeout = self.parse_timeout()
+        self.timeouts = {}
+        self.timed_out = set()
+        self.regression = self.parse_regression()
+        self.regression_report = self.parse_regression_report()
+        self.regressions = []
+        self.resource_usage = {}
+        self.profile_file = self.parse_profile("rank_profile")
+        self.pstats_file = self.parse_profile("rank_profile_pstats")
+        self.profiler = Profiler(
+            enabled=bool(self.profile_file or self.pstats_file),
+            pstats_path=self.pstats_file,
+        )
+        self.partition_depth = self.parse_partition_depth()
+        self.store = open_store(
+            self.parse_store(),
+            config.cache,
+            self.profiler,
+            self.partition_depth,
+            str(config.rootpath))
+        self.env = self.parse_env()
+        if self.env is not None:
+            self.store = EnvironmentStore(self.store, self.env[1])
+        # Only the pytest-xdist controller has results of all tests.
+        self.checkpoint = None
+        if not hasattr(config, "workerinput"):
+            self.checkpoint = ResultCheckpoint.from_store(self.store)
+            self.recover_checkpoint()
+        self.change_timeout = self.parse_change_timeout()
+        # Detect changed files while pytest collects tests.
+        self.chgtracker = changeTracker(
+            config.rootpath,
+            self.store,
+            self.profiler,
+            track_pending=self.checkpoint is not None)
+        self.chgtracker.start()
+        # Tests deselected, e.g., by `-k`, and tests collected by
+        # pytest-xdist workers, to resolve pending changes.
+        self.deselected = []
+        self.worker_collected = set()
+
+    def recover_checkpoint(self) -> None:
+        """Save results checkpointed by a session that was killed
+        before it could save them, e.g., by a CI timeout.
+        """
+        nodeids, failed, durations = [], [], []
+        orphans = list(ResultCheckpoint.find_orphans(self.store))
+        for orphan in orphans:
+            for nodeid, is_failed, duration in orphan.read():
+                nodeids.append(nodeid)
+                failed.append(is_failed)
+                durations.append(duration)
+        if nodeids:
+            compute_test_features(
+                self.store,
+                nodeids,
+                np.array(failed, dtype=bool),
+                np.array(durations, dtype=float),
+                self.hist_len)
+            self.log["Number of tests recovered from interrupted run"] = (
+                len(nodeids)
+            )
+        for orphan in orphans:
+            orphan.remove()
 
-    def parse_rtp_weights(self) -> list[float]:
-        """Get weights, non-default CLI overrides ini file input."""
+    def parse_rtp_weights(self) -> dict[str, float]:
+        """Get weights by heuristic name,
+        non-default CLI overrides ini file input.
+        """
         weights = self.config.getoption("--rank-weight")
         if weights == DEFAULT_WEIGHT:
             ini_val = self.config.getini("rank_weight")
             weights = ini_val if ini_val else weights
 
-        weights = weights.split("-")
-        weights = [float(w) for w in weights]
-        weight_sum = sum(weights)
+        weights = parse_weights(weights)
+        weight_sum = sum(weights.values())
         if weight_sum == 0:
-            return [0, 0, 0]
-        weights = [w_i / weight_sum for w_i in weights]
-        return weights
+            return {name: 0 for name in weights}
+        return {name: w_i / weight_sum for name, w_i in weights.items()}
+
+    def is_random_order(self) -> bool:
+        """Tests are run in random order if all weights are 0."""
+        return not any(self.weights.values())
 
     def parse_rtp_level(self) -> Enum:
         """Get test group level, non-default CLI overrides ini file input."""
@@ -204,6 +760,24 @@ class RTPRunner:
             level = ini_val if ini_val else level
         return level
 
+    def parse_normalize(self) -> tuple[str, dict[str, str]]:
+        """Get normalization of all heuristics and by heuristic name,
+        non-default CLI overrides ini file input.
+        """
+        normalize = self.config.getoption("--rank-normalize")
+        if normalize == DEFAULT_NORMALIZATION:
+            ini_val = self.config.getini("rank_normalize")
+            normalize = ini_val if ini_val else normalize
+        return parse_normalizations(normalize)
+
+    def parse_strategy(self) -> Enum:
+        """Get strategy, non-default CLI overrides ini file input."""
+        strategy = self.config.getoption("--rank-strategy")
+        if strategy == DEFAULT_STRATEGY:
+            ini_val = self.config.getini("rank_strategy")
+            strategy = ini_val if ini_val else strategy
+        return strategy
+
     def parse_replay(self) -> str:
         """Get replay file, non-default CLI overrides ini file input."""
         replay_file = self.config.getoption("--rank-replay")
@@ -220,6 +794,14 @@ class RTPRunner:
             hist_len = ini_val if ini_val else hist_len
         return int(hist_len)
 
+    def parse_history(self) -> int:
+        """Get number of runs to log, non-default CLI overrides ini file."""
+        history = self.config.getoption("--rank-history")
+        if history == DEFAULT_HISTORY:
+            ini_val = self.config.getini("rank_history")
+            history = ini_val if ini_val else history
+        return int(history)
+
     def parse_seed(self) -> int:
         """Get random seed, non-default CLI overrides ini file input."""
         rand_seed = self.config.getoption("--rank-seed")
@@ -228,71 +810,333 @@ class RTPRunner:
             rand_seed = ini_val if ini_val else rand_seed
         return int(rand_seed)
 
-    def load_feature(
-            self,
-            feature_name: str,
-            items: list[Item],
-            reverse: bool) -> list[float]:
+    def parse_rtp_shard(self) -> tuple[int, int] | None:
+        """Get shard as (K, N), non-default CLI overrides ini file input."""
+        shard = self.config.getoption("--rank-shard")
+        if shard == DEFAULT_SHARD:
+            ini_val = self.config.getini("rank_shard")
+            shard = ini_val if ini_val else shard
+        return parse_shard(shard) if shard else None
+
+    def parse_adaptive(self) -> bool:
+        """Get adaptive mode, CLI flag or ini file input."""
+        return (
+            self.config.getoption("--rank-adaptive")
+            or self.config.getini("rank_adaptive")
+        )
+
+    def parse_fixture_aware(self) -> bool:
+        """Get fixture-aware ordering, CLI flag or ini file input."""
+        return (
+            self.config.getoption("--rank-fixture-aware")
+            or self.config.getini("rank_fixture_aware")
+        )
+
+    def parse_max_memory(self) -> float | None:
+        """Get memory budget, non-default CLI overrides ini file input."""
+        max_memory = self.config.getoption("--rank-max-memory")
+        if max_memory == DEFAULT_MAX_MEMORY:
+            ini_val = self.config.getini("rank_max_memory")
+            max_memory = ini_val if ini_val else max_memory
+        return float(max_memory) if max_memory else None
+
+    def parse_store(self) -> str:
+        """Get store backend, non-default CLI overrides ini file input."""
+        store = self.config.getoption("--rank-store")
+        if store == DEFAULT_STORE:
+            ini_val = self.config.getini("rank_store")
+            store = ini_val if ini_val else store
+        return store
+
+    def parse_partition_depth(self) -> int:
+        """Get partition depth, non-default CLI overrides ini file input."""
+        depth = self.config.getoption("--rank-partition-depth")
+        if depth == DEFAULT_PARTITION_DEPTH:
+            ini_val = self.config.getini("rank_partition_depth")
+            depth = ini_val if ini_val else depth
+        return int(depth)
+
+    def parse_env(self) -> tuple[str, str] | None:
+        """Get environment components and key,
+        non-default CLI overrides ini file input.
         """
-        Load and normalize test-wise feature data for the current test suite,
-            - reverse: True if originally smaller value means higher priority.
+        spec = self.config.getoption("--rank-env")
+        if spec == DEFAULT_ENV:
+            ini_val = self.config.getini("rank_env")
+            spec = ini_val if ini_val else spec
+        if not spec:
+            return None
+        env = get_environment(spec)
+        return (spec, env) if env is not None else None
+
+    def parse_timeout(self) -> tuple[float, float] | None:
+        """Get timeout factor and minimum timeout,
+        non-default CLI overrides ini file.
         """
-        # Load original data.
-        key = os.path.join(DATA_DIR, feature_name)
-        values = self.config.cache.get(key, {})
-        # 0 if not exist: prioritizes newly selected/created tests.
-        values = [values.get(item.nodeid, 0) for item in items]
+        factor = self.config.getoption("--rank-timeout")
+        minimum = self.config.getoption("--rank-timeout-min")
+        try:
+            if factor == DEFAULT_TIMEOUT:
+                ini_val = self.config.getini("rank_timeout")
+                factor = (
+                    positive_float_type("--rank-timeout")(ini_val)
+                    if ini_val else factor
+                )
+            if minimum == DEFAULT_TIMEOUT_MIN:
+                ini_val = self.config.getini("rank_timeout_min")
+                minimum = (
+                    non_negative_float_type("--rank-timeout-min")(ini_val)
+                    if ini_val else minimum
+                )
+        except argparse.ArgumentTypeError as e:
+            raise pytest.UsageError(f"pytest-ranking: {e}")
+        if factor is None:
+            return None
+        return factor, minimum
+
+    def parse_regression(self) -> float | None:
+        """Get regression threshold, non-default CLI overrides ini file."""
+        threshold = self.config.getoption("--rank-regression")
+        if threshold == DEFAULT_REGRESSION:
+            ini_val = self.config.getini("rank_regression")
+            threshold = (
+                positive_float_type("--rank-regression")(ini_val)
+                if ini_val else threshold
+            )
+        return threshold
+
+    def parse_regression_report(self) -> str | None:
+        """Get regression report path, non-default CLI overrides ini file."""
+        path = self.config.getoption("--rank-regression-report")
+        if path == DEFAULT_REGRESSION_REPORT:
+            ini_val = self.config.getini("rank_regression_report")
+            path = ini_val if ini_val else path
+        return path
+
+    def parse_novelty(self) -> float:
+        """Get novelty boost, non-default CLI overrides ini file."""
+        novelty = self.config.getoption("--rank-novelty")
+        if novelty == DEFAULT_NOVELTY:
+            ini_val = self.config.getini("rank_novelty")
+            novelty = novelty_type(ini_val) if ini_val else novelty
+        return novelty
+
+    def parse_change_timeout(self) -> float:
+        """Get change tracking timeout, non-default CLI overrides ini file."""
+        timeout = self.config.getoption("--rank-change-timeout")
+        if timeout == DEFAULT_CHANGE_TIMEOUT:
+            ini_val = self.config.getini("rank_change_timeout")
+            timeout = ini_val if ini_val else timeout
+        return float(timeout)
+
+    def wait_for_change_tracker(self) -> None:
+        """Wait for changed files to be detected in the background."""
+        start_time = time.perf_counter()
+        if not self.chgtracker.join(self.change_timeout):
+            warnings.warn(pytest.PytestWarning(
+                "pytest-ranking: detecting changed files did not finish"
+                + f" within {self.change_timeout}s,"
+                + " proceeding without change information."
+            ))
+        self.log["Time waiting for changed files (s)"] = (
+            time.perf_counter() - start_time
+        )
+
+    def parse_profile(self, name: str) -> str:
+        """Get profile output path, non-default CLI overrides ini file input.
+        Under pytest-xdist, each worker writes to its own file.
+        """
+        path = self.config.getoption(name)
+        if path == DEFAULT_PROFILE:
+            ini_val = self.config.getini(name)
+            path = ini_val if ini_val else path
+        worker_input = getattr(self.config, "workerinput", None)
+        if path and worker_input:
+            root, ext = os.path.splitext(path)
+            path = f"{root}.{worker_input['workerid']}{ext}"
+        return path
+
+    @pytest.hookimpl(trylast=True)
+    def pytest_ranking_features(
+            self, config: Config) -> list[FeatureProvider]:
+        """Built-in heuristics."""
+        return [
+            FeatureProvider(
+                "time",
+                cached_feature("last_durations", estimate=True),
+                needs_history=True,
+                reverse=True),
+            FeatureProvider(
+                "fail",
+                cached_feature("num_runs_since_fail", estimate=True),
+                needs_history=True,
+                reverse=True),
+            FeatureProvider("change", self.change_similarity),
+            FeatureProvider(
+                "memory",
+                cached_feature("peak_rss"),
+                needs_history=True,
+                reverse=True),
+            FeatureProvider(
+                "cofail",
+                self.cofailure_similarity,
+                needs_history=True),
+        ]
+
+    def change_similarity(
+            self,
+            items: list[Item],
+            store: CacheStore | None) -> np.ndarray:
+        """Similarity between each test and the changed files."""
+        similarity = self.chgtracker.compute_test_suite_similarity(items)
+        return np.array([similarity[item.nodeid] for item in items])
+
+    def cofailure_similarity(
+            self,
+            items: list[Item],
+            store: CacheStore) -> np.ndarray:
+        """Co-failure of each test with changed or recently failed tests."""
+        change_tokens = get_change_tokens(
+            self.chgtracker.changed_files, [item.nodeid for item in items])
+        return cofailure_feature(items, store, change_tokens)
+
+    def get_feature_providers(self) -> dict[str, FeatureProvider]:
+        """Get heuristics provided by this and other plugins."""
+        providers = {}
+        results = self.config.hook.pytest_ranking_features(config=self.config)
+        for provider in [x for result in results for x in result]:
+            if provider.name in providers:
+                raise pytest.UsageError(
+                    f"pytest-ranking: heuristic `{provider.name}`"
+                    + " is provided more than once."
+                )
+            providers[provider.name] = provider
+        unknown = [name for name in self.weights if name not in providers]
+        if unknown:
+            raise pytest.UsageError(
+                "pytest-ranking: unknown heuristic in `--rank-weight`: "
+                + ", ".join(unknown)
+                + ". Available: " + ", ".join(providers) + "."
+            )
+        return providers
+
+    def load_feature(
+            self,
+            provider: FeatureProvider,
+            items: list[Item]) -> np.ndarray:
+        """Compute and normalize values of a heuristic for the test suite."""
+        store = self.store if provider.needs_history else None
+        values = np.asarray(provider.compute(items, store), dtype=float)
+        if values.shape != (len(items),):
+            raise ValueError(
+                f"pytest-ranking: heuristic `{provider.name}` returned"
+                + f" {values.shape} values for {len(items)} tests."
+            )
         # Normalize to [0, 1] range.
-        values = min_max_normalization(values)
+        default, normalizations = self.normalize
+        normalization = normalizations.get(provider.name, default)
+        values = NORMALIZATIONS[normalization](values)
         # If smaller values is better, transform to larger is better.
-        if reverse:
+        if provider.reverse:
             values = 1 - values
-        return values.tolist()
+        return values
 
     def run_rtp(self, items: list[Item]) -> None:
         """Run test prioritization algorithm."""
         # Get pytest default order.
         init_order = {item.nodeid: i for i, item in enumerate(items)}
-        # Load code change features.
-        self.chgtracker.compute_test_suite_similarity(items)
+        # Wait for code change data.
+        self.wait_for_change_tracker()
         num_delta_file = self.chgtracker.num_delta_files
         compute_time = self.chgtracker.runtime
         self.log["Number of changed Python files"] = num_delta_file
         self.log["Time to compute test-change similarity (s)"] = compute_time
 
         # Start reordering.
-        start_time = time.time()
+        start_time = time.perf_counter()
+        self.profiler.count("items_ranked", len(items))
 
         # Get priority score per test, prioritized tests have LOWER scores.
         scores = {}
-        if self.replay_file and os.path.exists(self.replay_file):
-            # Run tests in the order specified in the replay file.
-            with open(self.replay_file) as f:
-                test_list = [x.strip() for x in f.readlines()]
-                scores = {x: i for i, x in enumerate(test_list)}
-        elif self.weights == [0, 0, 0]:
+        if self.is_random_order():
             # Run tests in random order.
             # Pre-sort so that all workers gets the same order in pytest-xdist.
             # https://pytest-xdist.readthedocs.io/en/stable/known-limitations.html
             items.sort(key=lambda item: item.nodeid)
             random.seed(self.seed)
             scores = {item.nodeid: random.random() for item in items}
+        elif self.strategy == STRATEGY.BANDIT:
+            # Sample failure probability per test from its posterior.
+            nodeids = [item.nodeid for item in items]
+            bandit = ThompsonSampler(self.store.get("bandit_state", {}))
+            with self.profiler.phase("scoring"):
+                samples = bandit.sample(nodeids, self.seed)
+                scores = dict(zip(nodeids, (-samples).tolist()))
+        elif self.strategy == STRATEGY.COST:
+            # Failure probability per predicted second.
+            nodeids = [item.nodeid for item in items]
+            num_runs_since_fail = cached_feature(
+                "num_runs_since_fail", estimate=True)(items, self.store)
+            similarity = self.change_similarity(items, None)
+            costs = self.predict_costs(items)
+            with self.profiler.phase("scoring"):
+                priority = cost_cognizant_priority(
+                    failure_probability(num_runs_since_fail, similarity),
+                    costs)
+                scores = dict(zip(nodeids, (-priority).tolist()))
+            self.log["Time to compute test-change similarity (s)"] = (
+                self.chgtracker.runtime
+            )
         else:
             # Prioritize by test features.
-            w_time, w_fail, w_rel = self.weights
-            h_time = self.load_feature("last_durations", items, True)
-            h_fail = self.load_feature("num_runs_since_fail", items, True)
-            h_rel = self.load_feature("change_similarity", items, False)
+            providers = self.get_feature_providers()
+            if self.strategy == STRATEGY.LEARNED:
+                # The model may learn to use any built-in heuristic.
+                names = list(BUILTIN_FEATURES) + [
+                    name for name, w in self.weights.items()
+                    if w and name not in BUILTIN_FEATURES
+                ]
+            else:
+                # Only compute weighted heuristics.
+                names = [name for name, w in self.weights.items() if w]
+            features = np.column_stack(
+                [self.load_feature(providers[name], items) for name in names]
+            )
+            weights = np.array([self.weights.get(name, 0) for name in names])
+            nodeids = [item.nodeid for item in items]
 
-            def hybrid(i):
-                # Linearly combine different heurisic values.
+            with self.profiler.phase("scoring"):
+                if self.strategy == STRATEGY.LEARNED:
+                    # Predict failure probability from heuristic values.
+                    model = FailurePredictor.from_dict(
+                        self.store.get("failure_model", {}), names, weights)
+                    self.ranked_features = (
+                        names,
+                        {nodeid: i for i, nodeid in enumerate(nodeids)},
+                        features)
+                    priority = model.predict(features)
+                else:
+                    # Linearly combine different heurisic values.
+                    priority = features @ weights
+                if self.novelty:
+                    priority = priority + self.novelty * self.is_new(items)
                 # The higher, the earlier the test will be run.
-                s = h_time[i] * w_time + h_fail[i] * w_fail + h_rel[i] * w_rel
-                return -s
-
-            scores = {item.nodeid: hybrid(i) for i, item in enumerate(items)}
+                scores = dict(zip(nodeids, (-priority).tolist()))
+            # Include similarity if computed.
+            self.log["Time to compute test-change similarity (s)"] = (
+                self.chgtracker.runtime
+            )
 
-        rank = get_ranking(scores, self.level, init_order)
+        with self.profiler.phase("grouping"):
+            rank = get_ranking(scores, self.level, init_order)
+        if self.replay_file and os.path.exists(self.replay_file):
+            # Run tests in the order specified in the replay file,
+            # then unlisted tests by their rank.
+            listed = load_replay(self.replay_file, list(rank))
+            rank = replay_ranking(listed, rank)
+            self.log["Number of tests not listed in replay file"] = (
+                len(rank) - len(listed)
+            )
 
         # Respect tests with declared order dependency (OD).
         od_items: list[Item] = []
@@ -308,23 +1152,286 @@ class RTPRunner:
             else:
                 nod_items.append(item)
         # Only reorder tests with no declared OD.
-        nod_items.sort(
-            key=lambda item: (
-                rank.get(item.nodeid, 0), init_order[item.nodeid]
+        with self.profiler.phase("sorting"):
+            nod_items.sort(
+                key=lambda item: (
+                    rank.get(item.nodeid, 0), init_order[item.nodeid]
+                )
             )
-        )
+        if self.fixture_aware:
+            nod_items = self.reduce_fixture_churn(nod_items)
         # Run OD tests first.
         items[:] = od_items + nod_items
+        if self.shard:
+            self.select_shard(items, od_items)
+        if self.adaptive:
+            self.start_adaptive(items, len(od_items))
 
         # Record reordering runtime.
-        self.log["Time to reorder tests (s)"] = time.time() - start_time
+        self.log["Time to reorder tests (s)"] = (
+            time.perf_counter() - start_time
+        )
+
+    def reduce_fixture_churn(self, items: list[Item]) -> list[Item]:
+        """Reorder ranked tests to set up expensive fixtures less often."""
+        fixture_keys = [get_fixture_keys(item) for item in items]
+        fixture_costs = self.store.get_items(
+            "fixture_costs",
+            sorted({key for keys in fixture_keys for _, key in keys}))
+        durations = self.predict_durations(items)
+        with self.profiler.phase("grouping"):
+            chains, node_costs = get_scope_costs(
+                items, fixture_keys, fixture_costs)
+            order = reduce_fixture_churn(
+                chains, node_costs, [x or 0.0 for x in durations])
+        before = estimate_overhead(chains, node_costs)
+        after = estimate_overhead([chains[i] for i in order], node_costs)
+        self.log["Estimated fixture setup overhead (s)"] = after
+        self.log["Estimated fixture setup overhead avoided (s)"] = (
+            before - after
+        )
+        return [items[i] for i in order]
+
+    def predict_costs(self, items: list[Item]) -> np.ndarray:
+        """Get recorded setup, call and teardown time of each test,
+        estimated from its closest test group if not recorded.
+        Caches without recorded costs fall back to durations.
+        """
+        nodeids = [item.nodeid for item in items]
+        costs = self.store.get_items("last_costs", nodeids)
+        estimator = GroupEstimator.from_store(
+            self.store, "last_costs", [x for x in nodeids if x not in costs])
+        durations = self.predict_durations(items)
+        return np.array([
+            costs[x] if x in costs else estimator.estimate(x, duration or 0)
+            for x, duration in zip(nodeids, durations)
+        ])
+
+    def is_new(self, items: list[Item]) -> np.ndarray:
+        """Whether each test has no recorded duration."""
+        nodeids = [item.nodeid for item in items]
+        recorded = self.store.get_items("last_durations", nodeids)
+        is_new = np.array([x not in recorded for x in nodeids])
+        self.log["Number of new tests boosted"] = int(is_new.sum())
+        return is_new
+
+    def predict_durations(self, items: list[Item]) -> list[float | None]:
+        """Get recorded duration of each test, or the mean duration of
+        its closest test group if not recorded, None if no test is.
+        """
+        nodeids = [item.nodeid for item in items]
+        durations = self.store.get_items("last_durations", nodeids)
+        estimator = GroupEstimator.from_store(
+            self.store,
+            "last_durations",
+            [x for x in nodeids if x not in durations])
+        return [
+            durations[x] if x in durations else estimator.estimate(x, None)
+            for x in nodeids
+        ]
+
+    def select_shard(self, items: list[Item], od_items: list[Item]) -> None:
+        """Only keep ranked tests of this shard, deselect the others.
+        Tests with declared order dependency are kept in the same shard.
+        """
+        shard, num_shards = self.shard
+        durations = dict(zip(
+            [item.nodeid for item in items], self.predict_durations(items)))
+        with self.profiler.phase("grouping"):
+            units = [od_items] if od_items else []
+            units += [[item] for item in items[len(od_items):]]
+            unit_durations = [
+                sum(durations[item.nodeid] for item in unit)
+                if all(durations[item.nodeid] is not None for item in unit)
+                else None
+                for unit in units
+            ]
+            assigned = assign_shards(unit_durations, num_shards)
+        selected, deselected = [], []
+        predicted = 0.0
+        for unit, unit_shard, duration in zip(
+                units, assigned, unit_durations):
+            if unit_shard == shard - 1:
+                selected.extend(unit)
+                predicted += duration or 0.0
+            else:
+                deselected.extend(unit)
+        if deselected:
+            self.config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+        self.log[f"Number of tests in shard {shard}/{num_shards}"] = (
+            len(selected)
+        )
+        self.log["Predicted duration of tests in shard (s)"] = predicted
+
+    def start_adaptive(self, items: list[Item], num_od_items: int) -> None:
+        """Schedule ranked tests adaptively in `pytest_runtestloop`."""
+        # pytest-xdist runs its own loop in workers.
+        if (
+            hasattr(self.config, "workerinput")
+            or self.config.pluginmanager.has_plugin("dsession")
+        ):
+            warnings.warn(pytest.PytestWarning(
+                "pytest-ranking: --rank-adaptive is ignored"
+                + " with pytest-xdist."
+            ))
+            return
+        self.scheduler = AdaptiveScheduler(
+            items,
+            self.level,
+            get_change_tokens(
+                self.chgtracker.changed_files,
+                [item.nodeid for item in items]),
+            CoFailureGraph(self.store.get("cofailure_graph", {})),
+            num_od_items)
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session: Session) -> bool | None:
+        """Run tests in the order of the adaptive scheduler,
+        same as the default loop of pytest otherwise.
+        """
+        if (
+            self.scheduler is None
+            or session.testsfailed
+            or session.config.option.collectonly
+        ):
+            # Let pytest handle collection errors and collect-only runs.
+            return None
+        item = self.scheduler.pop()
+        while item is not None:
+            # The next test is fixed before running a test, since fixtures
+            # are torn down depending on it, a failure promotes later tests.
+            nextitem = self.scheduler.pop()
+            item.config.hook.pytest_runtest_protocol(
+                item=item, nextitem=nextitem)
+            if session.shouldfail:
+                raise session.Failed(session.shouldfail)
+            if session.shouldstop:
+                raise session.Interrupted(session.shouldstop)
+            item = nextitem
+        self.log["Number of tests promoted after failures"] = (
+            self.scheduler.num_promoted
+        )
+        return True
 
     def pytest_runtest_logreport(self, report: TestReport) -> None:
         """Record test result of each executed test."""
-        if not report.skipped and report.when == "call":
-            # No skipped: only look at the executed test.
-            # `call`: only look at called duration (ignore setup/teardown).
-            self.test_reports.append(report)
+        if report.failed and self.scheduler is not None:
+            self.scheduler.on_failure(report.nodeid)
+        # Set by the plugin, also in reports sent by pytest-xdist workers.
+        if getattr(report, "rank_timed_out", False):
+            self.timed_out.add(report.nodeid)
+        features = getattr(report, "rank_features", None)
+        if features is not None:
+            self.executed_features[report.nodeid] = features
+        # Only keep compact results instead of the reports.
+        executed = self.results.add(report)
+        if (
+            executed
+            and self.checkpoint is not None
+            and self.checkpoint.is_due(self.results)
+        ):
+            with self.profiler.phase("persistence"):
+                self.checkpoint.write(self.results)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_fixture_setup(self, fixturedef, request):
+        """Record setup time of package, module and class scoped fixtures."""
+        key = get_fixture_key(fixturedef, request)
+        start_time = time.perf_counter()
+        yield
+        if key is None:
+            return
+        total, num_setups = self.fixture_costs.get(key, (0.0, 0))
+        self.fixture_costs[key] = (
+            total + time.perf_counter() - start_time, num_setups + 1
+        )
+        # Finalizers run in reverse order, this one before the teardown.
+        fixturedef.addfinalizer(
+            lambda: self.teardown_start.update({key: time.perf_counter()}))
+
+    def pytest_collection_finish(self, session: Session) -> None:
+        """Predict timeouts of collected tests."""
+        if not self.timeout or not session.items:
+            return
+        if not timeout_supported():
+            warnings.warn(pytest.PytestWarning(
+                "pytest-ranking: `--rank-timeout` needs SIGALRM"
+                + " and tests running in the main thread, ignored."
+            ))
+            return
+        factor, minimum = self.timeout
+        self.timeouts = predict_timeouts(
+            self.store,
+            [item.nodeid for item in session.items],
+            factor,
+            minimum)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_call(self, item: Item):
+        """Measure memory and CPU usage of a test, and fail it
+        if it takes longer than its predicted timeout.
+        """
+        with TimeLimit(self.timeouts.get(item.nodeid)) as limit:
+            # Usage is only recorded for ranking and memory budgets.
+            meter = None
+            if self.config.getoption("--rank") or self.max_memory:
+                meter = ResourceMeter()
+            yield
+            if meter is not None:
+                self.resource_usage[item.nodeid] = meter.stop()
+        if limit.expired:
+            self.timed_out.add(item.nodeid)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_makereport(self, item: Item, call):
+        """Attach memory and CPU usage, whether it timed out, and its
+        heuristic values of the learned strategy, to the report of a test,
+        so that pytest-xdist sends them to the controller.
+        """
+        outcome = yield
+        usage = self.resource_usage.pop(item.nodeid, None)
+        if call.when == "call" and usage is not None:
+            report = outcome.get_result()
+            report.rank_peak_rss, report.rank_cpu_ratio = usage
+        if call.when == "call" and item.nodeid in self.timed_out:
+            outcome.get_result().rank_timed_out = True
+        if call.when == "call" and self.ranked_features is not None:
+            names, index, features = self.ranked_features
+            row = index.get(item.nodeid)
+            if row is not None:
+                outcome.get_result().rank_features = dict(
+                    zip(names, features[row].tolist()))
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_make_scheduler(self, config: Config, log):
+        """Schedule tests by their memory and CPU usage under pytest-xdist,
+        if a memory budget is set.
+        """
+        if (
+            not self.config.getoption("--rank")
+            or not self.max_memory
+            or config.getvalue("dist") != "load"
+        ):
+            return None
+        from .xdist_scheduler import ResourceAwareScheduling
+        return ResourceAwareScheduling(
+            config,
+            log,
+            self.store.get_items("peak_rss"),
+            self.store.get_items("cpu_ratios"),
+            self.max_memory,
+            os.cpu_count() or 1)
+
+    def pytest_fixture_post_finalizer(self, fixturedef, request) -> None:
+        """Record teardown time of fixtures timed in setup."""
+        key = get_fixture_key(fixturedef, request)
+        start_time = self.teardown_start.pop(key, None)
+        if start_time is not None and key in self.fixture_costs:
+            total, num_setups = self.fixture_costs[key]
+            self.fixture_costs[key] = (
+                total + time.perf_counter() - start_time, num_setups
+            )
 
     def pytest_report_header(self, config: Config) -> str:
         """Report plugin configurations before test session starts."""
@@ -332,6 +1439,7 @@ class RTPRunner:
         if not self.config.getoption("--rank"):
             return None
         weight = self.config.getoption("--rank-weight")
+        strategy = self.config.getoption("--rank-strategy")
         replay = self.config.getoption("--rank-replay")
         level = self.config.getoption("--rank-level")
         hist_len = self.config.getoption("--rank-hist-len")
@@ -339,71 +1447,283 @@ class RTPRunner:
         report = [
             f"Using --rank-weight={weight}",
             f"Using --rank-level={level}",
+            f"Using --rank-strategy={strategy}",
             f"Using --rank-hist-len={hist_len}",
             f"Using --rank-seed={random_seed}",
             f"Using --rank-replay={replay}",
         ]
+        normalize = self.config.getoption("--rank-normalize")
+        if normalize != DEFAULT_NORMALIZATION:
+            report.append(f"Using --rank-normalize={normalize}")
+        if self.env:
+            spec, env = self.env
+            report.append(f"Using --rank-env={spec} ({env})")
+        if self.partition_depth != DEFAULT_PARTITION_DEPTH:
+            report.append(
+                f"Using --rank-partition-depth={self.partition_depth}")
+        if self.profile_file:
+            report.append(f"Using --rank-profile={self.profile_file}")
+        if self.shard:
+            shard, num_shards = self.shard
+            report.append(f"Using --rank-shard={shard}/{num_shards}")
+        if self.adaptive:
+            report.append("Using --rank-adaptive")
+        if self.fixture_aware:
+            report.append("Using --rank-fixture-aware")
+        if self.max_memory:
+            report.append(f"Using --rank-max-memory={self.max_memory:g}")
+        if self.novelty:
+            report.append(f"Using --rank-novelty={self.novelty:g}")
+        if self.timeout:
+            factor, minimum = self.timeout
+            report.append(
+                f"Using --rank-timeout={factor:g}"
+                + f" --rank-timeout-min={minimum:g}")
+        if self.regression:
+            report.append(f"Using --rank-regression={self.regression:g}")
+        if self.pstats_file:
+            report.append(f"Using --rank-profile-pstats={self.pstats_file}")
         return "\n".join(report)
 
     @pytest.hookimpl(trylast=True)
     def pytest_collection_modifyitems(self, items: list[Item]) -> None:
         if self.config.getoption("--rank"):
-            if self.replay_file and self.weights == [0, 0, 0]:
+            if self.replay_file and self.is_random_order():
                 raise argparse.ArgumentTypeError(
                     "--rank-replay cannot be used together with random order."
                 )
             self.run_rtp(items)
 
+    def pytest_deselected(self, items: list[Item]) -> None:
+        self.deselected.extend(item.nodeid for item in items)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_xdist_node_collection_finished(self, node, ids: list[str]):
+        """Collect tests of pytest-xdist workers on the controller."""
+        self.worker_collected.update(ids)
+
+    @pytest.hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node, error) -> None:
+        """Collect tests deselected by pytest-xdist workers."""
+        output = getattr(node, "workeroutput", {})
+        self.deselected.extend(output.get("rank_deselected", []))
+
+    def resolve_pending_changes(self, session: Session) -> None:
+        """Remove pending changed files whose related tests have run.
+        Known test modules that were not collected, e.g., of other
+        folders than the given paths, also need to run to resolve a change.
+        """
+        def resolve(state: dict) -> dict:
+            pending = PendingChanges(state)
+            pending.resolve(collected, executed, known)
+            return pending.to_dict()
+
+        if self.store.get("pending_changes", {}):
+            collected = (
+                [item.nodeid for item in session.items]
+                + self.deselected
+                + sorted(self.worker_collected)
+            )
+            executed = set(self.results.get_nodeids())
+            known = get_known_modules(
+                self.store, self.config.rootpath, collected)
+            self.store.update("pending_changes", {}, resolve)
+
     def pytest_sessionfinish(self, session: Session, exitstatus: int) -> None:
-        start_time = time.time()
-        compute_test_features(self.config, self.test_reports, self.hist_len)
+        # Make sure hashes are saved if tests were not ranked.
+        if self.chgtracker.thread is not None:
+            self.wait_for_change_tracker()
+        # Sent to the pytest-xdist controller to resolve pending changes.
+        if hasattr(self.config, "workeroutput"):
+            self.config.workeroutput["rank_deselected"] = self.deselected
+        # Interrupted runs, e.g., by collection errors, keep pending changes.
+        if (
+            self.checkpoint is not None
+            and exitstatus != pytest.ExitCode.INTERRUPTED
+        ):
+            self.resolve_pending_changes(session)
+        start_time = time.perf_counter()
+        # Fixtures are set up in pytest-xdist workers.
+        if self.fixture_costs:
+            self.store.update_items("fixture_costs", {
+                key: round(total / num_setups, 3)
+                for key, (total, num_setups) in self.fixture_costs.items()
+            })
+        # Only the pytest-xdist controller has results of all tests,
+        # and records them once per session.
+        if self.checkpoint is not None:
+            self.record_results()
         # Record feature collection runtime.
         self.log["Time to collect test features (s)"] = (
-            time.time() - start_time
+            time.perf_counter() - start_time
         )
+        self.profiler.dump(self.profile_file)
+
+    def record_results(self) -> None:
+        """Record results of all executed tests of the session."""
+        nodeids = self.results.get_nodeids()
+        failed = self.results.get_failed()
+        durations = self.results.get_durations()
+        compute_test_features(
+            self.store, nodeids, failed, durations, self.hist_len)
+        record_test_modules(self.store, nodeids)
+        record_resources(
+            self.store,
+            nodeids,
+            self.results.get_peak_rss(),
+            self.results.get_cpu_ratio())
+        record_costs(
+            self.store,
+            nodeids,
+            sum(self.results.get_durations(phase=x) for x in PHASES))
+        if self.regression:
+            self.report_regressions(nodeids, durations)
+        if self.timeout or self.regression:
+            # Timed out durations would raise later timeouts.
+            kept = [
+                i for i, x in enumerate(nodeids) if x not in self.timed_out
+            ]
+            record_recent_durations(
+                self.store, [nodeids[i] for i in kept], durations[kept])
+        if self.timeout:
+            self.log["Number of tests timed out"] = len(self.timed_out)
+        self.update_model(nodeids, failed)
+        self.update_bandit(nodeids, failed)
+        if self.history:
+            with self.profiler.phase("persistence"):
+                HistoryLog.from_store(self.store, self.history).append(
+                    make_record(
+                        nodeids,
+                        failed,
+                        durations,
+                        self.chgtracker.changed_files))
+        # All results are saved.
+        self.checkpoint.remove()
+
+    def report_regressions(
+            self,
+            nodeids: list[str],
+            durations: np.ndarray) -> None:
+        """Detect tests whose duration regressed from their recent
+        durations, before this run is recorded.
+        """
+        self.regressions = find_regressions(
+            self.store, nodeids, durations, self.regression)
+        if self.regression_report:
+            write_regression_report(
+                self.regression_report, self.regressions, self.regression)
+
+    def update_model(self, nodeids: list[str], failed: np.ndarray) -> None:
+        """Train the learned model once per session, on outcomes of
+        the ranked tests executed by this process or pytest-xdist workers.
+        """
+        executed = [
+            i for i, nodeid in enumerate(nodeids)
+            if nodeid in self.executed_features
+        ]
+        if not executed:
+            return
+        names = list(self.executed_features[nodeids[executed[0]]])
+        weights = np.array([self.weights.get(name, 0) for name in names])
+        features = np.array([
+            [self.executed_features[nodeids[i]][name] for name in names]
+            for i in executed
+        ])
+
+        def train(data: dict) -> dict:
+            # Continue from the model saved by concurrent sessions.
+            model = FailurePredictor.from_dict(data, names, weights)
+            model.update(features, failed[executed])
+            return model.to_dict()
+
+        self.store.update("failure_model", {}, train)
+
+    def update_bandit(self, nodeids: list[str], failed: np.ndarray) -> None:
+        """Reward tests of the bandit strategy by their outcomes,
+        once per session on results of all pytest-xdist workers.
+        """
+        if (
+            not self.config.getoption("--rank")
+            or self.strategy != STRATEGY.BANDIT
+            or self.is_random_order()
+        ):
+            return
+
+        def reward(state: dict) -> dict:
+            # Continue from the posteriors saved by concurrent sessions.
+            bandit = ThompsonSampler(state)
+            bandit.update(nodeids, failed)
+            return bandit.to_dict()
+
+        self.store.update("bandit_state", {}, reward)
+
+    def pytest_unconfigure(self, config: Config) -> None:
+        self.store.close()
 
     def pytest_terminal_summary(
             self,
             terminalreporter: TerminalReporter,
             exitstatus: int,
             config: Config) -> None:
-        """Report plugin runtime when it is enabled."""
+        """Report plugin runtime when it is enabled,
+        and duration regressions when they are detected.
+        """
         if self.config.getoption("--rank"):
             tr = terminalreporter
             tr._tw.sep("=", "pytest-ranking summary info")
             for k, v in self.log.items():
                 tr._tw.line(f"{k}: {v}")
-        pass
+        if self.regression and self.checkpoint is not None:
+            tr = terminalreporter
+            tr._tw.sep("=", "pytest-ranking duration regressions")
+            for regression in self.regressions:
+                tr._tw.line(format_regression(regression))
+            if not self.regressions:
+                tr._tw.line("No test duration regressed.")
 
 
 def compute_test_features(
-        config: Config,
-        test_reports: list[TestReport],
+        store: CacheStore,
+        nodeids: list[str],
+        failed: np.ndarray,
+        durations: np.ndarray,
         hist_len: int) -> None:
-    # Get the most recent execution time per test.
-    key = os.path.join(DATA_DIR, "last_durations")
-    last_durations = config.cache.get(key, {})
-    for report in test_reports:
-        nodeid = report.nodeid
-        duration = report.duration
-        last_durations[nodeid] = round(duration, 3)
-    config.cache.set(key, last_durations)
-
-    # Get the number of runs since its last failure per test.
-    key = os.path.join(DATA_DIR, "num_runs_since_fail")
-    num_runs_since_fail = config.cache.get(key, {})
-    for report in test_reports:
-        nodeid = report.nodeid
-        outcome = report.outcome
-        if outcome == "failed":
-            num_runs_since_fail[nodeid] = 0
-        else:
-            # Cap within history limit.
-            num_runs_since_fail[nodeid] = min(
-                hist_len,
-                num_runs_since_fail.get(nodeid, 0) + 1
-            )
-    config.cache.set(key, num_runs_since_fail)
+    """Update heuristic data with results of executed tests,
+    given in execution order. Data are read and updated under the store
+    lock, so that group stats stay consistent with concurrent sessions.
+    """
+    with store.file_lock:
+        # Get the most recent execution time per test.
+        last_durations = dict(zip(nodeids, durations.round(3).tolist()))
+        previous = store.get_items("last_durations", nodeids)
+        store.update_items("last_durations", last_durations)
+        update_group_stats(store, "last_durations", last_durations, previous)
+
+        # Get the number of runs since its last failure per test.
+        num_runs_since_fail = store.get_items("num_runs_since_fail", nodeids)
+        previous = dict(num_runs_since_fail)
+        for nodeid, is_failed in zip(nodeids, failed):
+            if is_failed:
+                num_runs_since_fail[nodeid] = 0
+            else:
+                # Cap within history limit.
+                num_runs_since_fail[nodeid] = min(
+                    hist_len,
+                    num_runs_since_fail.get(nodeid, 0) + 1
+                )
+        store.update_items("num_runs_since_fail", num_runs_since_fail)
+        update_group_stats(
+            store, "num_runs_since_fail", num_runs_since_fail, previous)
+
+    # Record which tests failed together.
+    record_cofailures(
+        store, [nodeid for nodeid, x in zip(nodeids, failed) if x])
+
+
+def pytest_addhooks(pluginmanager: pytest.PytestPluginManager) -> None:
+    """Register hooks of this plugin, see `hooks.py`."""
+    from . import hooks
+    pluginmanager.add_hookspecs(hooks)
 
 
 @pytest.hookimpl(trylast=True)
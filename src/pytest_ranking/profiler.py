@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # Not available on Windows.
+    resource = None
+
+
+# Phases of the plugin overhead, in the order they usually take place.
+PHASES = (
+    "discovery",
+    "hashing",
+    "cache_load",
+    "similarity",
+    "scoring",
+    "grouping",
+    "sorting",
+    "persistence",
+)
+
+# Peak resident set size in bytes before the last `reset_peak_rss`,
+# which also resets the peak reported by `getrusage`.
+_peak_before_reset = 0
+
+
+def get_peak_rss() -> int | None:
+    """Get peak resident set size of this process in bytes,
+    including peaks before `reset_peak_rss`.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes.
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    return max(peak, _peak_before_reset)
+
+
+def get_rss() -> int | None:
+    """Get current resident set size of this process in bytes,
+    only available on Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak resident set size reported by `get_hwm_rss`,
+    return whether it is supported (Linux only). The peak so far is
+    kept for `get_peak_rss`.
+    """
+    global _peak_before_reset
+    _peak_before_reset = get_peak_rss() or 0
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_hwm_rss() -> int | None:
+    """Get peak resident set size of this process in bytes since
+    `reset_peak_rss`, only available on Linux.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class Profiler:
+    """Record wall time per phase and counters of the plugin overhead."""
+    def __init__(
+            self,
+            enabled: bool = False,
+            pstats_path: str | None = None) -> None:
+        # Expensive counters are only recorded if profiling is enabled.
+        self.enabled = enabled
+        self.phases_ns = {phase: 0 for phase in PHASES}
+        self.counters = {}
+        self.pstats_path = pstats_path
+        self.cprofile = cProfile.Profile() if pstats_path else None
+        # Only phases in the creating thread are profiled by cProfile,
+        # phases in background threads are still timed.
+        self._owner = threading.get_ident()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        """Time a phase, nested phases are counted in both phases."""
+        depth = getattr(self._local, "depth", 0)
+        use_cprofile = (
+            self.cprofile is not None
+            and depth == 0
+            and threading.get_ident() == self._owner
+        )
+        if use_cprofile:
+            self.cprofile.enable()
+        self._local.depth = depth + 1
+        start_time = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter_ns() - start_time
+            self.phases_ns[name] = self.phases_ns.get(name, 0) + elapsed
+            self._local.depth = depth
+            if use_cprofile:
+                self.cprofile.disable()
+
+    def count(self, name: str, value: int = 1) -> None:
+        """Increase a counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def seconds(self, *names: str) -> float:
+        """Total time in seconds spent in the given phases."""
+        return sum(self.phases_ns.get(name, 0) for name in names) / 1e9
+
+    def to_dict(self) -> dict:
+        return {
+            "phases_ns": dict(self.phases_ns),
+            "total_ns": sum(self.phases_ns.values()),
+            "counters": dict(self.counters),
+            "peak_rss_bytes": get_peak_rss(),
+        }
+
+    def dump(self, json_path: str | None) -> None:
+        """Write profile to a JSON file and cProfile stats if enabled."""
+        if json_path:
+            with open(json_path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2, sort_keys=True)
+        if self.cprofile and self.pstats_path:
+            self.cprofile.dump_stats(self.pstats_path)
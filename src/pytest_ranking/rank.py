@@ -1,10 +1,91 @@
+from __future__ import annotations
+
 import collections
+import heapq
 import os
 from enum import Enum
 
 import numpy as np
 
-from .const import LEVEL
+from .const import LEVEL, NORMALIZATION
+
+# Robust z-scores are clipped to this many interquartile ranges.
+ROBUST_CLIP = 3.0
+
+
+def min_max_normalization(x: list[float]) -> np.ndarray:
+    x = np.array(x)
+    x_range = (np.max(x) - np.min(x))
+    x = (x - np.min(x)) / x_range if x_range else np.zeros(len(x))
+    return x
+
+
+def rank_normalization(x: list[float]) -> np.ndarray:
+    """Percentile rank of each value, ties get their mean rank."""
+    x = np.asarray(x, dtype=float)
+    _, inverse, counts = np.unique(
+        x, return_inverse=True, return_counts=True)
+    if len(counts) < 2:
+        return np.zeros(len(x))
+    # Mean of the ranks of tied values.
+    mean_ranks = np.cumsum(counts) - (counts + 1) / 2
+    return mean_ranks[inverse] / (len(x) - 1)
+
+
+def log_min_max_normalization(x: list[float]) -> np.ndarray:
+    """Min-max normalization of log-scaled values, so that a few
+    large values do not compress the differences of the others.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return x
+    return min_max_normalization(np.log1p(x - np.min(x)))
+
+
+def robust_normalization(
+        x: list[float], clip: float = ROBUST_CLIP) -> np.ndarray:
+    """Min-max normalization of the z-score by median and interquartile
+    range, clipped to `clip`, so that outliers get the same value.
+    """
+    x = np.asarray(x, dtype=float)
+    if len(x) == 0:
+        return x
+    median = np.median(x)
+    q1, q3 = np.percentile(x, [25, 75])
+    # Fall back to the mean absolute deviation if most values are equal.
+    scale = (q3 - q1) or np.mean(np.abs(x - median)) or 1.0
+    return min_max_normalization(np.clip((x - median) / scale, -clip, clip))
+
+
+NORMALIZATIONS = {
+    NORMALIZATION.MINMAX: min_max_normalization,
+    NORMALIZATION.RANK: rank_normalization,
+    NORMALIZATION.LOG: log_min_max_normalization,
+    NORMALIZATION.ROBUST: robust_normalization,
+}
+
+
+def assign_shards(
+        durations: list[float | None],
+        num_shards: int) -> list[int]:
+    """Assign tests to shards in priority order, each test to the shard
+    with the least predicted duration so far (ties: fewest tests, then
+    lowest shard). The first tests are thereby spread round-robin,
+    and predicted shard durations differ by at most one test duration.
+    Tests without recorded duration are predicted by the mean duration.
+        - durations: predicted duration per test in priority order
+    """
+    known = [x for x in durations if x is not None]
+    default = sum(known) / len(known) if known else 1.0
+    # Heap of (predicted duration, number of tests, shard).
+    loads = [(0.0, 0, shard) for shard in range(num_shards)]
+    shards = []
+    for duration in durations:
+        load, count, shard = heapq.heappop(loads)
+        duration = default if duration is None else duration
+        heapq.heappush(loads, (load + duration, count + 1, shard))
+        shards.append(shard)
+    return shards
 
 
 def get_test_group(nodeid: str, level: Enum) -> str:
@@ -30,6 +111,27 @@ def get_test_group(nodeid: str, level: Enum) -> str:
         return nodeid
 
 
+def get_test_groups(nodeid: str) -> list[str]:
+    """Get test groups of a PUT from the closest to the broadest,
+    with the same grouping as `get_test_group`.
+
+    Given a put: folder/testfile.py::TestClass::testmethod[param1]
+        - function: folder/testfile.py::TestClass::testmethod
+        - class: folder/testfile.py::TestClass
+        - module: folder/testfile.py
+        - dir: folder, and its parent folders up to "" (all tests)
+    """
+    test_without_param = nodeid.split("[")[0]
+    parts = test_without_param.split("::")
+    groups = ["::".join(parts[:i]) for i in range(len(parts), 0, -1)]
+    test_folder = os.path.dirname(parts[0])
+    while test_folder:
+        groups.append(test_folder)
+        test_folder = os.path.dirname(test_folder)
+    groups.append("")
+    return groups
+
+
 def get_ranking(scores: dict, level: Enum, init_order: dict) -> dict:
     """Return ranking of tests by test nodeid.
         - scores: mapping between test nodeid to its score
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import json
+
+import numpy as np
+
+from .store import CacheStore
+
+# Minimum number of recent durations of a test to detect its regression.
+REGRESSION_MIN_RUNS = 3
+
+# Spread of recent durations is at least this fraction of their median...
+REGRESSION_MIN_SPREAD = 0.1
+
+# ... and a regressed test takes at least this many seconds longer,
+# so that tests with stable or tiny durations are not reported for noise.
+REGRESSION_MIN_INCREASE = 0.1
+
+
+def find_regressions(
+        store: CacheStore,
+        nodeids: list[str],
+        durations: np.ndarray,
+        threshold: float) -> list[dict]:
+    """Get executed tests whose duration exceeds the median of their
+    recent durations by more than `threshold` times the scaled median
+    absolute deviation, the largest increase first.
+    """
+    recent = store.get_items("recent_durations", nodeids)
+    regressions = []
+    for nodeid, duration in zip(nodeids, durations.tolist()):
+        history = np.asarray(recent.get(nodeid, []), dtype=float)
+        if len(history) < REGRESSION_MIN_RUNS:
+            continue
+        median = float(np.median(history))
+        # Scaled to the standard deviation of normal distribution.
+        mad = 1.4826 * float(np.median(np.abs(history - median)))
+        spread = max(mad, REGRESSION_MIN_SPREAD * median)
+        increase = duration - median
+        if increase <= max(threshold * spread, REGRESSION_MIN_INCREASE):
+            continue
+        regressions.append({
+            "nodeid": nodeid,
+            "duration": round(duration, 3),
+            "median": round(median, 3),
+            "mad": round(mad, 3),
+            "ratio": round(duration / median, 1) if median else None,
+        })
+    return sorted(
+        regressions, key=lambda x: x["duration"] - x["median"], reverse=True)
+
+
+def format_regression(regression: dict) -> str:
+    ratio = regression["ratio"]
+    return (
+        f"{regression['duration']:.2f}s"
+        + f" (median {regression['median']:.2f}s"
+        + (f", {ratio:g}x" if ratio is not None else "")
+        + f") {regression['nodeid']}"
+    )
+
+
+def write_regression_report(
+        path: str,
+        regressions: list[dict],
+        threshold: float) -> None:
+    """Write detected regressions as JSON, also if there are none."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"threshold": threshold, "regressions": regressions}, f,
+                  indent=2)
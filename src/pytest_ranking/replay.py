@@ -0,0 +1,61 @@
+from __future__ import annotations
+
+import gzip
+from typing import IO, Iterator
+
+from .rank import get_test_groups
+
+
+def open_replay(path: str) -> IO[str]:
+    """Open a replay file as text, gzip-compressed if it ends with `.gz`."""
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def read_entries(path: str) -> Iterator[str]:
+    """Stream entries of a replay file, skipping empty lines."""
+    with open_replay(path) as f:
+        for line in f:
+            # Folders and classes may be listed with a trailing separator.
+            entry = line.strip().rstrip("/")
+            if entry.endswith("::"):
+                entry = entry[:-len("::")]
+            if entry:
+                yield entry
+
+
+def get_replay_keys(nodeid: str) -> list[str]:
+    """Entries that match a test, from the closest: the test itself,
+    the test function without parameters, its class, module and folders.
+    """
+    return [nodeid] + get_test_groups(nodeid)[:-1]
+
+
+def load_replay(path: str, nodeids: list[str]) -> dict[str, int]:
+    """Get position of each listed test in a replay file, by the closest
+    entry that matches it. Only entries that match a collected test are
+    kept while streaming the file, the first one if listed again.
+    """
+    wanted = {key for nodeid in nodeids for key in get_replay_keys(nodeid)}
+    positions = {}
+    for i, entry in enumerate(read_entries(path)):
+        if entry in wanted:
+            positions.setdefault(entry, i)
+    listed = {}
+    for nodeid in nodeids:
+        for key in get_replay_keys(nodeid):
+            if key in positions:
+                listed[nodeid] = positions[key]
+                break
+    return listed
+
+
+def replay_ranking(listed: dict[str, int], rank: dict[str, int]) -> dict:
+    """Rank listed tests by their position in the replay file,
+    then unlisted tests, each by their rank otherwise.
+    """
+    nodeids = sorted(
+        rank,
+        key=lambda x: (x not in listed, listed.get(x, 0), rank[x]))
+    return {nodeid: i for i, nodeid in enumerate(nodeids)}
@@ -0,0 +1,75 @@
+from __future__ import annotations
+
+import math
+import time
+
+import numpy as np
+
+from .profiler import get_hwm_rss, get_peak_rss, get_rss, reset_peak_rss
+from .store import CacheStore
+
+# Weight kept from the previous peak memory of a test at each run,
+# since without resetting the peak of the process (only on Linux),
+# a test does not increase it if an earlier test used more memory.
+PEAK_RSS_DECAY = 0.9
+
+# Tests that use CPU for at least this share of their duration
+# are CPU-bound, others are mostly waiting, e.g., for I/O.
+CPU_BOUND_RATIO = 0.5
+
+
+class ResourceMeter:
+    """Measure peak memory increase (MB) and CPU time per wall time
+    of the call phase of a test.
+    """
+    def __init__(self) -> None:
+        # On Linux, the peak of the process is reset for each test.
+        self.reset = reset_peak_rss()
+        self.peak = None if self.reset else get_peak_rss()
+        self.rss = get_rss()
+        self.start_time = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+    def stop(self) -> tuple[float, float]:
+        wall_time = time.perf_counter() - self.start_time
+        cpu_time = time.process_time() - self.start_cpu
+        cpu_ratio = cpu_time / wall_time if wall_time > 0 else math.nan
+        if self.rss is None:
+            return math.nan, cpu_ratio
+        if self.reset:
+            peak_rss = get_hwm_rss()
+        elif self.peak is not None and get_peak_rss() > self.peak:
+            # The test raised the peak of the process.
+            peak_rss = get_peak_rss()
+        else:
+            # Only memory kept after the test is known.
+            peak_rss = get_rss()
+        if peak_rss is None:
+            return math.nan, cpu_ratio
+        return max(peak_rss - self.rss, 0) / 2**20, cpu_ratio
+
+
+def record_resources(
+        store: CacheStore,
+        nodeids: list[str],
+        peak_rss: np.ndarray,
+        cpu_ratio: np.ndarray) -> None:
+    """Update peak memory (MB) and CPU ratio of tests,
+    skipping tests without measurements.
+    """
+    measured = ~np.isnan(peak_rss)
+    measured_nodeids = [x for x, m in zip(nodeids, measured) if m]
+    if measured_nodeids:
+        with store.file_lock:
+            previous = store.get_items("peak_rss", measured_nodeids)
+            values = {}
+            for nodeid, value in zip(measured_nodeids, peak_rss[measured]):
+                value = max(
+                    float(value), PEAK_RSS_DECAY * previous.get(nodeid, 0))
+                values[nodeid] = round(value, 1)
+            store.update_items("peak_rss", values)
+    measured = ~np.isnan(cpu_ratio)
+    store.update_items("cpu_ratios", {
+        nodeid: round(float(value), 3)
+        for nodeid, value, m in zip(nodeids, cpu_ratio, measured) if m
+    })
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+import glob
+import json
+import math
+import os
+import time
+import uuid
+from typing import Iterator
+
+import numpy as np
+from _pytest.reports import TestReport
+
+from .store import CacheStore, fcntl, try_lock
+
+# Checkpoint files, one per session, so that concurrent sessions
+# in the same checkout do not write to the same file.
+CHECKPOINT_PATTERN = "results*.jsonl"
+
+# Without file locks, checkpoints not written for this many seconds
+# are taken as left by killed sessions.
+CHECKPOINT_STALE = 3600.0
+
+# Write results to the checkpoint after this many executed tests...
+CHECKPOINT_TESTS = 100
+
+# ... or after this many seconds, whichever comes first.
+CHECKPOINT_SECONDS = 10.0
+
+# Phases of a test in the order they are reported.
+PHASES = ("setup", "call", "teardown")
+
+
+class TestResults:
+    """Compact results of executed tests, reduced from each report
+    as soon as it arrives, so that reports are not kept in memory.
+    A test is executed if its call phase is reported and not skipped.
+    """
+    # Not a test class, despite its name.
+    __test__ = False
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self.nodeids = []
+        self.index = {}
+        self.durations = np.zeros((capacity, len(PHASES)))
+        self.failed = np.zeros(capacity, dtype=bool)
+        # Peak memory (MB) and CPU time per wall time of the call phase.
+        self.peak_rss = np.full(capacity, np.nan)
+        self.cpu_ratio = np.full(capacity, np.nan)
+        # Row of each executed test in execution order.
+        self.executed = []
+
+    def get_row(self, nodeid: str) -> int:
+        """Get the row of a test, doubling the arrays when full."""
+        row = self.index.get(nodeid)
+        if row is None:
+            row = self.index[nodeid] = len(self.nodeids)
+            self.nodeids.append(nodeid)
+            if row == len(self.failed):
+                self.durations = np.concatenate(
+                    [self.durations, np.zeros_like(self.durations)])
+                self.failed = np.concatenate(
+                    [self.failed, np.zeros_like(self.failed)])
+                self.peak_rss = np.concatenate(
+                    [self.peak_rss, np.full_like(self.peak_rss, np.nan)])
+                self.cpu_ratio = np.concatenate(
+                    [self.cpu_ratio, np.full_like(self.cpu_ratio, np.nan)])
+        return row
+
+    def add(self, report: TestReport) -> bool:
+        """Record a report, return whether a test has been executed."""
+        row = self.get_row(report.nodeid)
+        self.durations[row, PHASES.index(report.when)] = report.duration
+        if report.when != "call" or report.skipped:
+            return False
+        self.failed[row] = report.outcome == "failed"
+        # Set by the plugin, also in reports sent by pytest-xdist workers.
+        self.peak_rss[row] = getattr(report, "rank_peak_rss", math.nan)
+        self.cpu_ratio[row] = getattr(report, "rank_cpu_ratio", math.nan)
+        self.executed.append(row)
+        return True
+
+    def __len__(self) -> int:
+        return len(self.executed)
+
+    def get_nodeids(self, start: int = 0) -> list[str]:
+        """Executed tests in execution order."""
+        return [self.nodeids[row] for row in self.executed[start:]]
+
+    def get_failed(self, start: int = 0) -> np.ndarray:
+        return self.failed[self.executed[start:]]
+
+    def get_peak_rss(self, start: int = 0) -> np.ndarray:
+        return self.peak_rss[self.executed[start:]]
+
+    def get_cpu_ratio(self, start: int = 0) -> np.ndarray:
+        return self.cpu_ratio[self.executed[start:]]
+
+    def get_durations(self, start: int = 0, phase: str = "call") -> np.ndarray:
+        return self.durations[self.executed[start:], PHASES.index(phase)]
+
+
+class ResultCheckpoint:
+    """Append-only checkpoint of executed tests as JSON lines,
+    written during the session, so that a killed session
+    still contributes its durations and failures to the next session.
+    The file is locked while its session runs, so that concurrent
+    sessions only recover checkpoints of killed sessions.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.num_written = 0
+        self.last_time = time.monotonic()
+        self.lock_file = None
+
+    @classmethod
+    def from_store(cls, store: CacheStore) -> ResultCheckpoint:
+        """Create the checkpoint of this session."""
+        name = f"results-{os.getpid()}-{uuid.uuid4().hex[:8]}.jsonl"
+        checkpoint = cls(store.get_path(name))
+        checkpoint.lock()
+        return checkpoint
+
+    @classmethod
+    def find_orphans(cls, store: CacheStore) -> Iterator[ResultCheckpoint]:
+        """Checkpoints left by killed sessions, locked until removed."""
+        folder = os.path.dirname(store.get_path(CHECKPOINT_PATTERN))
+        for path in glob.glob(os.path.join(folder, CHECKPOINT_PATTERN)):
+            checkpoint = cls(path)
+            if fcntl is not None:
+                if checkpoint.lock():
+                    yield checkpoint
+                continue
+            try:
+                age = time.time() - os.path.getmtime(path)
+            except OSError:
+                continue
+            if age > CHECKPOINT_STALE:
+                yield checkpoint
+
+    def lock(self) -> bool:
+        """Lock the checkpoint file, False if another session holds it."""
+        if fcntl is None:
+            return True
+        self.lock_file = open(self.path, "a")
+        if try_lock(self.lock_file):
+            return True
+        self.lock_file.close()
+        self.lock_file = None
+        return False
+
+    def is_due(self, results: TestResults) -> bool:
+        return (
+            len(results) - self.num_written >= CHECKPOINT_TESTS
+            or time.monotonic() - self.last_time >= CHECKPOINT_SECONDS
+        )
+
+    def write(self, results: TestResults) -> None:
+        """Append results of tests executed since the last checkpoint."""
+        start = self.num_written
+        lines = [
+            json.dumps([nodeid, int(failed), round(float(duration), 3)])
+            for nodeid, failed, duration in zip(
+                results.get_nodeids(start),
+                results.get_failed(start),
+                results.get_durations(start),
+            )
+        ]
+        if lines:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+        self.num_written = len(results)
+        self.last_time = time.monotonic()
+
+    def read(self) -> Iterator[tuple[str, bool, float]]:
+        """Stream checkpointed results, skipping a partially written line."""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    nodeid, failed, duration = json.loads(line)
+                except ValueError:
+                    continue
+                yield nodeid, bool(failed), duration
+
+    def remove(self) -> None:
+        """Remove the checkpoint file, and release its lock."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
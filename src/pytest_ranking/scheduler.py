@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+import collections
+import heapq
+from enum import Enum
+
+import numpy as np
+from _pytest.nodes import Item
+
+from .change_tracker import tokenize
+from .cofailure import CoFailureGraph
+from .const import LEVEL
+from .rank import get_test_group
+
+# Boost of pending tests in the same test group as a failed test.
+GROUP_BOOST = 1.0
+
+# Boost of pending tests related to the same changed files as a failed test.
+CHANGE_BOOST = 1.0
+
+# Boost of pending tests that failed together with a failed test before.
+COFAIL_BOOST = 1.0
+
+
+class AdaptiveScheduler:
+    """Queue of ranked tests that promotes pending tests related to
+    a failed test: tests in the same test group, tests related to
+    the same changed files, and tests that failed together with it before.
+    Tests keep their ranked order among tests of the same boost,
+    and only promoted tests are re-queued.
+    """
+    def __init__(
+            self,
+            items: list[Item],
+            level: Enum,
+            change_tokens: set[str],
+            cofailures: CoFailureGraph,
+            num_fixed: int = 0) -> None:
+        """
+            - items: tests in ranked order
+            - change_tokens: tokens of changed files that relate them to
+              some of the tests, see `get_change_tokens`
+            - cofailures: tests that failed together in previous runs
+            - num_fixed: number of first tests that keep their position,
+              i.e., tests with declared order dependency
+        """
+        self.items = items
+        self.index = {item.nodeid: i for i, item in enumerate(items)}
+        self.boost = np.zeros(len(items))
+        self.pending = np.ones(len(items), dtype=bool)
+        self.num_promoted = 0
+        self.failed = set()
+        # Parametrized tests of a failed test are related at PUT level.
+        if level == LEVEL.PUT:
+            level = LEVEL.FUNCTION
+        self.groups = collections.defaultdict(list)
+        self.change_tests = collections.defaultdict(list)
+        for i, item in enumerate(items[num_fixed:], num_fixed):
+            self.groups[get_test_group(item.nodeid, level)].append(i)
+            if change_tokens:
+                tokens = change_tokens.intersection(tokenize(item.nodeid))
+                for token in tokens:
+                    self.change_tests[token].append(i)
+        self.level = level
+        self.change_tokens = change_tokens
+        self.cofailures = cofailures
+        self.num_fixed = num_fixed
+        # Queue of (fixed or not, negative boost, ranked position).
+        self.queue = [(int(i >= num_fixed), 0.0, i) for i in range(len(items))]
+
+    def pop(self) -> Item | None:
+        """Get the next pending test of the highest boost."""
+        while self.queue:
+            _, neg_boost, i = heapq.heappop(self.queue)
+            # Skip outdated entries of promoted tests.
+            if self.pending[i] and -neg_boost == self.boost[i]:
+                self.pending[i] = False
+                return self.items[i]
+        return None
+
+    def get_related(self, nodeid: str) -> dict[int, float]:
+        """Get boost per pending test related to a test."""
+        related = collections.Counter()
+        for i in self.groups.get(get_test_group(nodeid, self.level), []):
+            related[i] += GROUP_BOOST
+        for token in self.change_tokens.intersection(tokenize(nodeid)):
+            for i in self.change_tests[token]:
+                related[i] += CHANGE_BOOST
+        for neighbor in self.cofailures.get_neighbors(nodeid):
+            i = self.index.get(neighbor)
+            if i is not None and i >= self.num_fixed:
+                related[i] += COFAIL_BOOST
+        return related
+
+    def on_failure(self, nodeid: str) -> None:
+        """Promote pending tests related to a failed test."""
+        if nodeid in self.failed or nodeid not in self.index:
+            return
+        self.failed.add(nodeid)
+        for i, boost in self.get_related(nodeid).items():
+            if not self.pending[i]:
+                continue
+            self.boost[i] += boost
+            heapq.heappush(self.queue, (1, -self.boost[i], i))
+            self.num_promoted += 1
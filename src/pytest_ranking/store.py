@@ -0,0 +1,592 @@
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Iterable
+from urllib.parse import quote, unquote
+
+from .const import DATA_DIR, DEFAULT_PARTITION_DEPTH, STORE
+from .profiler import Profiler
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Not available on Windows, where writes are only atomic.
+    fcntl = None
+
+SQLITE_FILE = "ranking.sqlite3"
+
+# Folder of mappings stored by partition.
+PARTITION_DIR = "partitions"
+
+# Partition depth of the stored partitions.
+PARTITION_DEPTH = "depth"
+
+# Names of mappings that are migrated when switching to SQLite.
+MAPPINGS = (
+    "last_durations",
+    "num_runs_since_fail",
+    "file_hashes",
+    "file_index",
+    "fixture_costs",
+    "peak_rss",
+    "cpu_ratios",
+    "last_costs",
+    "recent_durations",
+    # Group stats, see `estimate.get_group_stats_name`.
+    "groups/last_durations",
+    "groups/num_runs_since_fail",
+    "groups/last_costs",
+)
+
+# Maximum number of keys per SQL query.
+SQL_BATCH_SIZE = 500
+
+LOCK_FILE = "store.lock"
+
+# Seconds to wait for other pytest processes writing to the same cache,
+# afterwards data are written without the lock.
+LOCK_TIMEOUT = 10.0
+
+# Seconds between attempts to acquire the lock.
+LOCK_POLL = 0.01
+
+
+def json_size(value) -> int:
+    """Size in bytes of a value as serialized by the pytest cache."""
+    data = json.dumps(value, ensure_ascii=False, indent=2, sort_keys=True)
+    return len(data.encode("utf-8"))
+
+
+def write_atomic(path: str, data: str) -> None:
+    """Write a file by renaming a temporary file in the same folder,
+    so that concurrent readers never read a partially written file.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def try_lock(file) -> bool:
+    """Try to lock an open file exclusively, without waiting."""
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class FileLock:
+    """Exclusive lock across processes and threads, held while
+    data are merged and written, so that concurrent pytest processes
+    do not overwrite each other's updates. After `timeout` seconds,
+    and on systems without `fcntl`, data are written without the lock.
+    The lock is reentrant within a thread.
+    """
+    def __init__(self, path: str, timeout: float = LOCK_TIMEOUT) -> None:
+        self.path = path
+        self.timeout = timeout
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.file = None
+
+    def __enter__(self) -> FileLock:
+        self.thread_lock.acquire()
+        self.depth += 1
+        if fcntl is None or self.depth > 1:
+            return self
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, "a")
+        deadline = time.monotonic() + self.timeout
+        while not try_lock(self.file):
+            if time.monotonic() >= deadline:
+                self.file.close()
+                self.file = None
+                break
+            time.sleep(LOCK_POLL)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.depth -= 1
+        if self.depth == 0 and self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
+        self.thread_lock.release()
+
+
+class CacheStore:
+    """Read and write ranking data in the pytest cache.
+    Mappings are updated by merging the updated entries into the data
+    written in the meantime by other pytest processes.
+    """
+    def __init__(self, cache, profiler: Profiler) -> None:
+        self.cache = cache
+        self.profiler = profiler
+        self.file_lock = FileLock(
+            os.path.join(cache._cachedir, "v", DATA_DIR, LOCK_FILE))
+
+    def get(self, name: str, default):
+        with self.profiler.phase("cache_load"):
+            value = self.cache.get(os.path.join(DATA_DIR, name), None)
+            if value is None:
+                return default
+            if self.profiler.enabled:
+                self.profiler.count("cache_bytes_read", json_size(value))
+        return value
+
+    def set(self, name: str, value) -> None:
+        with self.profiler.phase("persistence"):
+            key = os.path.join(DATA_DIR, name)
+            if not os.path.isdir(self.cache._cachedir):
+                # The cache creates its folder with supporting files.
+                self.cache.set(key, value)
+            else:
+                path = os.path.join(self.cache._cachedir, "v", key)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                write_atomic(path, json.dumps(
+                    value, ensure_ascii=False, indent=2, sort_keys=True))
+            if self.profiler.enabled:
+                self.profiler.count("cache_bytes_written", json_size(value))
+
+    def update(self, name: str, default, update: Callable):
+        """Replace a value by `update` of its current value, under the lock,
+        so that updates of concurrent pytest processes are not lost.
+        Return the new value.
+        """
+        with self.file_lock:
+            value = update(self.get(name, default))
+            self.set(name, value)
+        return value
+
+    def get_items(self, name: str, keys: Iterable[str] | None = None) -> dict:
+        """Get entries of a mapping, only of the given keys if any."""
+        values = self.get(name, {})
+        if keys is None:
+            return values
+        return {key: values[key] for key in keys if key in values}
+
+    def update_items(
+            self,
+            name: str,
+            values: dict,
+            removed: Iterable[str] = ()) -> None:
+        """Insert or update entries of a mapping, and delete removed keys.
+        """
+        removed = list(removed)
+        if not values and not removed:
+            return
+        with self.file_lock:
+            # Re-read to keep entries updated by other processes.
+            data = self.get(name, {})
+            data.update(values)
+            for key in removed:
+                data.pop(key, None)
+            self.set(name, data)
+
+    def replace_items(self, name: str, values: dict) -> None:
+        """Replace all entries of a mapping."""
+        with self.file_lock:
+            self.set(name, values)
+
+    def get_mtime(self, name: str) -> float | None:
+        """Time of the last update of the data, None if there is no data."""
+        path = os.path.join(self.cache._cachedir, "v", DATA_DIR, name)
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def list_names(self, folder: str) -> list[str]:
+        """Names of data stored in a folder, e.g., `env`."""
+        root = os.path.join(self.cache._cachedir, "v", DATA_DIR)
+        return [
+            os.path.relpath(os.path.join(path, file), root).replace(
+                os.sep, "/")
+            for path, _, files in os.walk(os.path.join(root, folder))
+            for file in files if not file.startswith(".tmp-")
+        ]
+
+    def close(self) -> None:
+        pass
+
+    def get_path(self, name: str) -> str:
+        """Path of a data file that is not a cache value,
+        stored next to the cache values so that it is kept with them.
+        """
+        path = os.path.join(self.cache._cachedir, "v", DATA_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+
+class DirCache:
+    """Minimal stand-in of the pytest cache for use outside pytest.
+    Values are stored in the same layout as `config.cache`,
+    i.e., `<cache_dir>/v/<key>` as JSON.
+    """
+    def __init__(self, cache_dir: str) -> None:
+        # Same attribute name as the pytest cache.
+        self._cachedir = cache_dir
+
+    def get(self, key: str, default):
+        path = os.path.join(self._cachedir, "v", key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return default
+
+    def set(self, key: str, value) -> None:
+        if not os.path.isdir(self._cachedir):
+            os.makedirs(self._cachedir)
+            # Same as pytest: keep the cache folder out of version control.
+            with open(os.path.join(self._cachedir, ".gitignore"), "w") as f:
+                f.write("# Created by pytest automatically.\n*\n")
+        path = os.path.join(self._cachedir, "v", key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(value, ensure_ascii=False, indent=2, sort_keys=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(data)
+
+
+class SqliteStore(CacheStore):
+    """Read and write ranking data in a SQLite database in the pytest cache.
+    Entries of mappings are stored per row, so that only entries of
+    the given keys are loaded and only updated entries are written.
+    """
+    def __init__(self, cache, profiler: Profiler) -> None:
+        super().__init__(cache, profiler)
+        path = self.get_path(SQLITE_FILE)
+        is_new = not os.path.exists(path)
+        # Change tracking accesses the store from a background thread.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            path, timeout=LOCK_TIMEOUT, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS data"
+                " (name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS items"
+                " (name TEXT NOT NULL, key TEXT NOT NULL,"
+                " value TEXT NOT NULL, PRIMARY KEY (name, key))"
+                " WITHOUT ROWID"
+            )
+        if is_new:
+            self.migrate()
+
+    def migrate(self) -> None:
+        """Import mappings stored in the pytest cache by the JSON store."""
+        for name in MAPPINGS:
+            values = self.cache.get(os.path.join(DATA_DIR, name), None)
+            if isinstance(values, dict):
+                self.update_items(name, values)
+
+    def get(self, name: str, default):
+        with self.profiler.phase("cache_load"), self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM data WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            return default
+        self.profiler.count("cache_bytes_read", len(row[0]))
+        return json.loads(row[0])
+
+    def set(self, name: str, value) -> None:
+        data = json.dumps(value, separators=(",", ":"))
+        with self.profiler.phase("persistence"), self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO data VALUES (?, ?)", (name, data))
+        self.profiler.count("cache_bytes_written", len(data))
+
+    def get_items(self, name: str, keys: Iterable[str] | None = None) -> dict:
+        with self.profiler.phase("cache_load"), self.lock:
+            if keys is None:
+                rows = self.conn.execute(
+                    "SELECT key, value FROM items WHERE name = ?", (name,)
+                ).fetchall()
+            else:
+                keys = list(keys)
+                rows = []
+                for i in range(0, len(keys), SQL_BATCH_SIZE):
+                    batch = keys[i:i + SQL_BATCH_SIZE]
+                    placeholders = ",".join("?" * len(batch))
+                    rows += self.conn.execute(
+                        "SELECT key, value FROM items"
+                        + f" WHERE name = ? AND key IN ({placeholders})",
+                        [name] + batch,
+                    ).fetchall()
+        self.profiler.count("cache_rows_read", len(rows))
+        return {key: json.loads(value) for key, value in rows}
+
+    def update_items(
+            self,
+            name: str,
+            values: dict,
+            removed: Iterable[str] = ()) -> None:
+        rows = [
+            (name, key, json.dumps(value, separators=(",", ":")))
+            for key, value in values.items()
+        ]
+        removed = [(name, key) for key in removed]
+        with self.profiler.phase("persistence"), self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO items VALUES (?, ?, ?)", rows)
+            self.conn.executemany(
+                "DELETE FROM items WHERE name = ? AND key = ?", removed)
+        self.profiler.count("cache_rows_written", len(rows) + len(removed))
+
+    def replace_items(self, name: str, values: dict) -> None:
+        rows = [
+            (name, key, json.dumps(value, separators=(",", ":")))
+            for key, value in values.items()
+        ]
+        with self.profiler.phase("persistence"), self.lock, self.conn:
+            self.conn.execute("DELETE FROM items WHERE name = ?", (name,))
+            self.conn.executemany(
+                "INSERT INTO items VALUES (?, ?, ?)", rows)
+        self.profiler.count("cache_rows_written", len(rows))
+
+    def get_mtime(self, name: str) -> float | None:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM items WHERE name = ?"
+                + " UNION ALL SELECT 1 FROM data WHERE name = ? LIMIT 1",
+                (name, name),
+            ).fetchone()
+        if row is None:
+            return None
+        return os.path.getmtime(self.get_path(SQLITE_FILE))
+
+    def list_names(self, folder: str) -> list[str]:
+        prefix = folder + "/"
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT DISTINCT name FROM items WHERE substr(name, 1, ?) = ?"
+                + " UNION SELECT name FROM data WHERE substr(name, 1, ?) = ?",
+                (len(prefix), prefix, len(prefix), prefix),
+            ).fetchall()
+        return [name for name, in rows]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def get_relative_path(key: str, rootdir: str | None) -> str:
+    """POSIX path of a test or file key relative to the rootdir.
+    Absolute paths outside the rootdir keep their folders, without
+    the root and drive.
+    """
+    path = key.split("::", 1)[0].replace("\\", "/")
+    if rootdir is not None:
+        root = rootdir.replace("\\", "/").rstrip("/") + "/"
+        if path.startswith(root):
+            return path[len(root):]
+    return re.sub(r"^([a-zA-Z]:)?/+", "", path)
+
+
+def get_partition(key: str, depth: int, rootdir: str | None = None) -> str:
+    """Partition of a test or file key: its folder relative to the
+    rootdir, or its first `depth` folders if `depth` is positive.
+    Keys at the root share a partition. Test group keys are partitioned
+    the same way, a folder group by its parent folder.
+    """
+    folders = get_relative_path(key, rootdir).split("/")[:-1]
+    if depth:
+        folders = folders[:depth]
+    return "/".join(folders)
+
+
+def get_partition_file(partition: str) -> str:
+    """File name of a partition, safe for any key."""
+    return quote(partition, safe="") + ".json"
+
+
+def group_by_partition(
+        keys: Iterable[str],
+        depth: int,
+        rootdir: str | None = None) -> dict[str, list[str]]:
+    groups = {}
+    for key in keys:
+        groups.setdefault(get_partition(key, depth, rootdir), []).append(key)
+    return groups
+
+
+class PartitionedStore(CacheStore):
+    """Read and write ranking data in the pytest cache, with mappings
+    stored as one JSON file per partition of their keys, so that runs of
+    the tests of a few folders only read the partitions of the collected
+    tests and only write the partitions of the executed tests.
+    Partitions of another depth are repartitioned when the store is opened,
+    the depth of the stored partitions is kept if `depth` is None.
+    File keys are partitioned by their path relative to `rootdir`,
+    by default the folder of the cache directory.
+    """
+    def __init__(
+            self,
+            cache,
+            profiler: Profiler,
+            depth: int | None = None,
+            rootdir: str | None = None) -> None:
+        super().__init__(cache, profiler)
+        if rootdir is None:
+            rootdir = os.path.dirname(os.path.abspath(cache._cachedir))
+        self.rootdir = rootdir
+        # Partitions loaded in this run, reused when they are read again.
+        self.loaded = {}
+        depth_name = os.path.join(PARTITION_DIR, PARTITION_DEPTH)
+        with self.file_lock:
+            self.depth = self.get(depth_name, None)
+            if depth is None:
+                depth = self.depth
+            if depth is None:
+                depth = DEFAULT_PARTITION_DEPTH
+            if depth == self.depth:
+                return
+            if not os.path.isdir(self.get_partition_path()):
+                self.depth = depth
+                self.migrate()
+            else:
+                # Also partitions stored before the depth was recorded.
+                self.repartition(depth)
+            self.set(depth_name, depth)
+
+    def migrate(self) -> None:
+        """Import mappings stored in the pytest cache by the JSON store."""
+        for name in MAPPINGS:
+            values = self.cache.get(os.path.join(DATA_DIR, name), None)
+            if isinstance(values, dict):
+                self.update_items(name, values)
+
+    def list_mappings(self) -> list[str]:
+        """Names of the mappings stored by partition."""
+        root = self.get_partition_path()
+        return [
+            os.path.relpath(path, root).replace(os.sep, "/")
+            for path, _, files in os.walk(root)
+            if any(file.endswith(".json") for file in files)
+        ]
+
+    def repartition(self, depth: int) -> None:
+        """Store all mappings by partitions of another depth."""
+        mappings = {
+            name: self.get_items(name) for name in self.list_mappings()
+        }
+        self.depth = depth
+        for name, values in mappings.items():
+            self.replace_items(name, values)
+
+    def get_partition_path(self, *parts: str) -> str:
+        return os.path.join(
+            self.cache._cachedir, "v", DATA_DIR, PARTITION_DIR, *parts)
+
+    def get_partition_name(self, name: str, partition: str) -> str:
+        """Cache key of a partition of a mapping."""
+        return os.path.join(PARTITION_DIR, name, get_partition_file(partition))
+
+    def list_partitions(self, name: str) -> list[str]:
+        path = self.get_partition_path(name)
+        if not os.path.isdir(path):
+            return []
+        return [
+            unquote(file[:-len(".json")])
+            for file in os.listdir(path) if file.endswith(".json")
+        ]
+
+    def load_partition(self, name: str, partition: str) -> dict:
+        """Load a partition once, later reads reuse it."""
+        key = (name, partition)
+        if key not in self.loaded:
+            self.loaded[key] = self.get(
+                self.get_partition_name(name, partition), {})
+            self.profiler.count("cache_partitions_read", 1)
+        return self.loaded[key]
+
+    def save_partition(self, name: str, partition: str, data: dict) -> None:
+        self.loaded[(name, partition)] = data
+        self.set(self.get_partition_name(name, partition), data)
+        self.profiler.count("cache_partitions_written", 1)
+
+    def get_items(self, name: str, keys: Iterable[str] | None = None) -> dict:
+        if keys is None:
+            values = {}
+            for partition in self.list_partitions(name):
+                values.update(self.load_partition(name, partition))
+            return values
+        values = {}
+        groups = group_by_partition(keys, self.depth, self.rootdir)
+        for partition, group in groups.items():
+            data = self.load_partition(name, partition)
+            values.update({key: data[key] for key in group if key in data})
+        return values
+
+    def update_items(
+            self,
+            name: str,
+            values: dict,
+            removed: Iterable[str] = ()) -> None:
+        removed = group_by_partition(removed, self.depth, self.rootdir)
+        updated = group_by_partition(values, self.depth, self.rootdir)
+        for partition in set(updated) | set(removed):
+            with self.file_lock:
+                # Re-read to keep entries updated by other processes.
+                data = self.get(self.get_partition_name(name, partition), {})
+                data.update(
+                    {key: values[key] for key in updated.get(partition, [])})
+                for key in removed.get(partition, []):
+                    data.pop(key, None)
+                self.save_partition(name, partition, data)
+
+    def replace_items(self, name: str, values: dict) -> None:
+        updated = group_by_partition(values, self.depth, self.rootdir)
+        with self.file_lock:
+            for partition in self.list_partitions(name):
+                if partition not in updated:
+                    self.loaded.pop((name, partition), None)
+                    os.remove(self.get_partition_path(
+                        name, get_partition_file(partition)))
+            for partition, group in updated.items():
+                self.save_partition(
+                    name, partition, {key: values[key] for key in group})
+
+    def get_mtime(self, name: str) -> float | None:
+        mtimes = [
+            os.path.getmtime(self.get_partition_path(
+                name, get_partition_file(partition)))
+            for partition in self.list_partitions(name)
+        ]
+        if mtimes:
+            return max(mtimes)
+        return super().get_mtime(name)
+
+    def list_names(self, folder: str) -> list[str]:
+        mappings = [
+            name for name in self.list_mappings()
+            if name.startswith(folder + "/")
+        ]
+        return mappings + super().list_names(folder)
+
+
+def open_store(
+        kind: str,
+        cache,
+        profiler: Profiler,
+        partition_depth: int | None = None,
+        rootdir: str | None = None) -> CacheStore:
+    """Open the ranking data store of the given kind."""
+    if kind == STORE.SQLITE:
+        return SqliteStore(cache, profiler)
+    if kind == STORE.PARTITIONED:
+        return PartitionedStore(cache, profiler, partition_depth, rootdir)
+    return CacheStore(cache, profiler)
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import signal
+import threading
+
+import numpy as np
+import pytest
+
+from .estimate import GroupEstimator
+from .store import CacheStore
+
+# Number of most recent durations kept per test.
+DURATION_WINDOW = 10
+
+# Percentile of recent durations that the timeout is a multiple of.
+TIMEOUT_PERCENTILE = 95
+
+
+def timeout_supported() -> bool:
+    """Timeouts interrupt tests by SIGALRM in the main thread."""
+    return (
+        hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+
+
+def predict_timeouts(
+        store: CacheStore,
+        nodeids: list[str],
+        factor: float,
+        minimum: float) -> dict[str, float]:
+    """Get timeout of each test, `factor` times the percentile of its
+    recent durations, or of its last or estimated duration, at least
+    `minimum` seconds. Tests without any duration have no timeout.
+    """
+    recent = store.get_items("recent_durations", nodeids)
+    last = store.get_items("last_durations", nodeids)
+    estimator = GroupEstimator.from_store(
+        store,
+        "last_durations",
+        [x for x in nodeids if x not in recent and x not in last])
+    timeouts = {}
+    for nodeid in nodeids:
+        if nodeid in recent:
+            duration = np.percentile(recent[nodeid], TIMEOUT_PERCENTILE)
+        elif nodeid in last:
+            duration = last[nodeid]
+        else:
+            duration = estimator.estimate(nodeid, None)
+        if duration is not None:
+            timeouts[nodeid] = max(minimum, factor * float(duration))
+    return timeouts
+
+
+def record_recent_durations(
+        store: CacheStore,
+        nodeids: list[str],
+        durations: np.ndarray) -> None:
+    """Append durations of executed tests to their recent durations."""
+    recent = store.get_items("recent_durations", nodeids)
+    store.update_items("recent_durations", {
+        nodeid: (recent.get(nodeid, []) + [duration])[-DURATION_WINDOW:]
+        for nodeid, duration in zip(nodeids, durations.round(3).tolist())
+    })
+
+
+class TimeLimit:
+    """Fail the running test by SIGALRM if it does not finish
+    within seconds, no limit if seconds is None.
+    """
+    def __init__(self, seconds: float | None) -> None:
+        self.seconds = seconds
+        self.expired = False
+        self.previous = None
+
+    def handler(self, signum, frame) -> None:
+        self.expired = True
+        pytest.fail(
+            f"pytest-ranking: test did not finish within {self.seconds:.1f}s,"
+            + " see `--rank-timeout`.",
+            pytrace=False)
+
+    def __enter__(self) -> TimeLimit:
+        if self.seconds is not None:
+            self.previous = signal.signal(signal.SIGALRM, self.handler)
+            signal.setitimer(signal.ITIMER_REAL, self.seconds)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.seconds is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self.previous)
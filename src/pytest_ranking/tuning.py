@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import itertools
+from typing import Iterable
+
+import numpy as np
+
+from .bandit import ThompsonSampler
+from .change_tracker import tokenize
+from .const import DEFAULT_NORMALIZATION
+from .cost import cost_cognizant_priority, failure_probability
+from .features import BUILTIN_FEATURES
+from .model import FailurePredictor
+from .rank import NORMALIZATIONS
+
+DEFAULT_GRID = (0, 1, 2, 4)
+
+
+def get_weight_grid(values: Iterable[float]) -> tuple[list[str], np.ndarray]:
+    """Get all combinations of weights of the built-in heuristics,
+    skipping random order and combinations equal after normalization.
+    Return names in `--rank-weight` format and a (3, k) weight matrix.
+    """
+    names = []
+    columns = []
+    seen = set()
+    for combo in itertools.product(values, repeat=len(BUILTIN_FEATURES)):
+        total = sum(combo)
+        if total == 0:
+            continue
+        normalized = tuple(round(w / total, 6) for w in combo)
+        if normalized in seen:
+            continue
+        seen.add(normalized)
+        names.append("-".join(f"{w:g}" for w in combo))
+        columns.append([w / total for w in combo])
+    return names, np.array(columns).T
+
+
+def evaluate_orders(
+        orders: np.ndarray,
+        failed: np.ndarray,
+        durations: np.ndarray) -> dict[str, np.ndarray] | None:
+    """Compute APFD, cost-cognizant APFD (APFDc) and time to first failure
+    of test orders, where each failing test is regarded as one fault.
+        - orders: (n, k) test indices in execution order per configuration
+    Return None if no test failed.
+    """
+    num_tests, num_fail = len(failed), int(failed.sum())
+    if num_fail == 0:
+        return None
+    fail = failed[orders]
+    cost = durations[orders]
+    position = np.arange(1, num_tests + 1)[:, None]
+    apfd = (
+        1 - (fail * position).sum(axis=0) / (num_tests * num_fail)
+        + 1 / (2 * num_tests)
+    )
+    elapsed = np.cumsum(cost, axis=0)
+    total = elapsed[-1]
+    if total[0] > 0:
+        # Cost of tests from each fault-revealing test till the end.
+        remaining = total - elapsed + cost / 2
+        apfdc = (fail * remaining).sum(axis=0) / (total * num_fail)
+    else:
+        apfdc = apfd
+    first_fail = np.argmax(fail, axis=0)
+    ttff = elapsed[first_fail, np.arange(orders.shape[1])]
+    return {"apfd": apfd, "apfdc": apfdc, "ttff": ttff}
+
+
+class ReplayState:
+    """Heuristic data of tests reconstructed from recorded runs,
+    the same way as the plugin updates its cache after each run.
+    """
+    def __init__(
+            self,
+            hist_len: int,
+            normalize: tuple[str, dict[str, str]] = (
+                DEFAULT_NORMALIZATION, {})) -> None:
+        self.hist_len = hist_len
+        self.normalize = normalize
+        self.last_durations = {}
+        self.num_runs_since_fail = {}
+
+    def get_features(self, run: dict) -> np.ndarray:
+        """Normalized heuristic values (n, 3) of tests in a run."""
+        nodeids = run["nodeids"]
+        delta = set()
+        for path in run["changed_files"]:
+            delta.update(tokenize(path))
+        h_time = [self.last_durations.get(x, 0) for x in nodeids]
+        h_fail = [self.num_runs_since_fail.get(x, 0) for x in nodeids]
+        h_rel = [len(delta.intersection(tokenize(x))) for x in nodeids]
+        default, normalizations = self.normalize
+        h_time, h_fail, h_rel = (
+            NORMALIZATIONS[normalizations.get(name, default)](values)
+            for name, values in zip(BUILTIN_FEATURES, (h_time, h_fail, h_rel))
+        )
+        return np.column_stack([1 - h_time, 1 - h_fail, h_rel])
+
+    def get_cost_priority(self, run: dict) -> np.ndarray:
+        """Failure probability per recorded second of tests in a run,
+        same as `--rank-strategy=cost` without setup and teardown time.
+        """
+        nodeids = run["nodeids"]
+        delta = set()
+        for path in run["changed_files"]:
+            delta.update(tokenize(path))
+        probability = failure_probability(
+            [self.num_runs_since_fail.get(x, 0) for x in nodeids],
+            [len(delta.intersection(tokenize(x))) for x in nodeids])
+        return cost_cognizant_priority(
+            probability, [self.last_durations.get(x, 0) for x in nodeids])
+
+    def update(self, run: dict) -> None:
+        for nodeid, failed, duration in zip(
+                run["nodeids"], run["failed"], run["durations"]):
+            self.last_durations[nodeid] = duration
+            if failed:
+                self.num_runs_since_fail[nodeid] = 0
+            else:
+                self.num_runs_since_fail[nodeid] = min(
+                    self.hist_len,
+                    self.num_runs_since_fail.get(nodeid, 0) + 1
+                )
+
+
+def order_by_priority(priority: np.ndarray) -> np.ndarray:
+    """Test indices by descending priority, ties keep recorded order."""
+    return np.argsort(-priority, axis=0, kind="stable")
+
+
+def replay(
+        runs: Iterable[dict],
+        grid: Iterable[float] = DEFAULT_GRID,
+        hist_len: int = 50,
+        seed: int = 0,
+        normalize: tuple[str, dict[str, str]] = (
+            DEFAULT_NORMALIZATION, {})) -> list[dict]:
+    """Replay recorded runs through all strategies and weight combinations.
+    Return mean metrics per configuration over runs with failures.
+    """
+    weight_names, weight_matrix = get_weight_grid(grid)
+    names = (
+        ["recorded", "random"]
+        + [f"hybrid:{name}" for name in weight_names]
+        + ["learned", "bandit", "cost"]
+    )
+    totals = {
+        metric: np.zeros(len(names)) for metric in ("apfd", "apfdc", "ttff")
+    }
+    num_runs = 0
+    state = ReplayState(hist_len, normalize)
+    model = FailurePredictor(BUILTIN_FEATURES, [1, 0, 0])
+    bandit = ThompsonSampler({})
+    rng = np.random.default_rng(seed)
+    for run in runs:
+        num_tests = len(run["nodeids"])
+        if num_tests == 0:
+            continue
+        failed = np.array(run["failed"], dtype=bool)
+        durations = np.array(run["durations"], dtype=float)
+        features = state.get_features(run)
+
+        recorded = np.arange(num_tests)[:, None]
+        random_order = rng.permutation(num_tests)[:, None]
+        hybrid = order_by_priority(features @ weight_matrix)
+        learned = order_by_priority(model.predict(features))[:, None]
+        sampled = order_by_priority(bandit.sample(run["nodeids"], seed))
+        cost = order_by_priority(state.get_cost_priority(run))[:, None]
+        orders = np.hstack(
+            [recorded, random_order, hybrid, learned, sampled[:, None], cost]
+        )
+
+        metrics = evaluate_orders(orders, failed, durations)
+        if metrics is not None:
+            num_runs += 1
+            for metric, values in metrics.items():
+                totals[metric] += values
+
+        # Learn from the run as the plugin does after each run.
+        state.update(run)
+        model.update(features, failed)
+        bandit.update([run["nodeids"][i] for i in sampled], failed[sampled])
+
+    if num_runs == 0:
+        return []
+    results = []
+    for i, name in enumerate(names):
+        results.append({
+            "config": name,
+            "runs": num_runs,
+            "apfd": round(float(totals["apfd"][i] / num_runs), 4),
+            "apfdc": round(float(totals["apfdc"][i] / num_runs), 4),
+            "ttff": round(float(totals["ttff"][i] / num_runs), 3),
+        })
+    results.sort(key=lambda x: (-x["apfdc"], x["ttff"]))
+    return results
+
+
+def recommend(results: list[dict]) -> str | None:
+    """Get pytest options of the best configuration by APFDc."""
+    for result in results:
+        config = result["config"]
+        if config.startswith("hybrid:"):
+            return f"--rank-weight={config.split(':')[1]}"
+        if config in ("learned", "bandit", "cost"):
+            return f"--rank-strategy={config}"
+    return None
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import pytest
+from xdist.scheduler import LoadScheduling
+from xdist.workermanage import WorkerController
+
+from .resources import CPU_BOUND_RATIO
+
+# Number of pending tests to look at for tests that fit the budget.
+LOOKAHEAD = 1000
+
+
+class ResourceAwareScheduling(LoadScheduling):
+    """Load scheduling of pytest-xdist that holds back tests, in order,
+    as long as sending them to a worker would exceed the memory budget
+    or the number of CPUs. Tests sent to a worker run one after another,
+    so a worker reserves the peak memory of its most memory-heavy test,
+    and a CPU if any of its tests is CPU-bound.
+    """
+    def __init__(
+            self,
+            config: pytest.Config,
+            log,
+            peak_rss: dict[str, float],
+            cpu_ratios: dict[str, float],
+            max_memory: float,
+            num_cpus: int) -> None:
+        super().__init__(config, log)
+        self.peak_rss = peak_rss
+        self.cpu_ratios = cpu_ratios
+        self.max_memory = max_memory
+        self.num_cpus = num_cpus
+
+    def get_memory(self, index: int) -> float:
+        return self.peak_rss.get(self.collection[index], 0.0)
+
+    def is_cpu_bound(self, index: int) -> bool:
+        ratio = self.cpu_ratios.get(self.collection[index], 0.0)
+        return ratio >= CPU_BOUND_RATIO
+
+    def get_reserved(self, node: WorkerController) -> tuple[float, bool]:
+        """Reserved memory and CPU of tests sent to a worker."""
+        pending = self.node2pending[node]
+        memory = max((self.get_memory(x) for x in pending), default=0.0)
+        return memory, any(self.is_cpu_bound(x) for x in pending)
+
+    def _send_tests(self, node: WorkerController, num: int) -> None:
+        memory, cpu_bound = self.get_reserved(node)
+        other_memory, other_cpus = 0.0, 0
+        for other in self.nodes:
+            if other is not node:
+                reserved = self.get_reserved(other)
+                other_memory += reserved[0]
+                other_cpus += reserved[1]
+        selected = []
+        for index in self.pending[:LOOKAHEAD]:
+            if len(selected) >= num:
+                break
+            new_memory = max(memory, self.get_memory(index))
+            if other_memory and other_memory + new_memory > self.max_memory:
+                continue
+            new_cpu_bound = self.is_cpu_bound(index)
+            if (
+                new_cpu_bound
+                and not cpu_bound
+                and other_cpus >= self.num_cpus
+            ):
+                continue
+            selected.append(index)
+            memory = new_memory
+            cpu_bound = cpu_bound or new_cpu_bound
+        if len(self.node2pending[node]) + len(selected) == 1:
+            # A worker only runs its last test after receiving another one,
+            # send the next test regardless of the budget.
+            rest = [x for x in self.pending if x not in selected]
+            selected.extend(rest[:1])
+        if selected:
+            sent = set(selected)
+            self.pending[:] = [x for x in self.pending if x not in sent]
+            self.node2pending[node].extend(selected)
+            node.send_runtest_some(selected)
+
+    def mark_test_complete(
+            self,
+            node: WorkerController,
+            item_index: int,
+            duration: float = 0) -> None:
+        super().mark_test_complete(node, item_index, duration)
+        # Other workers may wait for the released memory and CPU.
+        for other in self.nodes:
+            if other is not node and len(self.node2pending[other]) < 2:
+                self.check_schedule(other)
@@ -1,7 +1,17 @@
 from __future__ import annotations
 
+import gzip
+import json
+import os
+import pstats
+import shutil
+import signal
+import sqlite3
+import sys
 import textwrap
+import time
 
+import numpy as np
 import pytest
 
 test_method_one = \
@@ -927,6 +937,37 @@ def test_replay(mytester):
     )
 
 
+def test_replay_groups(mytester):
+    mytester.makepyfile(
+        test_method_one=test_method_one,
+        test_class_one=test_class_one,
+    )
+    # Record durations.
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=4, failed=2)
+
+    # Tests of a listed group and unlisted tests are ordered by duration.
+    with gzip.open(mytester.path.joinpath("order.txt.gz"), "wt") as f:
+        f.write("test_method_one.py::test_medium\n")
+        f.write("test_class_one.py::TestClassSample::\n")
+        f.write("test_method_one.py::test_medium\n")
+    args = ["-v", "--rank", "--rank-replay=order.txt.gz"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=4, failed=2)
+    out.stdout.fnmatch_lines(
+        [
+            "test_method_one.py::test_medium PASSED",
+            "test_class_one.py::TestClassSample::test_fast PASSED",
+            "test_class_one.py::TestClassSample::test_medium PASSED",
+            "test_class_one.py::TestClassSample::test_slow_fail FAILED",
+            "test_method_one.py::test_fast_fail FAILED",
+            "test_method_one.py::test_slow PASSED",
+        ],
+        consecutive=True
+    )
+    out.stdout.fnmatch_lines(["Number of tests not listed in replay file: 2"])
+
+
 def test_replay_with_random(mytester):
     mytester.makepyfile(
         test_method_one=test_method_one,
@@ -960,3 +1001,1601 @@ def test_invalid_replay(mytester):
         + " File provided to `--rank-replay` cannot be read." \
         + " Please run `pytest --help` for instruction."
     assert len([x for x in out.errlines if x.startswith(error_msg)]) == 1
+
+
+def test_profile(mytester):
+    mytester.makepyfile(
+        test_put_one=test_put_one,
+    )
+
+    args = [
+        "-v",
+        "--rank",
+        "--rank-profile=profile.json",
+        "--rank-profile-pstats=profile.pstats",
+    ]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=11)
+    log_text = (
+        "Using --rank-profile=profile.json",
+        "Using --rank-profile-pstats=profile.pstats",
+    )
+    assert len([x for x in out.outlines if x.startswith(log_text)]) == 2
+
+    profile = json.loads(mytester.path.joinpath("profile.json").read_text())
+    assert set(profile["phases_ns"]) == {
+        "discovery", "hashing", "cache_load", "similarity",
+        "scoring", "grouping", "sorting", "persistence",
+    }
+    assert profile["counters"]["items_ranked"] == 11
+    assert profile["counters"]["files_scanned"] >= 1
+    assert profile["counters"]["cache_bytes_written"] > 0
+    assert mytester.path.joinpath("profile.pstats").exists()
+    pstats.Stats(str(mytester.path.joinpath("profile.pstats")))
+
+
+def test_warm(mytester):
+    mytester.makepyfile(
+        test_method_one=test_method_one,
+    )
+    args = ["-v", "--rank"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+
+    # Change a file, and make all files look older than the racy window.
+    mytester.makepyfile(source_method_one=source_method_one)
+    for path in mytester.path.glob("*.py"):
+        os.utime(path, (time.time() - 60, time.time() - 60))
+
+    result = mytester.run(
+        sys.executable, "-m", "pytest_ranking", "warm",
+        "--rootdir", str(mytester.path),
+    )
+    assert result.ret == 0
+    result.stdout.fnmatch_lines(["Indexed 2 Python files (2 re-hashed)*"])
+
+    # Pytest run reuses the index and still detects the change.
+    args = ["-v", "--rank", "--rank-profile=profile.json"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(["Number of changed Python files: 1"])
+    profile = json.loads(mytester.path.joinpath("profile.json").read_text())
+    assert profile["counters"].get("files_hashed", 0) == 0
+
+
+slow_change_tracker = \
+    """
+    import time
+
+    from pytest_ranking.change_tracker import changeTracker
+
+    get_all_file_paths = changeTracker.get_all_file_paths
+
+    def slow_get_all_file_paths(self):
+        time.sleep(3)
+        return get_all_file_paths(self)
+
+    changeTracker.get_all_file_paths = slow_get_all_file_paths
+    """
+
+
+failing_change_tracker = \
+    """
+    from pytest_ranking.change_tracker import changeTracker
+
+    def failing_get_all_file_paths(self):
+        raise RuntimeError("cannot list files")
+
+    changeTracker.get_all_file_paths = failing_get_all_file_paths
+    """
+
+
+def test_change_tracker_timeout(mytester):
+    mytester.makepyfile(
+        test_method_one=test_method_one,
+    )
+    args = ["-v", "--rank"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+
+    # Proceed without change information if detection is too slow.
+    mytester.makepyfile(source_method_one=source_method_one)
+    mytester.makeconftest(slow_change_tracker)
+    args = ["-v", "--rank", "--rank-change-timeout=0.5"]
+    out = mytester.runpytest_subprocess(*args)
+    out.assert_outcomes(passed=2, failed=1, warnings=1)
+    out.stdout.fnmatch_lines([
+        "*detecting changed files did not finish within 0.5s*",
+    ])
+    out.stdout.fnmatch_lines(["Number of changed Python files: 0"])
+
+    # The abandoned changes are detected in the next run.
+    mytester.path.joinpath("conftest.py").unlink()
+    args = ["-v", "--rank"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(["Number of changed Python files: 1"])
+
+
+def test_change_tracker_error(mytester):
+    mytester.makepyfile(
+        test_method_one=test_method_one,
+    )
+    mytester.makeconftest(failing_change_tracker)
+    args = ["-v", "--rank"]
+    out = mytester.runpytest_subprocess(*args)
+    assert out.ret != 0
+    assert len([x for x in out.outlines if "cannot list files" in x]) >= 1
+
+
+test_learned = \
+    """
+    import time
+
+    def test_a_fast():
+        time.sleep(0.01)
+
+    def test_b_medium():
+        time.sleep(0.1)
+
+    # FAIL
+    def test_c_slow_fail():
+        time.sleep(0.2)
+        assert False
+    """
+
+
+def test_learned_strategy(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+
+    # Run without RTP.
+    args = ["-v"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+
+    # Untrained model follows --rank-weight.
+    args = ["-v", "--rank", "--rank-strategy=learned"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(["Using --rank-strategy=learned"])
+    out.stdout.fnmatch_lines(
+        [
+            "test_learned.py::test_a_fast PASSED",
+            "test_learned.py::test_b_medium PASSED",
+            "test_learned.py::test_c_slow_fail FAILED",
+        ],
+        consecutive=True
+    )
+
+    # Model learns that the failing test fails.
+    for _ in range(2):
+        out = mytester.runpytest(*args)
+        out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "test_learned.py::test_c_slow_fail FAILED",
+        ]
+    )
+    assert [x for x in out.outlines if "::" in x][0].startswith(
+        "test_learned.py::test_c_slow_fail")
+
+    model = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "failure_model")
+    assert json.loads(model.read_text())["num_updates"] == 3
+    assert len(json.loads(model.read_text())["weights"]) == 3
+
+    # Trained once per session on results of all pytest-xdist workers.
+    out = mytester.runpytest(*args, "-p", "xdist", "-n", "2")
+    out.assert_outcomes(passed=2, failed=1)
+    assert json.loads(model.read_text())["num_updates"] == 4
+
+
+def test_invalid_strategy(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+    args = ["-v", "--rank", "--rank-strategy=unknown"]
+    out = mytester.runpytest(*args)
+    error_msg = "error: argument --rank-strategy:" \
+        + " Invalid input for `--rank-strategy`."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_bandit_strategy(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+
+    args = ["-v", "--rank", "--rank-strategy=bandit"]
+    for _ in range(4):
+        out = mytester.runpytest(*args)
+        out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(["Using --rank-strategy=bandit"])
+    # Failing test is rewarded and run first.
+    assert [x for x in out.outlines if "::" in x][0].startswith(
+        "test_learned.py::test_c_slow_fail")
+
+    state = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "bandit_state")
+    state = json.loads(state.read_text())
+    assert state["num_updates"] == 4
+    assert len(state["nodeids"]) == len(state["alpha"]) == 3
+
+    # Same seed gives the same order on all pytest-xdist workers.
+    args = ["-v", "--rank", "--rank-strategy=bandit", "-n", "2"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    assert len([x for x in out.outlines if "Different tests" in x]) == 0
+
+    # All arms are updated once, with results of all workers.
+    before = {
+        x: (a, b)
+        for x, a, b in zip(state["nodeids"], state["alpha"], state["beta"])
+    }
+    state = json.loads(mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "bandit_state"
+    ).read_text())
+    assert state["num_updates"] == 5
+    assert all(
+        (a, b) != before[x]
+        for x, a, b in zip(state["nodeids"], state["alpha"], state["beta"])
+    )
+
+
+feature_conftest = \
+    """
+    import numpy as np
+
+    from pytest_ranking import FeatureProvider
+
+    def target(items, store):
+        assert store is None
+        return np.array([item.name == "test_c_slow_fail" for item in items])
+
+    def unused(items, store):
+        raise AssertionError("unweighted heuristic is computed")
+
+    def pytest_ranking_features(config):
+        return [
+            FeatureProvider("target", target),
+            FeatureProvider("unused", unused, needs_history=True),
+        ]
+    """
+
+
+def test_feature_provider(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+    mytester.makeconftest(feature_conftest)
+
+    # Run without RTP.
+    args = ["-v"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+
+    # Weight heuristic from conftest by name.
+    args = ["-v", "--rank", "--rank-weight=time:1,target:2"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "test_learned.py::test_c_slow_fail FAILED",
+            "test_learned.py::test_a_fast PASSED",
+            "test_learned.py::test_b_medium PASSED",
+        ],
+        consecutive=True
+    )
+
+    # Built-in heuristics by name.
+    args = ["-v", "--rank", "--rank-weight=time:1,target:0"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "test_learned.py::test_a_fast PASSED",
+            "test_learned.py::test_b_medium PASSED",
+            "test_learned.py::test_c_slow_fail FAILED",
+        ],
+        consecutive=True
+    )
+
+    # Unknown heuristic.
+    args = ["-v", "--rank", "--rank-weight=time:1,nope:1"]
+    out = mytester.runpytest(*args)
+    assert out.ret != 0
+    error_msg = "unknown heuristic in `--rank-weight`: nope."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_invalid_named_weight(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+    args = ["-v", "--rank", "--rank-weight=time:1,time:2"]
+    out = mytester.runpytest(*args)
+    error_msg = "error: argument --rank-weight:" \
+        + " Cannot parse input for `--rank-weight`."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_history_and_tune(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+
+    args = ["-v", "--rank", "--rank-history=2"]
+    for _ in range(3):
+        out = mytester.runpytest(*args)
+        out.assert_outcomes(passed=2, failed=1)
+
+    # Three runs are kept in two segments.
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    old_runs = data_dir.joinpath("history.jsonl.1").read_text().splitlines()
+    runs = data_dir.joinpath("history.jsonl").read_text().splitlines()
+    assert (len(old_runs), len(runs)) == (2, 1)
+    run = json.loads(runs[0])
+    assert run["failed"] == [0, 0, 1]
+    assert run["nodeids"][2] == "test_learned.py::test_c_slow_fail"
+
+    result = mytester.run(
+        sys.executable, "-m", "pytest_ranking", "tune",
+        "--rootdir", str(mytester.path), "--json", "tune.json",
+    )
+    assert result.ret == 0
+    result.stdout.fnmatch_lines([
+        "Evaluated on 3 runs with failures.",
+        "Recommended: --rank-*",
+    ])
+    results = json.loads(mytester.path.joinpath("tune.json").read_text())
+    results = {x["config"]: x for x in results}
+    # Recorded order runs the failing test last.
+    assert results["recorded"]["apfd"] == pytest.approx(1 / 6, abs=1e-4)
+    # Recent failure runs it first after the first run.
+    assert results["hybrid:0-1-0"]["apfd"] == pytest.approx(
+        (1 / 6 + 5 / 6 + 5 / 6) / 3, abs=1e-4)
+    assert "cost" in results
+
+
+def test_evaluate_orders():
+    from pytest_ranking.tuning import evaluate_orders
+
+    failed = np.array([False, True, False])
+    durations = np.array([1.0, 2.0, 3.0])
+    orders = np.array([[0, 1], [1, 0], [2, 2]])
+    metrics = evaluate_orders(orders, failed, durations)
+    assert metrics["apfd"] == pytest.approx([1 - 2 / 3 + 1 / 6, 5 / 6])
+    assert metrics["apfdc"] == pytest.approx([(5 - 1) / 6, (6 - 1) / 6])
+    assert metrics["ttff"] == pytest.approx([3, 2])
+    assert evaluate_orders(orders, ~np.ones(3, dtype=bool), durations) is None
+
+
+def test_sqlite_store(mytester):
+    mytester.makepyfile(
+        test_learned=test_learned,
+    )
+
+    # Data of JSON store is migrated.
+    args = ["-v", "--rank"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+
+    args = ["-v", "--rank", "--rank-store=sqlite", "--rank-weight=0-1-0"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(
+        [
+            "test_learned.py::test_c_slow_fail FAILED",
+            "test_learned.py::test_a_fast PASSED",
+            "test_learned.py::test_b_medium PASSED",
+        ],
+        consecutive=True
+    )
+
+    # Partial run only updates data of executed tests.
+    args = ["-v", "--rank", "--rank-store=sqlite", "-k", "test_a_fast"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=1)
+
+    db = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "ranking.sqlite3")
+    conn = sqlite3.connect(str(db))
+    rows = dict(conn.execute(
+        "SELECT key, value FROM items WHERE name = 'num_runs_since_fail'"
+    ).fetchall())
+    # Group stats are stored per group.
+    stats = dict(conn.execute(
+        "SELECT key, value FROM items"
+        " WHERE name = 'groups/num_runs_since_fail'"
+    ).fetchall())
+    conn.close()
+    assert rows == {
+        "test_learned.py::test_a_fast": "3",
+        "test_learned.py::test_b_medium": "2",
+        "test_learned.py::test_c_slow_fail": "0",
+    }
+    assert stats[""] == stats["test_learned.py"] == "[5.0,3]"
+    assert stats["test_learned.py::test_a_fast"] == "[3.0,1]"
+
+
+def test_partitioned_store(mytester):
+    mytester.makepyfile(test_learned=test_learned)
+    for pkg in ("pkg_a", "pkg_a/sub", "pkg_b"):
+        mytester.mkdir(pkg)
+        name = pkg.replace("/", "_")
+        mytester.path.joinpath(pkg, f"test_{name}.py").write_text(
+            "def test_x():\n    pass\n")
+
+    # Data of JSON store is migrated.
+    out = mytester.runpytest("-v", "--rank")
+    out.assert_outcomes(passed=5, failed=1)
+    args = ["-v", "--rank", "--rank-store=partitioned", "--rank-weight=0-1-0"]
+    out = mytester.runpytest(*args, "test_learned.py")
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(
+        ["test_learned.py::test_c_slow_fail FAILED"], consecutive=True)
+
+    # Partial run only writes partitions of executed tests,
+    # which are the folders of test modules.
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "partitions")
+    runs_dir = data_dir.joinpath("num_runs_since_fail")
+    stats_dir = data_dir.joinpath("groups", "num_runs_since_fail")
+    before = runs_dir.joinpath("pkg_b.json").read_text()
+    stats_before = stats_dir.joinpath("pkg_b.json").read_text()
+    out = mytester.runpytest(*args, "pkg_a/sub")
+    out.assert_outcomes(passed=1)
+    assert sorted(x.name for x in runs_dir.iterdir()) == [
+        ".json", "pkg_a%2Fsub.json", "pkg_a.json", "pkg_b.json"]
+    assert json.loads(runs_dir.joinpath("pkg_a%2Fsub.json").read_text()) == {
+        "pkg_a/sub/test_pkg_a_sub.py::test_x": 2}
+    assert runs_dir.joinpath("pkg_b.json").read_text() == before
+    # Group stats are partitioned the same way.
+    assert stats_dir.joinpath("pkg_b.json").read_text() == stats_before
+
+    # Partitions are by top-level folder with depth 1.
+    out = mytester.runpytest(*args, "--rank-partition-depth=1", "pkg_a")
+    out.assert_outcomes(passed=2)
+    assert "Using --rank-partition-depth=1" in out.outlines
+    assert sorted(x.name for x in runs_dir.iterdir()) == [
+        ".json", "pkg_a.json", "pkg_b.json"]
+    assert json.loads(runs_dir.joinpath("pkg_a.json").read_text()) == {
+        "pkg_a/test_pkg_a.py::test_x": 2,
+        "pkg_a/sub/test_pkg_a_sub.py::test_x": 3,
+    }
+
+    # File keys are absolute paths, partitioned relative to the rootdir.
+    out = mytester.runpytest(
+        "--rank", "--rank-store=partitioned", "--rank-partition-depth=0")
+    out.assert_outcomes(passed=5, failed=1)
+    hashes_dir = data_dir.joinpath("file_hashes")
+    assert sorted(x.name for x in hashes_dir.iterdir()) == [
+        ".json", "pkg_a%2Fsub.json", "pkg_a.json", "pkg_b.json"]
+    hashes = json.loads(hashes_dir.joinpath("pkg_b.json").read_text())
+    assert list(hashes) == [
+        str(mytester.path.joinpath("pkg_b", "test_pkg_b.py"))]
+
+    out = mytester.runpytest("--rank-partition-depth=-1")
+    error_msg = "error: argument --rank-partition-depth:" \
+        + " Invalid input for `--rank-partition-depth`."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_get_partition():
+    from pytest_ranking.store import get_partition
+
+    assert get_partition("a/b/test_x.py::C::test_f", 0) == "a/b"
+    assert get_partition("test_x.py::test_f", 0) == ""
+    # Absolute keys are relative to the rootdir.
+    assert get_partition("/repo/src/pkg/mod.py", 0, "/repo") == "src/pkg"
+    assert get_partition("/repo/src/pkg/mod.py", 1, "/repo/") == "src"
+    assert get_partition("/repo/mod.py", 1, "/repo") == ""
+    # Keys outside the rootdir keep their folders.
+    assert get_partition("/usr/lib/mod.py", 1, "/repo") == "usr"
+    assert get_partition("/repo2/mod.py", 0, "/repo") == "repo2"
+    # Windows paths are split at backslashes.
+    assert get_partition("C:\\repo\\src\\mod.py", 0, "C:\\repo") == "src"
+    assert get_partition("D:\\lib\\mod.py", 0, "C:\\repo") == "lib"
+
+
+def test_merge(mytester):
+    shards = {
+        "shard1": {
+            "last_durations": {"t.py::a": 1.0, "t.py::b": 2.0},
+            "num_runs_since_fail": {"t.py::a": 3, "t.py::b": 0},
+        },
+        "shard2": {
+            "last_durations": {"t.py::a": 5.0, "t.py::c": 3.0},
+            "num_runs_since_fail": {"t.py::a": 1, "t.py::b": 4},
+        },
+    }
+    for i, (shard, data) in enumerate(shards.items()):
+        data_dir = mytester.path.joinpath(shard, "v", "pytest_ranking_data")
+        data_dir.mkdir(parents=True)
+        for name, values in data.items():
+            path = data_dir.joinpath(name)
+            path.write_text(json.dumps(values))
+            # The second shard is newer.
+            os.utime(path, (1000 + i, 1000 + i))
+
+    for store in ("json", "sqlite"):
+        result = mytester.run(
+            sys.executable, "-m", "pytest_ranking", "merge",
+            "shard2", "shard1", "-o", f"merged_{store}", "--store", store,
+        )
+        assert result.ret == 0
+        result.stdout.fnmatch_lines([
+            "last_durations: 3",
+            "num_runs_since_fail: 2",
+            "Merged 2 caches into *",
+        ])
+
+    data_dir = mytester.path.joinpath(
+        "merged_json", "v", "pytest_ranking_data")
+    durations = json.loads(data_dir.joinpath("last_durations").read_text())
+    # Newest value wins.
+    assert durations == {"t.py::a": 5.0, "t.py::b": 2.0, "t.py::c": 3.0}
+    num_runs = json.loads(data_dir.joinpath("num_runs_since_fail").read_text())
+    # Recent failure wins.
+    assert num_runs == {"t.py::a": 1, "t.py::b": 0}
+
+    data_dir = mytester.path.joinpath(
+        "merged_sqlite", "v", "pytest_ranking_data")
+    conn = sqlite3.connect(data_dir.joinpath("ranking.sqlite3"))
+    rows = conn.execute(
+        "SELECT key, value FROM items WHERE name = 'num_runs_since_fail'"
+    ).fetchall()
+    conn.close()
+    assert dict(rows) == {"t.py::a": "1", "t.py::b": "0"}
+    # Input caches are not modified.
+    assert not mytester.path.joinpath(
+        "shard1", "v", "pytest_ranking_data", "ranking.sqlite3").exists()
+
+
+def test_merge_shards(mytester):
+    mytester.makepyfile(
+        test_m="""
+        import os
+        import time
+
+        def test_a():
+            time.sleep(0.3 if os.path.exists("slow") else 0)
+
+        def test_b():
+            assert not os.path.exists("fail")
+        """,
+    )
+    mytester.runpytest().assert_outcomes(passed=2)
+    for shard in ("shard1", "shard2"):
+        shutil.copytree(
+            mytester.path.joinpath(".pytest_cache"),
+            mytester.path.joinpath(shard))
+
+    # Each shard only runs and changes data of its own tests.
+    mytester.path.joinpath("slow").touch()
+    out = mytester.runpytest("-k", "test_a", "-o", "cache_dir=shard1")
+    out.assert_outcomes(passed=1)
+    mytester.path.joinpath("fail").touch()
+    out = mytester.runpytest("-k", "test_b", "-o", "cache_dir=shard2")
+    out.assert_outcomes(failed=1, deselected=1)
+
+    result = mytester.run(
+        sys.executable, "-m", "pytest_ranking", "merge",
+        "shard1", "shard2", "-o", ".pytest_cache",
+    )
+    assert result.ret == 0
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    num_runs = json.loads(data_dir.joinpath("num_runs_since_fail").read_text())
+    assert num_runs == {"test_m.py::test_a": 2, "test_m.py::test_b": 0}
+    # The newer shard did not change the duration of test_a.
+    durations = json.loads(data_dir.joinpath("last_durations").read_text())
+    assert durations["test_m.py::test_a"] >= 0.3
+
+
+def test_merge_environment(mytester):
+    mytester.makepyfile(
+        test_m="""
+        import os
+        import time
+
+        def test_a():
+            time.sleep(0.3 if os.path.exists("slow") else 0)
+
+        def test_b():
+            pass
+        """,
+    )
+    args = ["--rank", "--rank-env=myenv"]
+    for store in ("json", "sqlite", "partitioned"):
+        cache_dir = f"base_{store}"
+        store_args = [*args, f"--rank-store={store}"]
+        out = mytester.runpytest(*store_args, "-o", f"cache_dir={cache_dir}")
+        out.assert_outcomes(passed=2)
+        shutil.copytree(
+            mytester.path.joinpath(cache_dir),
+            mytester.path.joinpath(f"shard_{store}"))
+        mytester.path.joinpath("slow").touch()
+        out = mytester.runpytest(
+            *store_args, "-k", "test_a", "-o", f"cache_dir=shard_{store}")
+        out.assert_outcomes(passed=1)
+        mytester.path.joinpath("slow").unlink()
+
+        result = mytester.run(
+            sys.executable, "-m", "pytest_ranking", "merge",
+            f"shard_{store}", "-o", cache_dir, "--store", store,
+        )
+        assert result.ret == 0
+        result.stdout.fnmatch_lines(["env/myenv/last_durations: 2"])
+
+        # Data of the environment are merged, not only pooled data.
+        from pytest_ranking.environment import EnvironmentStore
+        from pytest_ranking.estimate import GroupEstimator
+        from pytest_ranking.profiler import Profiler
+        from pytest_ranking.store import DirCache, open_store
+
+        base = open_store(
+            store, DirCache(str(mytester.path.joinpath(cache_dir))),
+            Profiler())
+        env_store = EnvironmentStore(base, "myenv")
+        durations = base.get_items("env/myenv/last_durations")
+        assert durations["test_m.py::test_a"] >= 0.3
+        assert durations["test_m.py::test_b"] < 0.3
+        estimator = GroupEstimator.from_store(
+            env_store, "last_durations", ["test_m.py::test_c"])
+        assert estimator.estimate("test_m.py::test_c") >= 0.15
+        base.close()
+
+
+def test_shard(mytester):
+    mytester.makepyfile(
+        test_put_one=test_put_one,
+    )
+    out = mytester.runpytest("-v", "--rank")
+    out.assert_outcomes(passed=11)
+
+    # Shards of a CI run start from the same cache.
+    cache = mytester.path.joinpath(".pytest_cache")
+    shutil.copytree(cache, mytester.path.joinpath("cache_copy"))
+
+    def restore_cache():
+        shutil.rmtree(cache)
+        shutil.copytree(mytester.path.joinpath("cache_copy"), cache)
+
+    shards = []
+    for shard in ("1/3", "2/3", "3/3"):
+        restore_cache()
+        out = mytester.runpytest("-v", "--rank", f"--rank-shard={shard}")
+        assert f"Using --rank-shard={shard}" in out.outlines
+        executed = [x.split(" ")[0] for x in out.outlines if "PASSED" in x]
+        assert len(executed) in (3, 4)
+        out.stdout.fnmatch_lines([f"Number of tests in shard {shard}: *"])
+        shards.append(executed)
+    # Shards are disjoint and cover all tests.
+    all_tests = [x for executed in shards for x in executed]
+    assert len(set(all_tests)) == len(all_tests) == 11
+
+    # The same cache gives the same shards.
+    restore_cache()
+    out = mytester.runpytest("-v", "--rank", "--rank-shard=2/3")
+    assert [x.split(" ")[0] for x in out.outlines if "PASSED" in x] \
+        == shards[1]
+
+
+def test_invalid_shard(mytester):
+    mytester.makepyfile(
+        test_put_one=test_put_one,
+    )
+    for shard in ("0/2", "3/2", "1", "a/b"):
+        out = mytester.runpytest("-v", "--rank", f"--rank-shard={shard}")
+        error_msg = "error: argument --rank-shard:" \
+            + " Invalid input for `--rank-shard`."
+        assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_assign_shards():
+    from pytest_ranking.rank import assign_shards
+
+    # The first tests are spread round-robin.
+    assert assign_shards([1, 1, 1, 1], 2) == [0, 1, 0, 1]
+    # Shards are balanced by duration.
+    assert assign_shards([4, 1, 1, 1, 1], 2) == [0, 1, 1, 1, 1]
+    # Unknown durations are predicted by the mean.
+    assert assign_shards([2, None, 1, 1], 2) == [0, 1, 1, 0]
+    # Same number of tests if durations are unknown.
+    assert assign_shards([None] * 5, 3) == [0, 1, 2, 0, 1]
+
+
+killed_session = \
+    """
+    import os
+
+    def test_a_pass():
+        pass
+
+    # FAIL
+    def test_b_fail():
+        assert False
+
+    def test_c_killed():
+        os._exit(1)
+    """
+
+
+def test_checkpoint_recovery(mytester):
+    mytester.makepyfile(
+        test_killed=killed_session,
+    )
+    mytester.makeconftest(
+        """
+        import pytest_ranking.results
+
+        pytest_ranking.results.CHECKPOINT_TESTS = 1
+        """
+    )
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+
+    # The session is killed before it can save the results.
+    out = mytester.runpytest_subprocess("-v")
+    assert out.ret == 1
+    [checkpoint] = data_dir.glob("results-*.jsonl")
+    lines = checkpoint.read_text().splitlines()
+    assert [json.loads(x)[:2] for x in lines] == [
+        ["test_killed.py::test_a_pass", 0],
+        ["test_killed.py::test_b_fail", 1],
+    ]
+    assert not data_dir.joinpath("num_runs_since_fail").exists()
+
+    # Checkpoints of running sessions are not recovered.
+    from pytest_ranking.store import fcntl, try_lock
+    if fcntl is not None:
+        with open(checkpoint, "a") as f:
+            assert try_lock(f)
+            out = mytester.runpytest("-v", "--rank", "--collect-only")
+        assert "Number of tests recovered" not in out.stdout.str()
+        assert checkpoint.exists()
+
+    # The next session saves the checkpointed results.
+    out = mytester.runpytest("-v", "--rank", "--collect-only")
+    out.stdout.fnmatch_lines([
+        "Number of tests recovered from interrupted run: 2",
+    ])
+    assert not list(data_dir.glob("results*.jsonl"))
+    num_runs = json.loads(data_dir.joinpath("num_runs_since_fail").read_text())
+    assert num_runs == {
+        "test_killed.py::test_a_pass": 1,
+        "test_killed.py::test_b_fail": 0,
+    }
+
+
+test_adaptive = \
+    """
+    import time
+
+    import pytest
+
+    # FAIL at delay 0
+    @pytest.mark.parametrize("delay", [0, 0.3])
+    def test_a(delay):
+        time.sleep(delay)
+        assert delay
+
+    def test_b():
+        time.sleep(0.1)
+
+    def test_c():
+        time.sleep(0.15)
+    """
+
+
+def test_adaptive_ranking(mytester):
+    mytester.makepyfile(
+        test_adaptive=test_adaptive,
+    )
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=3, failed=1)
+
+    # The slow test of the same function is run later without failures.
+    out = mytester.runpytest("-v", "--rank")
+    out.stdout.fnmatch_lines(
+        [
+            "test_adaptive.py::test_a[0] FAILED",
+            "test_adaptive.py::test_b PASSED",
+            "test_adaptive.py::test_c PASSED",
+            "test_adaptive.py::test_a[0.3] PASSED",
+        ],
+        consecutive=True
+    )
+
+    # The failure promotes the slow test of the same function
+    # after the test that was already scheduled next.
+    out = mytester.runpytest("-v", "--rank", "--rank-adaptive")
+    out.assert_outcomes(passed=3, failed=1)
+    assert "Using --rank-adaptive" in out.outlines
+    out.stdout.fnmatch_lines(
+        [
+            "test_adaptive.py::test_a[0] FAILED",
+            "test_adaptive.py::test_b PASSED",
+            "test_adaptive.py::test_a[0.3] PASSED",
+            "test_adaptive.py::test_c PASSED",
+        ],
+        consecutive=True
+    )
+    out.stdout.fnmatch_lines([
+        "Number of tests promoted after failures: 1",
+    ])
+
+
+def test_adaptive_change_tokens():
+    from types import SimpleNamespace
+
+    from pytest_ranking.change_tracker import get_change_tokens
+    from pytest_ranking.cofailure import CoFailureGraph
+    from pytest_ranking.const import LEVEL
+    from pytest_ranking.scheduler import AdaptiveScheduler
+
+    nodeids = [
+        "ta/test_alpha.py::test_a",
+        "tb/test_beta.py::test_b",
+        "ta/test_alpha.py::test_c",
+    ]
+    # Tokens shared by all tests relate a changed file to no test.
+    tokens = get_change_tokens(["ta/alpha.py", "tests/conftest.py"], nodeids)
+    assert tokens == {"ta", "alpha", "tests", "conftest"}
+
+    # Only tests related to the changed files of a failure are promoted.
+    scheduler = AdaptiveScheduler(
+        [SimpleNamespace(nodeid=x) for x in nodeids],
+        LEVEL.FUNCTION,
+        tokens,
+        CoFailureGraph({}))
+    assert scheduler.pop().nodeid == "ta/test_alpha.py::test_a"
+    scheduler.on_failure("ta/test_alpha.py::test_a")
+    assert scheduler.num_promoted == 1
+    assert scheduler.pop().nodeid == "ta/test_alpha.py::test_c"
+    assert scheduler.pop().nodeid == "tb/test_beta.py::test_b"
+
+
+test_cofail = \
+    """
+    import os
+
+    def test_a_pass():
+        pass
+
+    # FAIL
+    def test_b_fail():
+        assert not os.path.exists("broken")
+
+    def test_c_pass():
+        pass
+
+    # FAIL
+    def test_d_fail():
+        assert not os.path.exists("broken")
+    """
+
+
+def test_cofailure(mytester):
+    mytester.makepyfile(
+        test_cofail=test_cofail,
+    )
+    mytester.path.joinpath("broken").touch()
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=2, failed=2)
+
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    graph = json.loads(data_dir.joinpath("cofailure_graph").read_text())
+    assert graph == {
+        "nodeids": [
+            "test_cofail.py::test_b_fail",
+            "test_cofail.py::test_d_fail",
+        ],
+        "indptr": [0, 1, 2],
+        "indices": [1, 0],
+        "weights": [1.0, 1.0],
+    }
+
+    # Tests that failed together with recently failed tests run first.
+    mytester.path.joinpath("broken").unlink()
+    out = mytester.runpytest("-v", "--rank", "--rank-weight=cofail:1")
+    out.assert_outcomes(passed=4)
+    out.stdout.fnmatch_lines(
+        [
+            "test_cofail.py::test_b_fail PASSED",
+            "test_cofail.py::test_d_fail PASSED",
+            "test_cofail.py::test_a_pass PASSED",
+            "test_cofail.py::test_c_pass PASSED",
+        ],
+        consecutive=True
+    )
+    # Co-failures only decay in runs with failures.
+    graph = json.loads(data_dir.joinpath("cofailure_graph").read_text())
+    assert graph["weights"] == [1.0, 1.0]
+
+    # Co-failures are recorded once per session with pytest-xdist.
+    mytester.path.joinpath("broken").touch()
+    out = mytester.runpytest("-p", "xdist", "-n", "2")
+    out.assert_outcomes(passed=2, failed=2)
+    graph = json.loads(data_dir.joinpath("cofailure_graph").read_text())
+    assert graph["weights"] == [pytest.approx(1.9)] * 2
+
+
+def test_fixture_aware(mytester):
+    fixture = """
+        import time
+
+        import pytest
+
+        @pytest.fixture(scope="module")
+        def resource():
+            time.sleep(0.3)
+            yield
+            time.sleep(0.05)
+
+        """
+    mytester.makepyfile(
+        test_m1=fixture + """
+        def test_a(resource):
+            pass
+
+        def test_b(resource):
+            time.sleep(0.15)
+        """,
+        test_m2=fixture + """
+        def test_c(resource):
+            time.sleep(0.05)
+
+        def test_d(resource):
+            time.sleep(0.1)
+        """,
+    )
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=4)
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    costs = json.loads(data_dir.joinpath("fixture_costs").read_text())
+    assert set(costs) == {"test_m1.py::resource", "test_m2.py::resource"}
+    assert costs["test_m1.py::resource"] >= 0.35
+
+    # Faster tests first set up the fixture of test_m1.py twice.
+    out = mytester.runpytest("-v", "--rank")
+    out.stdout.fnmatch_lines(
+        [
+            "test_m1.py::test_a PASSED",
+            "test_m2.py::test_c PASSED",
+            "test_m2.py::test_d PASSED",
+            "test_m1.py::test_b PASSED",
+        ],
+        consecutive=True
+    )
+
+    # Delaying test_c by test_b is cheaper than the fixture setup.
+    out = mytester.runpytest("-v", "--rank", "--rank-fixture-aware")
+    assert "Using --rank-fixture-aware" in out.outlines
+    out.stdout.fnmatch_lines(
+        [
+            "test_m1.py::test_a PASSED",
+            "test_m1.py::test_b PASSED",
+            "test_m2.py::test_c PASSED",
+            "test_m2.py::test_d PASSED",
+        ],
+        consecutive=True
+    )
+    out.stdout.fnmatch_lines([
+        "Estimated fixture setup overhead (s): 0.0",
+        "Estimated fixture setup overhead avoided (s): 0.3*",
+    ])
+
+
+def test_estimate_overhead():
+    from pytest_ranking.fixture_cost import (estimate_overhead,
+                                             reduce_fixture_churn)
+
+    chains = [["m1"], ["m2"], ["m1"], ["m2", "m2::C"], ["m2"]]
+    node_costs = {"m1": 1.0, "m2": 2.0, "m2::C": 0.5}
+    assert estimate_overhead(chains, node_costs) == 3.0
+    # Delays of the next test are limited by the saved fixture cost.
+    durations = [0.4] * 5
+    order = reduce_fixture_churn(chains, node_costs, durations)
+    assert order == [0, 2, 1, 3, 4]
+    assert estimate_overhead([chains[i] for i in order], node_costs) == 0
+    chains = [["m1"], ["m2"], ["m1"], ["m1"], ["m1"]]
+    order = reduce_fixture_churn(chains, {"m1": 1.0}, [0.6] * 5)
+    assert order == [0, 2, 3, 1, 4]
+
+
+test_resources = \
+    """
+    import time
+
+    def test_memory():
+        data = bytearray(100 * 2**20)
+        time.sleep(0.3)
+        del data
+
+    def test_cpu():
+        end = time.perf_counter() + 0.2
+        while time.perf_counter() < end:
+            pass
+
+    def test_io():
+        time.sleep(0.2)
+    """
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Needs /proc/self/statm")
+def test_resource_usage(mytester):
+    mytester.makepyfile(
+        test_resources=test_resources,
+    )
+    # Usage is not measured if it is not used.
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=3)
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    assert not data_dir.joinpath("peak_rss").exists()
+
+    args = ["-v", "--rank", "--rank-profile=profile.json"]
+    out = mytester.runpytest(*args, "-p", "xdist", "-n", "2")
+    out.assert_outcomes(passed=3)
+    peak_rss = json.loads(data_dir.joinpath("peak_rss").read_text())
+    assert peak_rss["test_resources.py::test_memory"] >= 90
+    assert peak_rss["test_resources.py::test_io"] < 10
+    cpu_ratios = json.loads(data_dir.joinpath("cpu_ratios").read_text())
+    # CPU-bound tests may share the CPU with other processes.
+    assert cpu_ratios["test_resources.py::test_io"] < 0.1
+    assert cpu_ratios["test_resources.py::test_cpu"] \
+        > cpu_ratios["test_resources.py::test_io"]
+
+    # Tests using less memory run first.
+    out = mytester.runpytest(*args, "--rank-weight=memory:1")
+    out.stdout.fnmatch_lines(
+        [
+            "test_resources.py::test_*PASSED",
+            "test_resources.py::test_*PASSED",
+            "test_resources.py::test_memory PASSED",
+        ],
+        consecutive=True
+    )
+
+    # Resetting the peak of each test keeps the peak of the whole run,
+    # here with test_memory run first.
+    out = mytester.runpytest(
+        "-v", "--rank-max-memory=1000", "--rank-profile=profile.json")
+    out.stdout.fnmatch_lines(["test_resources.py::test_memory PASSED"])
+    profile = json.loads(mytester.path.joinpath("profile.json").read_text())
+    assert profile["peak_rss_bytes"] >= 100 * 2**20
+
+
+test_memory_heavy = \
+    """
+    import time
+
+    import pytest
+
+    @pytest.mark.parametrize("i", range(4))
+    def test_memory(i):
+        data = bytearray(100 * 2**20)
+        with open(f"memory_{i}.log", "w") as f:
+            f.write(f"{time.time()} ")
+            time.sleep(0.5)
+            f.write(f"{time.time()}")
+        del data
+    """
+
+
+@pytest.mark.skipif(
+    not sys.platform.startswith("linux"), reason="Needs /proc/self/statm")
+def test_max_memory(mytester):
+    mytester.makepyfile(
+        test_memory_heavy=test_memory_heavy,
+    )
+    args = ["-v", "-p", "xdist", "-n", "2", "--rank", "--rank-max-memory=150"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=4)
+
+    # Tests of unknown memory usage run at the same time.
+    def get_intervals():
+        intervals = []
+        for i in range(4):
+            log = mytester.path.joinpath(f"memory_{i}.log").read_text()
+            intervals.append(sorted(float(x) for x in log.split()))
+        return sorted(intervals)
+
+    intervals = get_intervals()
+    assert any(a[1] > b[0] for a, b in zip(intervals, intervals[1:]))
+
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=4)
+    assert "Using --rank-max-memory=150" in out.outlines
+    intervals = get_intervals()
+    assert all(a[1] <= b[0] for a, b in zip(intervals, intervals[1:]))
+
+
+def test_new_test_estimate(mytester):
+    new_tests = """
+        import time
+
+        import pytest
+
+        def test_fast():
+            pass
+
+        @pytest.mark.parametrize("i", range({}))
+        def test_slow(i):
+            time.sleep(0.2)
+        """
+    mytester.makepyfile(test_new=new_tests.format(2))
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=3)
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    stats_dir = data_dir.joinpath("groups")
+    stats = json.loads(stats_dir.joinpath("last_durations").read_text())
+    assert stats["test_new.py::test_slow"][1] == 2
+    stats = json.loads(stats_dir.joinpath("num_runs_since_fail").read_text())
+    assert stats[""] == [3, 3]
+
+    # A new parametrization is as slow as the other ones.
+    mytester.makepyfile(test_new=new_tests.format(3))
+    out = mytester.runpytest("-v", "--rank")
+    out.assert_outcomes(passed=4)
+    out.stdout.fnmatch_lines(
+        [
+            "test_new.py::test_fast PASSED",
+            "test_new.py::test_slow*",
+        ],
+        consecutive=True
+    )
+    stats = json.loads(stats_dir.joinpath("last_durations").read_text())
+    assert stats["test_new.py::test_slow"][1] == 3
+
+    # New tests can still be run first.
+    mytester.makepyfile(test_new=new_tests.format(4))
+    out = mytester.runpytest("-v", "--rank", "--rank-novelty=2")
+    assert "Using --rank-novelty=2" in out.outlines
+    out.stdout.fnmatch_lines(
+        [
+            "test_new.py::test_slow[3] PASSED",
+            "test_new.py::test_fast PASSED",
+        ],
+        consecutive=True
+    )
+    out.stdout.fnmatch_lines(["Number of new tests boosted: 1"])
+
+
+def test_xdist_group_stats(mytester):
+    mytester.makepyfile(
+        test_a_method=test_a_method,
+        test_b_class=test_b_class,
+    )
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    for _ in range(3):
+        mytester.runpytest("-p", "xdist", "-n", "2", "--rank")
+    # Group stats are updated once per session, by the controller.
+    stats_dir = data_dir.joinpath("groups")
+    last_durations = json.loads(
+        data_dir.joinpath("last_durations").read_text())
+    stats = json.loads(stats_dir.joinpath("last_durations").read_text())
+    total, count = stats[""]
+    assert count == len(last_durations)
+    assert total == pytest.approx(sum(last_durations.values()))
+    num_runs_since_fail = json.loads(
+        data_dir.joinpath("num_runs_since_fail").read_text())
+    assert sorted(num_runs_since_fail.values()) == [0, 0, 3, 3, 3, 3]
+    stats = json.loads(stats_dir.joinpath("num_runs_since_fail").read_text())
+    assert stats[""] == [12, 6]
+
+
+def test_get_test_groups():
+    from pytest_ranking.rank import get_test_groups
+
+    assert get_test_groups("a/b/test_x.py::TestC::test_f[1]") == [
+        "a/b/test_x.py::TestC::test_f",
+        "a/b/test_x.py::TestC",
+        "a/b/test_x.py",
+        "a/b",
+        "a",
+        "",
+    ]
+    assert get_test_groups("test_x.py::test_f") == [
+        "test_x.py::test_f", "test_x.py", ""]
+
+
+def test_normalize(mytester):
+    mytester.makepyfile(
+        test_put_one=test_put_one,
+    )
+    out = mytester.runpytest("-v", "--rank", "--rank-normalize=rank,fail:log")
+    out.assert_outcomes(passed=11)
+    assert "Using --rank-normalize=rank,fail:log" in out.outlines
+
+    for normalize in ("zscore", "time:rank,time:log", "rank,log", ":rank"):
+        out = mytester.runpytest(
+            "-v", "--rank", f"--rank-normalize={normalize}")
+        error_msg = "error: argument --rank-normalize:" \
+            + " Invalid input for `--rank-normalize`."
+        assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_normalizations():
+    from pytest_ranking.rank import NORMALIZATIONS
+
+    durations = [0.1, 0.2, 0.2, 0.3, 900]
+    minmax = NORMALIZATIONS["minmax"](durations)
+    # An outlier compresses the other durations to about 0.
+    assert minmax[3] < 0.001
+    assert NORMALIZATIONS["rank"](durations).tolist() \
+        == [0, 0.375, 0.375, 0.75, 1]
+    assert NORMALIZATIONS["log"](durations)[3] > 0.01
+    # Outliers are clipped.
+    assert NORMALIZATIONS["robust"](durations).tolist() \
+        == pytest.approx([0, 0.25, 0.25, 0.5, 1])
+    for normalize in NORMALIZATIONS.values():
+        assert normalize([1, 1]).tolist() == [0, 0]
+
+
+def test_cost_strategy(mytester):
+    mytester.makepyfile(
+        test_cost="""
+        import time
+
+        def test_a_fast():
+            time.sleep(0.01)
+
+        # FAIL
+        def test_b_medium_fail():
+            time.sleep(0.05)
+            assert False
+
+        def test_c_slow():
+            time.sleep(0.5)
+        """,
+    )
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=2, failed=1)
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    costs = json.loads(data_dir.joinpath("last_costs").read_text())
+    durations = json.loads(data_dir.joinpath("last_durations").read_text())
+    assert all(costs[x] >= durations[x] for x in durations)
+
+    # A recent failure alone runs first by the weighted sum.
+    args = ["-v", "--rank", "--rank-weight=time:1,fail:1"]
+    out = mytester.runpytest(*args)
+    assert [x for x in out.outlines if "::" in x][0].startswith(
+        "test_cost.py::test_b_medium_fail")
+
+    # A much cheaper test runs first by failure probability per second.
+    out = mytester.runpytest(*args, "--rank-strategy=cost")
+    out.assert_outcomes(passed=2, failed=1)
+    out.stdout.fnmatch_lines(["Using --rank-strategy=cost"])
+    out.stdout.fnmatch_lines(
+        [
+            "test_cost.py::test_a_fast PASSED",
+            "test_cost.py::test_b_medium_fail FAILED",
+            "test_cost.py::test_c_slow PASSED",
+        ],
+        consecutive=True
+    )
+
+
+def test_failure_probability():
+    from pytest_ranking.cost import (cost_cognizant_priority,
+                                     failure_probability)
+
+    probability = failure_probability([0, 2, 2], [0, 0, 1])
+    assert probability.tolist() == pytest.approx([0.5, 0.25, 0.325])
+    priority = cost_cognizant_priority(probability, [1.0, 0.1, 0.0])
+    assert priority.tolist() == pytest.approx([0.5, 2.5, 32.5])
+
+
+def test_pending_changes(mytester):
+    mytester.makepyfile(
+        test_a="""
+        def test_a():
+            pass
+        """,
+        test_b="""
+        def test_b():
+            pass
+        """,
+    )
+    out = mytester.runpytest("-v")
+    out.assert_outcomes(passed=2)
+
+    # A change whose tests are deselected stays pending.
+    mytester.makepyfile(test_b="""
+        def test_b():
+            assert True
+        """)
+    out = mytester.runpytest("-v", "-k", "test_a")
+    out.assert_outcomes(passed=1)
+    pending = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "pending_changes")
+    assert json.loads(pending.read_text()) == {"test_b.py": 0}
+
+    # Its tests are still related to changes in the next run.
+    out = mytester.runpytest("-v", "--rank", "--rank-weight=0-0-1")
+    out.assert_outcomes(passed=2)
+    out.stdout.fnmatch_lines(["Number of changed Python files: 0"])
+    out.stdout.fnmatch_lines(
+        [
+            "test_b.py::test_b PASSED",
+            "test_a.py::test_a PASSED",
+        ],
+        consecutive=True
+    )
+    # All related tests have run.
+    assert json.loads(pending.read_text()) == {}
+
+
+def test_pending_changes_partial(mytester, monkeypatch):
+    from pytest_ranking.store import PartitionedStore
+
+    for pkg, name in (("ta", "alpha"), ("tb", "beta")):
+        mytester.mkdir(pkg)
+        mytester.path.joinpath(pkg, f"{name}.py").write_text("X = 1\n")
+        mytester.path.joinpath(pkg, f"test_{name}.py").write_text(
+            f"def test_{name}():\n    pass\n\n\n"
+            + f"def test_{name}_more():\n    pass\n")
+    args = ["-v", "--rank", "--rank-store=partitioned"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=4)
+    pending = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data", "pending_changes")
+    assert json.loads(pending.read_text()) == {}
+
+    # A run of other folders does not resolve a change,
+    # and does not read test data of the other folders.
+    loaded = []
+    load_partition = PartitionedStore.load_partition
+
+    def record_partition(self, name, partition):
+        loaded.append((name, partition))
+        return load_partition(self, name, partition)
+
+    monkeypatch.setattr(PartitionedStore, "load_partition", record_partition)
+    mytester.path.joinpath("tb", "beta.py").write_text("X = 2\n")
+    out = mytester.runpytest(*args, "ta")
+    out.assert_outcomes(passed=2)
+    assert json.loads(pending.read_text()) == {"tb/beta.py": 0}
+    assert ("last_durations", "ta") in loaded
+    # Only change tracking may read data of all files.
+    assert not [
+        x for x in loaded
+        if x[1] == "tb" and x[0] not in ("file_index", "file_hashes")
+    ]
+
+    # Tests deselected by pytest-xdist workers do not resolve it.
+    out = mytester.runpytest(
+        *args, "-p", "xdist", "-n", "2", "-k", "more")
+    out.assert_outcomes(passed=2)
+    assert json.loads(pending.read_text()) == {"tb/beta.py": 1}
+
+    # Tests run by pytest-xdist workers resolve it.
+    out = mytester.runpytest(*args, "-p", "xdist", "-n", "2")
+    out.assert_outcomes(passed=4)
+    assert json.loads(pending.read_text()) == {}
+
+
+def test_pending_changes_resolve():
+    from pytest_ranking.change_tracker import PENDING_RUNS, PendingChanges
+
+    pending = PendingChanges({})
+    pending.add_run(["src/a.py", "src/b.py"])
+    assert pending.get_token_weights() == {"src": 1, "a": 1, "b": 1, "py": 1}
+    collected = ["tests/test_a.py::test_a", "tests/test_b.py::test_b"]
+    pending.resolve(collected, {"tests/test_a.py::test_a"})
+    assert pending.to_dict() == {"src/b.py": 0}
+    for _ in range(PENDING_RUNS):
+        pending.add_run([])
+    assert pending.to_dict() == {"src/b.py": PENDING_RUNS}
+    pending.add_run([])
+    assert pending.to_dict() == {}
+
+    # Known tests that were not collected have not been executed.
+    pending = PendingChanges({"src/b.py": 0})
+    pending.resolve(
+        collected[1:],
+        {"tests/test_b.py::test_b"},
+        known=["tests/test_b.py::test_b2", "tests/test_c.py::test_c"])
+    assert pending.to_dict() == {"src/b.py": 0}
+    pending.resolve(collected[1:], {"tests/test_b.py::test_b"}, collected)
+    assert pending.to_dict() == {}
+
+
+@pytest.mark.skipif(
+    not hasattr(signal, "setitimer"), reason="Needs SIGALRM")
+def test_timeout(mytester):
+    mytester.makepyfile(
+        test_hang="""
+        import os
+        import time
+
+        def test_fast():
+            pass
+
+        def test_hang():
+            time.sleep(30 if os.path.exists("hang") else 0.1)
+        """,
+    )
+    args = ["-v", "--rank", "--rank-timeout=5", "--rank-timeout-min=0.5"]
+    out = mytester.runpytest(*args)
+    out.assert_outcomes(passed=2)
+    assert "Using --rank-timeout=5 --rank-timeout-min=0.5" in out.outlines
+    out.stdout.fnmatch_lines(["Number of tests timed out: 0"])
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    recent = json.loads(data_dir.joinpath("recent_durations").read_text())
+    assert len(recent["test_hang.py::test_hang"]) == 1
+
+    # A hanging test fails after its predicted timeout.
+    mytester.path.joinpath("hang").touch()
+    for extra_args in ([], ["-p", "xdist", "-n", "2"]):
+        start_time = time.perf_counter()
+        out = mytester.runpytest(*args, *extra_args)
+        assert time.perf_counter() - start_time < 20
+        out.assert_outcomes(passed=1, failed=1)
+        out.stdout.fnmatch_lines([
+            "*pytest-ranking: test did not finish within *s*",
+            "Number of tests timed out: 1",
+        ])
+    # Timed out durations are not recorded.
+    recent = json.loads(data_dir.joinpath("recent_durations").read_text())
+    assert len(recent["test_hang.py::test_hang"]) == 1
+    assert len(recent["test_hang.py::test_fast"]) == 3
+
+    out = mytester.runpytest("-v", "--rank-timeout=0")
+    error_msg = "error: argument --rank-timeout:" \
+        + " Invalid input for `--rank-timeout`."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+    # Invalid ini values are rejected as well, a zero minimum is not.
+    for ini, option in (
+            ("rank_timeout=0", "--rank-timeout"),
+            ("rank_timeout=-1", "--rank-timeout"),
+            ("rank_timeout_min=-1", "--rank-timeout-min")):
+        out = mytester.runpytest("-v", "--rank", "-o", ini)
+        assert out.ret == pytest.ExitCode.USAGE_ERROR
+        error_msg = f"Invalid input for `{option}`."
+        assert len([x for x in out.errlines if error_msg in x]) == 1
+    mytester.path.joinpath("hang").unlink()
+    out = mytester.runpytest(
+        "-v", "--rank", "-o", "rank_timeout=5", "-o", "rank_timeout_min=0")
+    out.assert_outcomes(passed=2)
+    assert "Using --rank-timeout=5 --rank-timeout-min=0" in out.outlines
+
+
+def test_regression(mytester):
+    mytester.makepyfile(
+        test_regress="""
+        import os
+        import time
+
+        def test_stable():
+            pass
+
+        def test_regress():
+            time.sleep(1 if os.path.exists("slow") else 0.1)
+        """,
+    )
+    args = ["-v", "--rank-regression=5"]
+    for _ in range(3):
+        out = mytester.runpytest(*args)
+        out.assert_outcomes(passed=2)
+        out.stdout.fnmatch_lines([
+            "*pytest-ranking duration regressions*",
+            "No test duration regressed.",
+        ])
+
+    # A test that takes much longer than its recent durations is reported.
+    mytester.path.joinpath("slow").touch()
+    for extra_args in ([], ["-p", "xdist", "-n", "2"]):
+        out = mytester.runpytest(
+            *args, *extra_args, "--rank-regression-report=regressions.json")
+        out.assert_outcomes(passed=2)
+        out.stdout.fnmatch_lines([
+            "*pytest-ranking duration regressions*",
+            "*s (median *s, *x) test_regress.py::test_regress",
+        ])
+        report = json.loads(
+            mytester.path.joinpath("regressions.json").read_text())
+        assert report["threshold"] == 5
+        assert [x["nodeid"] for x in report["regressions"]] == [
+            "test_regress.py::test_regress"]
+
+    out = mytester.runpytest("-v", "--rank-regression=-1")
+    error_msg = "error: argument --rank-regression:" \
+        + " Invalid input for `--rank-regression`."
+    assert len([x for x in out.errlines if error_msg in x]) == 1
+
+
+def test_environment(mytester, monkeypatch):
+    mytester.makepyfile(
+        test_env="""
+        import os
+        import time
+
+        def test_a():
+            time.sleep(0.5 if os.environ["RANK_MODE"] == "a" else 0)
+
+        def test_b():
+            time.sleep(0.5 if os.environ["RANK_MODE"] == "b" else 0)
+        """,
+    )
+    args = ["-v", "--rank", "--rank-env=python,env:RANK_MODE"]
+    for mode in ("a", "b"):
+        monkeypatch.setenv("RANK_MODE", mode)
+        out = mytester.runpytest(*args)
+        out.assert_outcomes(passed=2)
+    version = "py{}.{}".format(*sys.version_info[:2])
+    assert f"Using --rank-env=python,env:RANK_MODE ({version}-b)" \
+        in out.outlines
+
+    # Durations of the environment are used, not of the last run.
+    monkeypatch.setenv("RANK_MODE", "a")
+    out = mytester.runpytest(*args)
+    out.stdout.fnmatch_lines(
+        ["test_env.py::test_b PASSED", "test_env.py::test_a PASSED"],
+        consecutive=True)
+    data_dir = mytester.path.joinpath(
+        ".pytest_cache", "v", "pytest_ranking_data")
+    assert data_dir.joinpath("env", f"{version}-a", "last_durations").exists()
+
+    # A new environment uses pooled durations, updated by the last run.
+    monkeypatch.setenv("RANK_MODE", "c")
+    out = mytester.runpytest(*args)
+    out.stdout.fnmatch_lines(
+        ["test_env.py::test_b PASSED", "test_env.py::test_a PASSED"],
+        consecutive=True)
+    pooled = json.loads(data_dir.joinpath("last_durations").read_text())
+    env = json.loads(
+        data_dir.joinpath("env", f"{version}-c", "last_durations").read_text())
+    assert pooled == env
+
+
+def test_concurrent_store(tmp_path):
+    from pytest_ranking.profiler import Profiler
+    from pytest_ranking.store import DirCache, fcntl, open_store
+
+    for kind in ("json", "partitioned"):
+        cache_dir = str(tmp_path / kind)
+        first = open_store(kind, DirCache(cache_dir), Profiler())
+        second = open_store(kind, DirCache(cache_dir), Profiler())
+        first.update_items("last_durations", {"a/t.py::x": 1.0})
+
+        # Updates of another process since the last read are kept.
+        assert second.get_items("last_durations") == {"a/t.py::x": 1.0}
+        first.update_items(
+            "last_durations", {"a/t.py::y": 2.0, "b/t.py::x": 3.0})
+        second.update_items(
+            "last_durations", {"a/t.py::x": 4.0}, removed=["b/t.py::x"])
+        assert open_store(kind, DirCache(cache_dir), Profiler()).get_items(
+            "last_durations") == {"a/t.py::x": 4.0, "a/t.py::y": 2.0}
+        # Values are updated from their current value.
+        for store in (first, second):
+            store.update("counter", 0, lambda x: x + 1)
+        assert first.get("counter", 0) == 2
+        data_dir = os.path.join(cache_dir, "v", "pytest_ranking_data")
+        assert not [
+            x for _, _, files in os.walk(data_dir)
+            for x in files if x.startswith(".tmp-")
+        ]
+
+    # A process waits for the lock held by another one, up to a timeout.
+    if fcntl is None:
+        return
+    second.file_lock.timeout = 0.2
+    with first.file_lock:
+        start_time = time.perf_counter()
+        with second.file_lock:
+            assert time.perf_counter() - start_time >= 0.2